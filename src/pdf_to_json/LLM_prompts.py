@@ -113,6 +113,18 @@ class LLMPrompts:
         """
         return prompt
 
+    @staticmethod
+    def pdf_to_json_retry_prompt(problems):
+        """Prompt for converting PDF text to intermediary JSON again, after output with problems."""
+        problem_list = "\n".join(f"        - {problem}" for problem in problems)
+        prompt = LLMPrompts.pdf_to_json_prompt() + f"""
+        Your previous output for this PDF had these problems:
+{problem_list}
+
+        Make sure your output does not have them.
+        """
+        return prompt
+
     @staticmethod
     def fix_malformed_json_prompt(text):
             """Prompt for converting PDF text to intermediary JSON."""
@@ -0,0 +1,220 @@
+""" Admission control for conversion requests.
+
+Every conversion request (an upload, a batch or a directory run) must be
+admitted before it starts. A request takes as many slots as files it
+processes at once, and runs only if both the global cap and its API key's
+cap have room; each Gemini API key has its own quota, so one busy key does
+not starve the others. Requests that cannot run yet wait in a bounded FIFO
+queue. When the queue is full, or a request has waited too long, it is
+rejected at once with a Retry-After estimate rather than piling up, so the
+latency of admitted requests stays predictable under overload.
+"""
+
+import asyncio
+import collections
+import hashlib
+import math
+import os
+import threading
+import time
+
+MAX_RUNNING_SLOTS = int(os.environ.get("MAX_RUNNING_CONVERSIONS", 8))
+MAX_RUNNING_SLOTS_PER_KEY = int(os.environ.get("MAX_RUNNING_CONVERSIONS_PER_KEY", 4))
+MAX_QUEUED_REQUESTS = int(os.environ.get("MAX_QUEUED_CONVERSIONS", 16))
+QUEUE_TIMEOUT_SECONDS = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT_SECONDS", 60))
+
+# Assumed duration of a conversion until some have completed.
+_INITIAL_DURATION_SECONDS = 30.0
+# Weight of the latest conversion in the moving average of durations.
+_DURATION_SMOOTHING = 0.2
+
+
+class AdmissionRejected(Exception):
+    """ Raised when a request is not admitted. """
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def key_id(api_key):
+    """ Identifies an API key in quotas and metrics without revealing it.
+
+    Requests without a key use the server's key, identified as "default".
+    """
+    if not api_key:
+        return "default"
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+class _Waiter:
+    """ A queued request, woken up by notify() once it is admitted. """
+
+    def __init__(self, key, slots, notify):
+        self.key = key
+        self.slots = slots
+        self.notify = notify
+        self.is_admitted = False
+
+
+class Ticket:
+    """ The slots held by an admitted request. Release them exactly once. """
+
+    def __init__(self, controller, key, slots):
+        self._controller = controller
+        self.key = key
+        self.slots = slots
+        self.started_at = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self._controller._release(self)
+
+
+class AdmissionController:
+    """ Global and per-key caps on running conversions, with a bounded queue.
+
+    Safe to use from threads and, through acquire_async, from an event loop.
+    """
+
+    def __init__(self, max_slots=MAX_RUNNING_SLOTS,
+                 max_slots_per_key=MAX_RUNNING_SLOTS_PER_KEY,
+                 max_queued=MAX_QUEUED_REQUESTS,
+                 queue_timeout=QUEUE_TIMEOUT_SECONDS):
+        self.max_slots = max(1, max_slots)
+        self.max_slots_per_key = max(1, min(max_slots_per_key, self.max_slots))
+        self.max_queued = max(0, max_queued)
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._running_slots = 0
+        self._running_slots_by_key = collections.Counter()
+        self._queue = collections.deque()
+        self._average_duration = _INITIAL_DURATION_SECONDS
+        self._counters = collections.Counter()
+
+    def acquire(self, api_key=None, slots=1):
+        """ Waits until a request may run, or raises AdmissionRejected.
+
+        Args:
+          api_key: The request's Gemini API key, or None for the server's.
+          slots: The number of files the request processes at once. Capped
+            at the per-key limit, so that any request can eventually run.
+
+        Returns:
+          A Ticket; release() it when the request is done.
+        """
+        event = threading.Event()
+        ticket, waiter = self._admit_or_enqueue(api_key, slots, event.set)
+        if ticket is not None:
+            return ticket
+        event.wait(self.queue_timeout)
+        return self._after_wait(waiter)
+
+    async def acquire_async(self, api_key=None, slots=1):
+        """ Async version of acquire, for the async serving mode. """
+        loop = asyncio.get_running_loop()
+        admitted = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(
+                lambda: admitted.done() or admitted.set_result(None))
+
+        ticket, waiter = self._admit_or_enqueue(api_key, slots, notify)
+        if ticket is not None:
+            return ticket
+        try:
+            await asyncio.wait_for(admitted, self.queue_timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # The client went away: give back the slots if they were granted.
+            ticket = self._after_wait(waiter, cancelled=True)
+            if ticket is not None:
+                ticket.release()
+            raise
+        return self._after_wait(waiter)
+
+    def _admit_or_enqueue(self, api_key, slots, notify):
+        key = key_id(api_key)
+        slots = max(1, min(slots, self.max_slots_per_key))
+        with self._lock:
+            if self._can_run_locked(key, slots):
+                return self._start_locked(key, slots), None
+            if len(self._queue) >= self.max_queued:
+                self._counters["rejected_queue_full"] += 1
+                raise AdmissionRejected(
+                    "Too many conversions in progress.",
+                    self._retry_after_locked())
+            waiter = _Waiter(key, slots, notify)
+            self._queue.append(waiter)
+            self._counters["queued"] += 1
+            return None, waiter
+
+    def _after_wait(self, waiter, cancelled=False):
+        with self._lock:
+            if waiter.is_admitted:
+                return Ticket(self, waiter.key, waiter.slots)
+            self._queue.remove(waiter)
+            if cancelled:
+                return None
+            self._counters["rejected_timeout"] += 1
+            raise AdmissionRejected(
+                "Timed out waiting for a free conversion slot.",
+                self._retry_after_locked())
+
+    def _can_run_locked(self, key, slots):
+        return (self._running_slots + slots <= self.max_slots and
+                self._running_slots_by_key[key] + slots <= self.max_slots_per_key)
+
+    def _start_locked(self, key, slots):
+        self._running_slots += slots
+        self._running_slots_by_key[key] += slots
+        self._counters["admitted"] += 1
+        return Ticket(self, key, slots)
+
+    def _release(self, ticket):
+        duration = time.monotonic() - ticket.started_at
+        with self._lock:
+            self._running_slots -= ticket.slots
+            self._running_slots_by_key[ticket.key] -= ticket.slots
+            if self._running_slots_by_key[ticket.key] <= 0:
+                del self._running_slots_by_key[ticket.key]
+            self._counters["completed"] += 1
+            self._average_duration += _DURATION_SMOOTHING * (
+                duration - self._average_duration)
+            # Admit queued requests in order, skipping those whose key is
+            # still at its cap.
+            for waiter in list(self._queue):
+                if self._can_run_locked(waiter.key, waiter.slots):
+                    self._queue.remove(waiter)
+                    self._running_slots += waiter.slots
+                    self._running_slots_by_key[waiter.key] += waiter.slots
+                    self._counters["admitted"] += 1
+                    waiter.is_admitted = True
+                    waiter.notify()
+
+    def _retry_after_locked(self):
+        """ Estimates when a rejected request could be admitted, in seconds. """
+        batches_ahead = (len(self._queue) + 1) / self.max_slots
+        return max(1, math.ceil(self._average_duration * batches_ahead))
+
+    def metrics(self):
+        """ Returns queue depth, running slots and counters, as a dict. """
+        with self._lock:
+            return {
+                "running_slots": self._running_slots,
+                "max_running_slots": self.max_slots,
+                "max_running_slots_per_key": self.max_slots_per_key,
+                "running_slots_by_key": dict(self._running_slots_by_key),
+                "queue_depth": len(self._queue),
+                "max_queue_depth": self.max_queued,
+                "average_duration_seconds": round(self._average_duration, 2),
+                "retry_after_seconds": self._retry_after_locked(),
+                **{name: self._counters[name] for name in (
+                    "admitted", "queued", "completed", "rejected_queue_full",
+                    "rejected_timeout")},
+            }
@@ -0,0 +1,65 @@
+import admission_lib
+import asyncio
+import threading
+import unittest
+
+
+class TestAdmissionController(unittest.TestCase):
+
+    def test_per_key_cap(self):
+        controller = admission_lib.AdmissionController(
+            max_slots=4, max_slots_per_key=2, max_queued=0)
+        controller.acquire('key-a', slots=2)
+        with self.assertRaises(admission_lib.AdmissionRejected) as rejected:
+            controller.acquire('key-a')
+        self.assertGreaterEqual(rejected.exception.retry_after, 1)
+        # Another key still has room.
+        controller.acquire('key-b', slots=2)
+        self.assertEqual(controller.metrics()['running_slots'], 4)
+
+    def test_queued_request_runs_after_release(self):
+        controller = admission_lib.AdmissionController(
+            max_slots=1, max_queued=1, queue_timeout=5)
+        first = controller.acquire()
+        admitted = []
+        waiter = threading.Thread(
+            target=lambda: admitted.append(controller.acquire()))
+        waiter.start()
+        while controller.metrics()['queue_depth'] == 0:
+            pass
+        # The queue is full now.
+        with self.assertRaises(admission_lib.AdmissionRejected):
+            controller.acquire()
+        first.release()
+        waiter.join()
+        self.assertEqual(len(admitted), 1)
+        self.assertEqual(controller.metrics()['rejected_queue_full'], 1)
+
+    def test_queue_timeout(self):
+        controller = admission_lib.AdmissionController(
+            max_slots=1, max_queued=1, queue_timeout=0.05)
+        controller.acquire()
+        with self.assertRaises(admission_lib.AdmissionRejected):
+            controller.acquire()
+        metrics = controller.metrics()
+        self.assertEqual(metrics['queue_depth'], 0)
+        self.assertEqual(metrics['rejected_timeout'], 1)
+
+    def test_async_acquire(self):
+        controller = admission_lib.AdmissionController(
+            max_slots=1, max_queued=4, queue_timeout=5)
+
+        async def run():
+            first = await controller.acquire_async()
+            second = asyncio.create_task(controller.acquire_async())
+            await asyncio.sleep(0.01)
+            self.assertFalse(second.done())
+            first.release()
+            (await second).release()
+
+        asyncio.run(run())
+        self.assertEqual(controller.metrics()['running_slots'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
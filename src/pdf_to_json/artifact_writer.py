@@ -0,0 +1,234 @@
+""" Write-behind persistence of the pipeline's output files.
+
+Every processed PDF leaves three or four JSON files behind (the pdf-extract,
+formated, post-processed and CiviForm JSON). Writing them on the request
+thread adds their disk I/O to the request's latency, although nothing in the
+request reads them back. An ArtifactWriter queues them instead, and a
+background thread writes them in batches.
+
+A queued file is written under a temporary name and renamed into place, so a
+reader never sees a partial file. Code that must not act on a file before it
+is on disk, such as checkpointing a stage in a run manifest, passes a
+callback to when_written(). Until then, read_text() answers from the queue.
+
+Settings, from the environment:
+
+  ARTIFACT_COMPRESS: 1 to gzip the files, which are then named *.json.gz.
+  ARTIFACT_FSYNC: "never" (the default) leaves flushing to the OS, "batch"
+    syncs the files of a batch and their directories once per batch, and
+    "always" syncs every file and its directory as it is written.
+  ARTIFACT_BATCH_SIZE: Files written per batch (default 32).
+  ARTIFACT_MAX_QUEUED: Files queued at most (default 256). Beyond that,
+    write() waits, so that a slow disk slows requests down rather than
+    filling up memory.
+
+The queue is flushed at interpreter exit, see close().
+"""
+
+import atexit
+import collections
+import gzip
+import logging
+import os
+import queue
+import threading
+
+COMPRESS = os.environ.get("ARTIFACT_COMPRESS", "0") == "1"
+FSYNC_POLICIES = ("never", "batch", "always")
+FSYNC = os.environ.get("ARTIFACT_FSYNC", "never")
+BATCH_SIZE = int(os.environ.get("ARTIFACT_BATCH_SIZE", 32))
+MAX_QUEUED = int(os.environ.get("ARTIFACT_MAX_QUEUED", 256))
+
+GZIP_SUFFIX = ".gz"
+
+_Artifact = collections.namedtuple('_Artifact', ['path', 'data'])
+
+
+def read_text(path):
+    """ Reads a file written by an ArtifactWriter, compressed or not. """
+    if path.endswith(GZIP_SUFFIX):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return f.read()
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+class ArtifactWriter:
+    """ Writes text files from a background thread, in batches.
+
+    Safe to share between threads. The thread starts with the first write.
+
+    Args:
+      compress: Whether to gzip the files.
+      fsync: One of FSYNC_POLICIES.
+      batch_size: Files written per batch.
+      max_queued: Files queued at most before write() waits.
+    """
+
+    def __init__(self, compress=COMPRESS, fsync=FSYNC, batch_size=BATCH_SIZE,
+                 max_queued=MAX_QUEUED):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.compress = compress
+        self.fsync = fsync
+        self.batch_size = max(1, batch_size)
+        self._queue = queue.Queue(maxsize=max(1, max_queued))
+        self._lock = threading.Lock()
+        # Queued text by path, for read_text(), and the callbacks waiting
+        # for each path to be written.
+        self._pending = {}
+        self._callbacks = collections.defaultdict(list)
+        self._thread = None
+        self._totals = collections.Counter()
+
+    def output_path(self, path):
+        """ Returns the path a file requested at `path` is written to. """
+        return path + GZIP_SUFFIX if self.compress else path
+
+    def write(self, path, text):
+        """ Queues a text file to be written.
+
+        Args:
+          path: Where to write the file, see output_path().
+          text: Its content.
+
+        Returns:
+          The path the file will be written to.
+        """
+        path = self.output_path(path)
+        self._start()
+        with self._lock:
+            self._pending[path] = text
+            self._totals["queued"] += 1
+        self._queue.put(_Artifact(path, text))
+        return path
+
+    def when_written(self, path, callback):
+        """ Calls callback(path) once the file at `path` is on disk.
+
+        The callback runs right away if no write of that path is queued, and
+        never if the write fails.
+        """
+        with self._lock:
+            if path in self._pending:
+                self._callbacks[path].append(callback)
+                return
+        callback(path)
+
+    def read_text(self, path):
+        """ Reads a file, from the queue if it is not written yet. """
+        with self._lock:
+            text = self._pending.get(path)
+        if text is not None:
+            return text
+        return read_text(path)
+
+    def flush(self):
+        """ Waits until every queued file is written (or failed). """
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        """ Writes the queued files. Registered to run at interpreter exit. """
+        self.flush()
+
+    def metrics(self):
+        """ Returns counts of queued, written and failed files. """
+        with self._lock:
+            return {
+                "compress": self.compress,
+                "fsync": self.fsync,
+                "pending": len(self._pending),
+                **{name: self._totals[name] for name in (
+                    "queued", "written", "failed", "written_bytes",
+                    "batches")},
+            }
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="artifact_writer", daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+            except Exception as e:  # Never let the thread die.
+                logging.error(f"Artifact writer failed: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_batch(self, batch):
+        written = []
+        for artifact in batch:
+            try:
+                size = self._write_file(artifact)
+                written.append((artifact, size))
+            except Exception as e:
+                logging.error(f"Error saving response to file '{artifact.path}': {e}")
+                self._finish(artifact, failed=True)
+        if self.fsync == "batch":
+            for directory in {os.path.dirname(artifact.path)
+                              for (artifact, _) in written}:
+                _fsync_directory(directory)
+        with self._lock:
+            self._totals["batches"] += 1
+            self._totals["written_bytes"] += sum(size for (_, size) in written)
+        for (artifact, _) in written:
+            self._finish(artifact)
+
+    def _write_file(self, artifact):
+        """ Writes one file atomically and returns its size on disk. """
+        data = artifact.data.encode("utf-8")
+        if self.compress:
+            data = gzip.compress(data, compresslevel=6)
+        tmp_path = f"{artifact.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            if self.fsync != "never":
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, artifact.path)
+        if self.fsync == "always":
+            _fsync_directory(os.path.dirname(artifact.path))
+        return len(data)
+
+    def _finish(self, artifact, failed=False):
+        with self._lock:
+            # A later write of the same path may still be queued.
+            if self._pending.get(artifact.path) is artifact.data:
+                del self._pending[artifact.path]
+                callbacks = self._callbacks.pop(artifact.path, [])
+            else:
+                callbacks = []
+            self._totals["failed" if failed else "written"] += 1
+        if failed:
+            return
+        logging.debug(f"Saved: {artifact.path}")
+        for callback in callbacks:
+            try:
+                callback(artifact.path)
+            except Exception as e:
+                logging.error(f"Callback for '{artifact.path}' failed: {e}")
+
+
+def _fsync_directory(directory):
+    try:
+        fd = os.open(directory or ".", os.O_RDONLY)
+    except OSError:
+        return  # E.g. on Windows, where directories cannot be opened.
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,75 @@
+import artifact_writer
+import os
+import tempfile
+import threading
+import unittest
+
+
+class TestArtifactWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp_dir.name, name)
+
+    def test_writes_files_and_runs_callbacks_once_written(self):
+        writer = artifact_writer.ArtifactWriter(fsync="batch", batch_size=2)
+        written = []
+        for i in range(5):
+            path = writer.write(self.path(f"{i}.json"), f'{{"i": {i}}}')
+            writer.when_written(path, written.append)
+        writer.flush()
+
+        self.assertEqual(sorted(written), [self.path(f"{i}.json") for i in range(5)])
+        self.assertEqual(artifact_writer.read_text(self.path("3.json")), '{"i": 3}')
+        self.assertFalse([name for name in os.listdir(self.tmp_dir.name)
+                          if name.endswith(".tmp")])
+        metrics = writer.metrics()
+        self.assertEqual((metrics["written"], metrics["failed"], metrics["pending"]),
+                         (5, 0, 0))
+
+        # A file already on disk runs the callback right away.
+        writer.when_written(self.path("0.json"), written.append)
+        self.assertEqual(len(written), 6)
+
+    def test_queued_files_are_readable_before_they_are_written(self):
+        writer = artifact_writer.ArtifactWriter(compress=True)
+        blocked = threading.Event()
+        release = threading.Event()
+        write_file = writer._write_file
+
+        def slow_write_file(artifact):
+            blocked.set()
+            release.wait()
+            return write_file(artifact)
+
+        writer._write_file = slow_write_file
+        path = writer.write(self.path("a.json"), "queued")
+        self.assertEqual(path, self.path("a.json.gz"))
+        blocked.wait()
+        self.assertEqual(writer.read_text(path), "queued")
+        self.assertFalse(os.path.exists(path))
+
+        release.set()
+        writer.flush()
+        self.assertEqual(artifact_writer.read_text(path), "queued")
+
+    def test_failed_writes_are_counted_and_skip_callbacks(self):
+        writer = artifact_writer.ArtifactWriter()
+        written = []
+        path = writer.write(self.path("missing/a.json"), "{}")
+        writer.when_written(path, written.append)
+        writer.write(self.path("b.json"), "{}")
+        writer.flush()
+
+        self.assertEqual(written, [])
+        self.assertEqual(writer.metrics()["failed"], 1)
+        self.assertEqual(writer.metrics()["written"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,589 @@
+""" Async serving mode for the PDF->CiviForm web app.
+
+Serves the routes of pdf_to_civiform_gemini.py (/upload, /convert_to_civiform,
+/upload_directory, /upload_batch and the job and batch endpoints) with Quart, the asyncio
+implementation of the Flask API. LLM calls are awaited on the async Gemini
+client instead of blocking a worker thread for their whole latency, so one
+process can hold hundreds of conversions in flight. The pipeline itself is
+the sync app's (see pdf_to_civiform_gemini.process_file_steps); its steps
+between LLM calls run in worker threads.
+
+Run it with an ASGI server, e.g.:
+
+    hypercorn --bind 0.0.0.0:7000 async_app:app
+"""
+
+import admission_lib
+import asyncio
+import batch_lib
+import contextvars
+import convert_batch_lib
+import functools
+import job_lib
+import llm_lib as llm
+import log_lib
+import logging
+import os
+import pdf_to_civiform_gemini as sync_app
+import response_lib
+from quart import Quart, Response, request, jsonify, render_template, send_file
+from quart.wrappers.response import DataBody
+
+app = Quart(__name__)
+app.json = response_lib.JSONProvider(app)
+app.config['MAX_CONTENT_LENGTH'] = sync_app.app.config['MAX_CONTENT_LENGTH']
+# Conversions take minutes; match the gunicorn --timeout of the sync app.
+app.config['RESPONSE_TIMEOUT'] = 900
+
+_request_scope = contextvars.ContextVar('request_scope', default=None)
+
+
+class _RequestScope:
+    """ The log capture and job of one request. """
+
+    def __init__(self, log_capture, job):
+        self.log_capture = log_capture
+        self.job = job
+        self.is_streaming = False
+        self._close_callbacks = []
+
+    def call_on_close(self, callback):
+        """ Calls `callback` when the scope is closed. """
+        self._close_callbacks.append(callback)
+
+    def close(self, error=None):
+        for callback in self._close_callbacks:
+            callback()
+        job_lib.end_job(self.job, error)
+        self.log_capture.close()
+
+
+def runs_in_request_scope(route):
+    """
+    Async counterpart of pdf_to_civiform_gemini.runs_in_request_scope.
+
+    Quart handles each request in an asyncio task of its own, with its own
+    copy of the context, so the capture and job set here are only seen by
+    this request (and by the tasks it starts). A route that streams its
+    response hands the scope over to the response body with
+    stream_in_request_scope, so it stays open until the body is done.
+    """
+    @functools.wraps(route)
+    async def wrapper(*args, **kwargs):
+        form = await request.form
+        scope = _RequestScope(
+            log_lib.start_capture(log_lib.parse_level(form.get('logLevel'))),
+            job_lib.start_job(form.get('jobId')))
+        _request_scope.set(scope)
+        try:
+            response = await app.make_response(await route(*args, **kwargs))
+        except Exception as e:
+            scope.close(e)
+            raise
+        response.headers[sync_app.JOB_ID_HEADER] = scope.job.job_id
+        if not scope.is_streaming:
+            scope.close()
+        return response
+    return wrapper
+
+
+def requires_admission(request_slots=None):
+    """
+    Async counterpart of pdf_to_civiform_gemini.requires_admission. Apply it
+    inside runs_in_request_scope.
+
+    Args:
+        request_slots: An async function returning the number of files the
+            request processes at once. Defaults to 1.
+    """
+    def decorator(route):
+        @functools.wraps(route)
+        async def wrapper(*args, **kwargs):
+            form = await request.form
+            slots = await request_slots() if request_slots else 1
+            try:
+                ticket = await sync_app.admission.acquire_async(
+                    form.get('geminiApiKey'), slots)
+            except admission_lib.AdmissionRejected as e:
+                return too_many_requests(e)
+            try:
+                response = await route(*args, **kwargs)
+            except Exception:
+                ticket.release()
+                raise
+            scope = _request_scope.get()
+            if scope is not None and scope.is_streaming:
+                scope.call_on_close(ticket.release)
+            else:
+                ticket.release()
+            return response
+        return wrapper
+    return decorator
+
+
+def too_many_requests(rejection):
+    """ Async-app version of pdf_to_civiform_gemini.too_many_requests. """
+    data, headers = sync_app.rejection_response(rejection, request.path)
+    return jsonify(data), 429, headers
+
+
+async def directory_request_slots():
+    return sync_app.parse_max_workers((await request.form).get('maxWorkers'))
+
+
+async def batch_request_slots():
+    return sync_app.batch_slots(await request.files, await request.form)
+
+
+async def request_response_options():
+    """ Async-app version of pdf_to_civiform_gemini.request_response_options. """
+    json_body = await request.get_json(silent=True) if request.is_json else None
+    return response_lib.parse_response_options(
+        request.args, await request.form,
+        json_body if isinstance(json_body, dict) else None)
+
+
+async def json_response(data):
+    """ Async-app version of pdf_to_civiform_gemini.json_response. """
+    return jsonify(response_lib.shape_response(
+        data, await request_response_options()))
+
+
+async def wants_ndjson():
+    """ See pdf_to_civiform_gemini.asks_for_ndjson. """
+    return sync_app.asks_for_ndjson(
+        await request.values, request.accept_mimetypes)
+
+
+def ndjson_response(lines):
+    """ Streams NDJSON lines, keeping the request scope open until the end. """
+    response = Response(
+        stream_in_request_scope(lines),
+        mimetype='application/x-ndjson',
+        headers={'X-Accel-Buffering': 'no'})
+    response.timeout = None
+    return response
+
+
+async def final_result(lines):
+    """ See pdf_to_civiform_gemini.final_result. """
+    last_line = None
+    async for line in lines:
+        last_line = line
+    return sync_app.final_result(last_line)
+
+
+@app.after_request
+async def compress_response(response):
+    """ Async-app version of pdf_to_civiform_gemini.compress_response. """
+    if (not isinstance(response.response, DataBody) or
+            not response_lib.should_compress(response)):
+        return response
+    response_lib.compress_body(
+        response, await response.get_data(), request.accept_encodings)
+    return response
+
+
+def stream_in_request_scope(body):
+    """ Keeps the current request scope open until `body` is exhausted.
+
+    Args:
+      body: An async iterator of response chunks.
+
+    Returns:
+      An async generator yielding the chunks of `body`.
+    """
+    scope = _request_scope.get()
+    scope.is_streaming = True
+
+    async def scoped_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            scope.close()
+    return scoped_body()
+
+
+async def process_file_async(file_full, model_name, client, manifest=None,
+                             file_bytes=None, content_hash=None):
+    """
+    Async version of pdf_to_civiform_gemini.process_file: the same pipeline
+    steps, with the LLM calls awaited, see llm_lib.run_steps_async.
+    """
+    return await llm.run_steps_async(sync_app.process_file_steps(
+        file_full, model_name, manifest, file_bytes, content_hash), client)
+
+
+async def process_upload_async(file_full, model_name, client, file_bytes,
+                               content_hash, use_cache=True):
+    """ Async version of pdf_to_civiform_gemini.process_upload. """
+    if not use_cache:
+        return await process_file_async(
+            file_full, model_name, client,
+            file_bytes=file_bytes, content_hash=content_hash)
+    cache = sync_app.upload_result_cache
+    result, status = await cache.get_or_compute_async(
+        cache.key(content_hash, model_name),
+        functools.partial(process_file_async, file_full, model_name, client,
+                          file_bytes=file_bytes, content_hash=content_hash),
+        model_name)
+    sync_app.report_cache_status(os.path.basename(file_full), status)
+    return result
+
+
+async def process_file_result_async(file_full, model_name, client,
+                                    manifest=None, file_bytes=None,
+                                    content_hash=None, use_cache=False):
+    """ Async version of pdf_to_civiform_gemini.process_file_result. """
+    filename = os.path.basename(file_full)
+    try:
+        if use_cache:
+            processing_output = await process_upload_async(
+                file_full, model_name, client, file_bytes, content_hash)
+        else:
+            processing_output = await process_file_async(
+                file_full, model_name, client, manifest, file_bytes,
+                content_hash)
+    except Exception as e:
+        return sync_app.file_result_of(filename, error=e), None
+    return (sync_app.file_result_of(filename, processing_output),
+            processing_output)
+
+
+async def iter_concurrently_async(tasks, max_workers):
+    """
+    Async version of pdf_to_civiform_gemini.iter_concurrently: runs up to
+    max_workers coroutines at a time, as tasks on the event loop.
+
+    Args:
+        tasks: Iterable of (key, coroutine_function, args) tuples.
+        max_workers (int): Maximum number of coroutines running at once.
+
+    Yields:
+        tuple: (key, await coroutine_function(*args)), in completion order.
+    """
+    slots = asyncio.Semaphore(max(1, max_workers))
+
+    async def run(key, coroutine_function, args):
+        async with slots:
+            return key, await coroutine_function(*args)
+
+    # Tasks copy the current context, so their log lines and progress events
+    # go to the caller's request.
+    running = [asyncio.create_task(run(*task)) for task in tasks]
+    try:
+        for next_done in asyncio.as_completed(running):
+            yield await next_done
+    finally:
+        # If the caller stops early (e.g. the client disconnected), cancel
+        # the tasks that are still running or queued.
+        for task in running:
+            task.cancel()
+
+
+async def _process_directory_file_async(directory, filename, model_name,
+                                        client, manifest):
+    file_result, _ = await process_file_result_async(
+        os.path.join(directory, filename), model_name, client, manifest)
+    return file_result
+
+
+async def iter_process_directory_async(directory, model_name, client,
+                                       max_workers=1, manifest=None):
+    """
+    Async version of pdf_to_civiform_gemini.iter_process_directory.
+
+    Yields:
+        tuple: (filename, file_result), in completion order.
+    """
+    filenames = sorted(filename for filename in os.listdir(directory)
+                       if filename.lower().endswith(".pdf"))
+    with sync_app.storage.in_use(os.path.join(directory, "")):
+        async for result in iter_concurrently_async(
+                ((filename, _process_directory_file_async,
+                  (directory, filename, model_name, client, manifest))
+                 for filename in filenames),
+                max_workers):
+            yield result
+    if manifest is not None:
+        # See pdf_to_civiform_gemini.iter_process_directory.
+        await asyncio.to_thread(llm.artifacts.flush)
+
+
+async def stream_directory_results_async(directory, model_name, client,
+                                         max_workers, resume=True):
+    """
+    Async version of pdf_to_civiform_gemini.stream_directory_results.
+
+    Yields:
+        str: The lines of pdf_to_civiform_gemini.DirectoryRunLines.
+    """
+    lines = sync_app.DirectoryRunLines(directory)
+    try:
+        manifest = await asyncio.to_thread(
+            sync_app.open_run_manifest, directory, model_name, resume)
+        async for (filename, file_result) in iter_process_directory_async(
+                directory, model_name, client, max_workers, manifest):
+            yield lines.file_line(filename, file_result)
+        yield lines.summary_line()
+    except Exception as e:
+        yield lines.error_line(e)
+
+
+async def stream_batch_results_async(batch_id, uploads, batch_upload_dir,
+                                     model_name, client, max_workers,
+                                     use_cache=True):
+    """
+    Async version of pdf_to_civiform_gemini.stream_batch_results.
+
+    Yields:
+        str: The lines of pdf_to_civiform_gemini.BatchRunLines.
+    """
+    with sync_app.BatchRunLines(batch_id, batch_upload_dir,
+                                len(uploads)) as lines:
+        try:
+            async for (filename, (file_result, processing_output)) in iter_concurrently_async(
+                    ((filename, process_file_result_async,
+                      (os.path.join(batch_upload_dir, filename), model_name,
+                       client, None, upload.data, upload.content_hash, use_cache))
+                     for (filename, upload) in uploads.items()),
+                    max_workers):
+                yield lines.file_line(filename, file_result, processing_output)
+            yield lines.summary_line()
+        except Exception as e:
+            yield lines.error_line(e)
+
+
+@app.route('/')
+async def index():
+    return await render_template('index.html', debug_log="")
+
+
+@app.route('/jobs', methods=['POST'])
+async def create_job():
+    """ Creates a job, see pdf_to_civiform_gemini.create_job. """
+    return jsonify({"job_id": job_lib.create_job().job_id}), 201
+
+
+@app.route('/jobs/<job_id>/events')
+async def job_events(job_id):
+    """ Streams the progress events of a job as server-sent events. """
+    job = job_lib.get_job(job_id)
+    if job is None:
+        return jsonify(sync_app.UNKNOWN_JOB), 404
+
+    response = Response(
+        job_lib.stream_events_async(
+            job, sync_app.last_event_id(request.headers)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.timeout = None  # The stream lasts as long as the job.
+    return response
+
+
+@app.before_serving
+async def start_storage_janitor():
+    sync_app.storage.start()
+
+
+@app.after_serving
+async def flush_artifacts():
+    """ Writes the queued output files before the server stops. """
+    await asyncio.to_thread(llm.artifacts.flush)
+
+
+@app.route('/metrics')
+async def metrics():
+    """ See pdf_to_civiform_gemini.metrics. """
+    return jsonify(sync_app.metrics_data())
+
+
+@app.route('/upload', methods=['POST'])
+@runs_in_request_scope
+@requires_admission()
+async def upload_file():
+    try:
+        files = await request.files
+        form = await request.form
+        error = sync_app.upload_file_error(files)
+        if error is not None:
+            data, status = error
+            return await json_response(data), status
+        filename, file_full, upload = await asyncio.to_thread(
+            sync_app.receive_upload, files['file'])
+        settings = sync_app.request_settings(form)
+
+        client, error_data = sync_app.gemini_client(settings.gemini_api_key)
+        if client is None:
+            return await json_response(error_data), 500
+
+        processing_result = await process_upload_async(
+            file_full, settings.model_name, client, upload.data,
+            upload.content_hash, settings.use_cache)
+        data, status = sync_app.upload_result(filename, processing_result)
+        return await json_response(data), status
+
+    except Exception as e:
+        return await json_response(sync_app.unexpected_error(
+            f"An unexpected error occurred during file upload/processing: {e}")), 500
+
+
+@app.route('/convert_to_civiform', methods=['POST'])
+@runs_in_request_scope
+async def handle_convert_to_civiform():
+    """
+    Endpoint to convert intermediary JSON (provided in request body)
+    to CiviForm JSON.
+    """
+    logging.info("Received request to convert intermediary JSON to CiviForm JSON.")
+
+    if not request.is_json:
+        logging.error("Request content type is not application/json")
+        return await json_response({"error": "Request must be JSON"}), 415
+
+    try:
+        request_data = await request.get_json()
+        if request.args.get('download', '').lower() == 'true':
+            return await civiform_download(request_data)
+        response_data, status = await asyncio.to_thread(
+            convert_batch_lib.convert_request_data, request_data)
+        return await json_response(response_data), status
+
+    except Exception as e:
+        return await json_response(sync_app.unexpected_error(
+            f"An error occurred during CiviForm JSON conversion: {e}")), 500
+
+
+async def civiform_download(request_data):
+    """ See pdf_to_civiform_gemini.civiform_download. """
+    output, response_data, status = await asyncio.to_thread(
+        sync_app.convert_to_temporary_file, request_data)
+    if output is None:
+        return await json_response(response_data), status
+    return Response(
+        read_chunks(output), mimetype='application/json',
+        headers={'Content-Disposition': 'attachment; filename=civiform.json'})
+
+
+def read_chunks(f, chunk_size=64 * 1024):
+    """ Yields the content of a binary file in chunks, then closes it. """
+    with f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+@app.route('/convert_to_civiform_batch', methods=['POST'])
+@runs_in_request_scope
+async def handle_convert_to_civiform_batch():
+    """ See pdf_to_civiform_gemini.handle_convert_to_civiform_batch. """
+    logging.info("Received batch request to convert intermediary JSON to CiviForm JSON.")
+    items, error = sync_app.conversion_items(
+        await request.get_data(), request.mimetype)
+    if error is not None:
+        data, status = error
+        return await json_response(data), status
+
+    results = stream_conversions_async(items, await request_response_options())
+    if await wants_ndjson() or request.mimetype == "application/x-ndjson":
+        return ndjson_response(results)
+    return jsonify(sync_app.collected_conversions(
+        [line async for line in results]))
+
+
+async def stream_conversions_async(items, options):
+    """ Async version of pdf_to_civiform_gemini.stream_conversions. """
+    lines = sync_app.ConversionLines(options)
+    async for (index, item, response_data, status) in convert_batch_lib.iter_converted_async(items):
+        yield lines.result_line(index, item, response_data, status)
+    yield lines.summary_line()
+
+
+@app.route('/upload_directory', methods=['POST'])
+@runs_in_request_scope
+@requires_admission(directory_request_slots)
+async def upload_directory():
+    """
+    Endpoint to process a directory of files and return a summary, as in
+    the sync app (see pdf_to_civiform_gemini.upload_directory).
+    """
+    logging.info("Received request to process directory.")
+    form = await request.form
+    settings = sync_app.request_settings(form)
+    logging.info(f"Processing up to {settings.max_workers} files at once.")
+
+    directory_path = sync_app.requested_directory(
+        form.get('directoryPath', sync_app.default_upload_dir))
+    if directory_path is None:
+        debug_log = log_lib.captured_log()
+        return await json_response({"error": "Invalid directory path.", "debug_log": debug_log}), 400
+
+    client, error_data = sync_app.gemini_client(settings.gemini_api_key)
+    if client is None:
+        return await json_response(error_data), 500
+
+    results = stream_directory_results_async(
+        directory_path, settings.model_name, client, settings.max_workers,
+        settings.resume)
+    if await wants_ndjson():
+        return ndjson_response(results)
+
+    # Without streaming, return the final line (the summary or the error).
+    data, status = await final_result(results)
+    logging.info(f"Directory processing finished for: {directory_path}")
+    return await json_response(data), status
+
+
+@app.route('/upload_batch', methods=['POST'])
+@runs_in_request_scope
+@requires_admission(batch_request_slots)
+async def upload_batch():
+    """
+    Endpoint to process many PDFs sent in one multipart request, as in the
+    sync app (see pdf_to_civiform_gemini.upload_batch).
+    """
+    logging.info("Received batch upload.")
+    files = [file for file in (await request.files).getlist('files')
+             if file.filename]
+    if not files:
+        return await json_response({"error": "No files selected"}), 400
+    settings = sync_app.request_settings(await request.form)
+    logging.info(f"Processing up to {settings.max_workers} files at once.")
+
+    client, error_data = sync_app.gemini_client(settings.gemini_api_key)
+    if client is None:
+        return await json_response(error_data), 500
+
+    batch_id = batch_lib.new_batch_id()
+    batch_upload_dir = os.path.join(
+        sync_app.default_upload_dir, f"batch-{batch_id}")
+    uploads = await asyncio.to_thread(
+        sync_app.spool_batch_uploads, files, batch_upload_dir)
+    results = stream_batch_results_async(
+        batch_id, uploads, batch_upload_dir, settings.model_name, client,
+        settings.max_workers, settings.use_cache)
+
+    if await wants_ndjson():
+        return ndjson_response(results)
+    data, status = await final_result(results)
+    return await json_response(data), status
+
+
+@app.route('/batches/<batch_id>/archive')
+async def batch_archive(batch_id):
+    """ Downloads the zip archive of a finished batch's outputs. """
+    path, error = sync_app.batch_archive_file(batch_id)
+    if error is not None:
+        data, status = error
+        return jsonify(data), status
+    return await send_file(path, mimetype='application/zip', as_attachment=True,
+                           attachment_filename=f"civiform-batch-{batch_id}.zip")
+
+
+if __name__ == '__main__':
+    # Development server; use an ASGI server such as hypercorn in production.
+    convert_batch_lib.start()
+    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 7000)))
@@ -0,0 +1,216 @@
+import io
+import json
+import unittest
+from unittest import mock
+
+from werkzeug.datastructures import FileStorage, MultiDict
+from werkzeug.test import encode_multipart
+
+# Imports the Flask app with its directories under a temporary home.
+import pdf_to_civiform_gemini_test as app_test
+import async_app
+import convert_to_civiform_json
+import job_lib
+import llm_lib
+import pdf_to_civiform_gemini as sync_app
+
+INTERMEDIARY = {"title": "Test Form", "help_text": "help", "sections": [
+    {"title": "Applicant", "help_text": "About you", "fields": [
+        {"label": "Full name", "type": "name", "id": "name"}]}]}
+REQUEST = {"intermediary_json": json.dumps(INTERMEDIARY)}
+
+
+def multipart(files, form):
+    """ Returns (body, content_type) of a multipart request sending `files`,
+    a list of (field name, filename, data), and the `form` fields. """
+    values = MultiDict(form)
+    for (name, filename, data) in files:
+        values.add(name, FileStorage(io.BytesIO(data), filename=filename,
+                                     content_type="application/pdf"))
+    boundary, body = encode_multipart(values)
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def ndjson_lines(body):
+    return [json.loads(line) for line in body.decode().splitlines() if line]
+
+
+class TestAppsAnswerAlike(unittest.IsolatedAsyncioTestCase):
+    """ Sends the same requests to the Flask app and the async app. """
+
+    def setUp(self):
+        self.client = app_test.FakeClient()
+        patcher = mock.patch.object(
+            llm_lib, "initialize_gemini_client",
+            side_effect=lambda *args, **kwargs: self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # The converter gives each program a random id.
+        patcher = mock.patch.object(
+            convert_to_civiform_json.random, "randint", return_value=1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.sync_client = sync_app.app.test_client()
+        self.async_client = async_app.app.test_client()
+
+    async def post(self, path, query_string=None, **kwargs):
+        """ Returns the (status, mimetype, body) of each app's response. """
+        sync_response = self.sync_client.post(
+            path, query_string=query_string, **kwargs)
+        async_response = await self.async_client.post(
+            path, query_string=query_string, **kwargs)
+        return ((sync_response.status_code, sync_response.mimetype,
+                 sync_response.get_data()),
+                (async_response.status_code, async_response.mimetype,
+                 await async_response.get_data()))
+
+    async def post_pdfs(self, path, files, form, query_string=None):
+        body, content_type = multipart(files, form)
+        return await self.post(path, query_string=query_string, data=body,
+                               headers={"Content-Type": content_type})
+
+    async def test_upload(self):
+        pdf = app_test.make_pdf("Upload form")
+        results = await self.post_pdfs(
+            "/upload", [("file", "upload_form.pdf", pdf)],
+            {"useCache": "false", "modelName": "gemini-test"})
+
+        datas = []
+        for (status, mimetype, body) in results:
+            self.assertEqual((status, mimetype), (200, "application/json"))
+            datas.append(json.loads(body))
+        self.assertEqual(datas[0]["intermediary_json"],
+                         datas[1]["intermediary_json"])
+        self.assertEqual(json.loads(datas[0]["civiform_json"]),
+                         json.loads(datas[1]["civiform_json"]))
+
+    async def test_upload_without_file(self):
+        (sync_result, async_result) = await self.post_pdfs("/upload", [], {})
+        self.assertEqual(sync_result[0], 400)
+        self.assertEqual(sync_result, async_result)
+
+    async def test_convert_to_civiform(self):
+        results = await self.post("/convert_to_civiform", json=REQUEST)
+        datas = []
+        for (status, mimetype, body) in results:
+            self.assertEqual((status, mimetype), (200, "application/json"))
+            datas.append(json.loads(body))
+        self.assertEqual(json.loads(datas[0]["civiform_json"]),
+                         json.loads(datas[1]["civiform_json"]))
+
+    async def test_convert_to_civiform_download(self):
+        results = await self.post("/convert_to_civiform",
+                                  query_string={"download": "true"},
+                                  json=REQUEST)
+        programs = []
+        for (status, mimetype, body) in results:
+            self.assertEqual((status, mimetype), (200, "application/json"))
+            programs.append(json.loads(body))
+        self.assertEqual(programs[0], programs[1])
+
+    async def test_convert_to_civiform_rejects_non_json(self):
+        (sync_result, async_result) = await self.post(
+            "/convert_to_civiform", data="not json")
+        self.assertEqual(sync_result[0], 415)
+        self.assertEqual(sync_result, async_result)
+
+    async def test_convert_to_civiform_batch_ndjson(self):
+        body = "\n".join(json.dumps(item) for item in (
+            dict(REQUEST, id="a"),
+            INTERMEDIARY,
+            {"id": "bad", "intermediary_json": "not a form"}))
+        results = await self.post(
+            "/convert_to_civiform_batch", data=body,
+            headers={"Content-Type": "application/x-ndjson"})
+
+        all_lines = []
+        for (status, mimetype, body) in results:
+            self.assertEqual((status, mimetype), (200, "application/x-ndjson"))
+            lines = ndjson_lines(body)
+            self.assertEqual([line.get("index") for line in lines[:-1]],
+                             [0, 1, 2])
+            all_lines.append(lines)
+        (sync_lines, async_lines) = all_lines
+        self.assertEqual(sync_lines[-1], async_lines[-1])  # The summary.
+        self.assertEqual([line.get("id") for line in sync_lines[:-1]],
+                         [line.get("id") for line in async_lines[:-1]])
+        self.assertEqual([sorted(line) for line in sync_lines[:-1]],
+                         [sorted(line) for line in async_lines[:-1]])
+
+    async def test_upload_batch_stream(self):
+        files = [("files", f"form_{n}.pdf", app_test.make_pdf(f"Form {n}"))
+                 for n in range(2)]
+        results = await self.post_pdfs(
+            "/upload_batch", files,
+            {"useCache": "false", "modelName": "gemini-test"},
+            query_string={"stream": "true"})
+
+        all_lines = []
+        for (status, mimetype, body) in results:
+            self.assertEqual((status, mimetype), (200, "application/x-ndjson"))
+            all_lines.append(ndjson_lines(body))
+        (sync_lines, async_lines) = all_lines
+        # Files finish in any order; each batch has its own id.
+        self.assertEqual(
+            sorted(line.get("file") for line in sync_lines[:-1]),
+            sorted(line.get("file") for line in async_lines[:-1]))
+        self.assertEqual(
+            sorted(line.get("file") for line in sync_lines[:-1]),
+            ["form_0.pdf", "form_1.pdf"])
+        self.assertEqual(sorted(sync_lines[-1]["summary"]),
+                         sorted(async_lines[-1]["summary"]))
+        self.assertEqual(sync_lines[-1]["summary"]["success_count"], 2)
+        self.assertEqual(async_lines[-1]["summary"]["success_count"], 2)
+
+    async def send(self, app_client, method, path, **kwargs):
+        """ Sends a request to one of the apps; returns (response, body). """
+        response = getattr(app_client, method)(path, **kwargs)
+        if app_client is self.async_client:
+            response = await response
+            return response, await response.get_data()
+        return response, response.get_data()
+
+    async def test_job_events_end_with_the_job(self):
+        pdf = app_test.make_pdf("Tracked form")
+        for app_client in (self.sync_client, self.async_client):
+            response, body = await self.send(app_client, "post", "/jobs")
+            self.assertEqual(response.status_code, 201)
+            job_id = json.loads(body)["job_id"]
+
+            body, content_type = multipart(
+                [("file", "tracked.pdf", pdf)],
+                {"useCache": "false", "jobId": job_id})
+            response, _ = await self.send(
+                app_client, "post", "/upload", data=body,
+                headers={"Content-Type": content_type})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers["X-Job-Id"], job_id)
+
+            response, body = await self.send(
+                app_client, "get", f"/jobs/{job_id}/events")
+            self.assertEqual(response.mimetype, "text/event-stream")
+            self.assertIn("event: done", body.decode())
+
+    async def test_requests_without_a_job_get_one(self):
+        pdf = app_test.make_pdf("Untracked form")
+        for app_client in (self.sync_client, self.async_client):
+            body, content_type = multipart(
+                [("file", "untracked.pdf", pdf)], {"useCache": "false"})
+            response, _ = await self.send(
+                app_client, "post", "/upload", data=body,
+                headers={"Content-Type": content_type})
+            self.assertIsNotNone(
+                job_lib.get_job(response.headers.get("X-Job-Id")))
+
+    async def test_unknown_job_events(self):
+        (sync_result, async_result) = [
+            (response.status_code, json.loads(body))
+            for (response, body) in [
+                await self.send(app_client, "get",
+                                "/jobs/never-created/events")
+                for app_client in (self.sync_client, self.async_client)]]
+        self.assertEqual(sync_result[0], 404)
+        self.assertEqual(sync_result, async_result)
+
+if __name__ == '__main__':
+    unittest.main()
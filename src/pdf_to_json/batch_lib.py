@@ -0,0 +1,101 @@
+""" Multi-file batch uploads for the PDF->CiviForm web app.
+
+A batch is one /upload_batch request carrying many PDFs. The PDFs are
+processed concurrently, and each one's outputs are added to a zip archive
+as soon as it is done, so the whole batch can be downloaded in one go from
+/batches/<batch_id>/archive.
+"""
+
+import json_codec
+import logging
+import os
+import re
+import uuid
+import zipfile
+from werkzeug.utils import secure_filename
+
+_BATCH_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+def new_batch_id():
+    return uuid.uuid4().hex
+
+
+def is_valid_batch_id(batch_id):
+    return bool(batch_id) and _BATCH_ID_RE.match(batch_id) is not None
+
+
+def archive_path(batches_dir, batch_id):
+    """ Returns where the archive of a batch is stored. """
+    return os.path.join(batches_dir, f"{batch_id}.zip")
+
+
+def unique_filenames(filenames):
+    """ Makes the uploaded filenames of a batch safe and unique.
+
+    Two uploads named "form.pdf" become "form.pdf" and "form-2.pdf", so
+    neither overwrites the other's outputs.
+
+    Args:
+      filenames: The filenames sent by the client, in upload order.
+
+    Returns:
+      A list of filenames, in the same order.
+    """
+    seen = set()
+    result = []
+    for filename in filenames:
+        filename = secure_filename(filename) or "upload.pdf"
+        base_name, extension = os.path.splitext(filename)
+        candidate = filename
+        suffix = 2
+        while candidate in seen:
+            candidate = f"{base_name}-{suffix}{extension}"
+            suffix += 1
+        seen.add(candidate)
+        result.append(candidate)
+    return result
+
+
+class BatchArchive:
+    """ A zip archive of a batch's outputs, written as files finish.
+
+    The archive is written under a temporary name and only renamed into
+    place by close(), so a download never sees a partial archive. Not
+    thread-safe: add files from one thread.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._tmp_path = f"{path}.tmp"
+        self._zip = zipfile.ZipFile(
+            self._tmp_path, "w", compression=zipfile.ZIP_DEFLATED)
+
+    def add(self, filename, outputs):
+        """ Adds one PDF's outputs, under a folder named after the PDF.
+
+        Args:
+          filename: The PDF's filename within the batch.
+          outputs: The dict returned by process_file, with
+            'intermediary_json' and 'civiform_json' strings.
+        """
+        base_name, _ = os.path.splitext(filename)
+        self._zip.writestr(f"{base_name}/civiform.json",
+                           outputs["civiform_json"])
+        self._zip.writestr(f"{base_name}/intermediary.json",
+                           outputs["intermediary_json"])
+
+    def close(self, summary):
+        """ Adds the batch summary and makes the archive available. """
+        self._zip.writestr("summary.json", json_codec.dumps(summary, indent=2))
+        self._zip.close()
+        os.replace(self._tmp_path, self.path)
+        logging.info(f"Batch archive saved to: {self.path}")
+
+    def discard(self):
+        """ Deletes an archive that will not be completed. """
+        self._zip.close()
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
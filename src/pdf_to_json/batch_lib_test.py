@@ -0,0 +1,38 @@
+import batch_lib
+import os
+import tempfile
+import unittest
+import zipfile
+
+
+class TestBatchLib(unittest.TestCase):
+
+    def test_unique_filenames(self):
+        self.assertEqual(
+            batch_lib.unique_filenames(
+                ['form.pdf', 'form.pdf', '../form.pdf', 'other.pdf', '']),
+            ['form.pdf', 'form-2.pdf', 'form-3.pdf', 'other.pdf', 'upload.pdf'])
+
+    def test_archive_appears_only_when_closed(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = batch_lib.archive_path(tmp_dir, batch_lib.new_batch_id())
+            archive = batch_lib.BatchArchive(path)
+            archive.add('form.pdf', {'civiform_json': '{}',
+                                     'intermediary_json': '[]'})
+            self.assertFalse(os.path.exists(path))
+            archive.close({'total_files': 1})
+            with zipfile.ZipFile(path) as zip_file:
+                self.assertEqual(
+                    sorted(zip_file.namelist()),
+                    ['form/civiform.json', 'form/intermediary.json',
+                     'summary.json'])
+
+    def test_discard(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            archive = batch_lib.BatchArchive(os.path.join(tmp_dir, 'a.zip'))
+            archive.discard()
+            self.assertEqual(os.listdir(tmp_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
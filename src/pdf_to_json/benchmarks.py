@@ -0,0 +1,325 @@
+""" Benchmarks of the pipeline's CPU-bound steps on large synthetic forms.
+
+Run all benchmarks:  python benchmarks.py
+Run some of them:    python benchmarks.py format_json --sections 200 --fields 50
+
+Each benchmark times the current implementation and, where there is one, the
+implementation it replaced, on the same input, and prints the best of
+--repeat runs.
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import time
+import tracemalloc
+
+import convert_to_civiform_json
+import format_json_lib
+import json_codec
+import regression_test_rules
+
+
+def synthetic_form(sections=100, fields_per_section=40, options_per_field=6):
+    """
+    Builds an intermediary JSON document (as returned by the LLM) with
+    many sections, fields and options.
+
+    Returns:
+        list: [form], where form is a dict with a title and sections.
+    """
+    field_types = ["text", "radio_button", "checkbox", "date", "number",
+                   "email", "address", "phone", "currency", "name"]
+    form_sections = []
+    for s in range(sections):
+        fields = []
+        for f in range(fields_per_section):
+            field_type = field_types[(s + f) % len(field_types)]
+            field = {"label": f"Question {s}.{f}: describe the applicant's situation",
+                     "type": field_type,
+                     "id": f"section_{s}_field_{f}",
+                     "help_text": "Answer as it appears on your documents."}
+            if field_type in ("radio_button", "checkbox"):
+                field["options"] = [f"Option {o}" for o in range(options_per_field)]
+            fields.append(field)
+        form_sections.append({"title": f"Section {s}",
+                              "help_text": f"Information about part {s}.",
+                              "fields": fields})
+    return [{"title": "Synthetic Benefits Application",
+             "help_text": "A large synthetic form for benchmarks.",
+             "sections": form_sections}]
+
+
+def legacy_format_json_single_line_fields(json_string):
+    """ format_json_single_line_fields before the single-pass writer. """
+    data = json.loads(json_string)
+
+    def custom_dumps(obj, level=0):
+        if isinstance(obj, dict):
+            if "label" in obj and "type" in obj and "id" in obj:
+                return json.dumps(
+                    obj, separators=(',', ':'), sort_keys=False)
+            else:
+                return "{\n" + "".join(
+                    f"{'    ' * (level + 1)}{json.dumps(k, separators=(',', ':'), sort_keys=False)}: {custom_dumps(v, level + 1)},\n"
+                    for k, v in obj.items())[:-2] + "\n" + (
+                        "    " * level) + "}"
+        elif isinstance(obj, list):
+            return "[\n" + "".join(
+                f"{'    ' * (level + 1)}{custom_dumps(item, level + 1)},\n"
+                for item in obj)[:-2] + "\n" + ("    " * level) + "]"
+        else:
+            return json.dumps(obj, separators=(',', ':'), sort_keys=False)
+
+    return custom_dumps(data)
+
+
+def legacy_replace_numbers_in_string(s):
+    """ replace_numbers_in_string before the single-pass normalizer. """
+    while (re.search(r'[1-9]\d*', s)):
+        match = re.search(r'[1-9]\d*', s)
+        if match:
+            s = re.sub(match.group(0),
+                       convert_to_civiform_json.convert_to_base26(int(match.group(0))), s)
+        else:
+            break
+    return s
+
+
+def synthetic_field_ids(count, numbers_per_id):
+    """
+    Builds distinct field ids with many numbers each, e.g. for form line
+    items "part_31_line_12_col_40_...". All numbers have two digits, so that
+    none is part of another number of the same id, where the legacy
+    normalizer's output differs.
+    """
+    rng = random.Random(0)
+    return ["_".join(f"part_{n}" for n in rng.sample(range(10, 100), numbers_per_id))
+            for _ in range(count)]
+
+
+def legacy_question_mapping(similarity_matrix):
+    """ generate_question_mapping before NumPy, without the eval->golden
+    mapping (which was the eval index itself). """
+    def index_penalty(index1, index2):
+        return regression_test_rules._INDEX_PENALTY_EXPONENT ** abs(index1 - index2)
+
+    golden_to_eval = [None] * len(similarity_matrix)
+    for golden_index in range(len(similarity_matrix)):
+        best_index = -1
+        best_value = 0
+        for eval_index in range(len(similarity_matrix[0])):
+            penalized_value = (index_penalty(golden_index, eval_index) *
+                               similarity_matrix[golden_index][eval_index])
+            if (best_value <= penalized_value):
+                best_index = eval_index
+                best_value = penalized_value
+        golden_to_eval[golden_index] = best_index
+    return golden_to_eval
+
+
+def synthetic_program_pair(questions):
+    """
+    Builds a ProgramPair of a CiviForm program with that many questions and
+    a shuffled copy of it, with about one question in ten dropped.
+    """
+    rng = random.Random(0)
+    words = ["applicant", "household", "income", "address", "date", "birth",
+             "employer", "benefits", "monthly", "rent", "children", "school",
+             "insurance", "vehicle", "disability", "language", "phone"]
+    texts = [" ".join(rng.sample(words, 4)) + f" question {q}"
+             for q in range(questions)]
+    evaluated = [text for text in texts if rng.random() > 0.1]
+    rng.shuffle(evaluated)
+
+    def program(question_texts):
+        return json.dumps({"questions": [
+            {"type": "text", "config": {"questionText": {
+                "translations": {"en_US": text}}}}
+            for text in question_texts]})
+
+    return regression_test_rules.ProgramPair.from_json(
+        program(texts), program(evaluated))
+
+
+def best_time(function, repeat):
+    """ Returns the fastest of `repeat` runs of function(), in seconds. """
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def report(name, seconds, baseline_seconds=None, size=None):
+    line = f"  {name:<32} {seconds * 1000:9.2f} ms"
+    if size:
+        line += f"  {size / seconds / 1e6:7.1f} MB/s"
+    if baseline_seconds:
+        line += f"  {baseline_seconds / seconds:5.2f}x"
+    print(line)
+
+
+def benchmark_format_json(args):
+    json_string = json.dumps(synthetic_form(args.sections, args.fields))
+    expected = legacy_format_json_single_line_fields(json_string)
+    assert format_json_lib.format_json_single_line_fields(json_string) == expected
+    assert "".join(format_json_lib.iter_format_json_single_line_fields(
+        json.loads(json_string))) == expected
+
+    print(f"format_json_single_line_fields: {len(json_string)} bytes in, {len(expected)} out")
+    legacy = best_time(
+        lambda: legacy_format_json_single_line_fields(json_string), args.repeat)
+    report("legacy (recursive concat)", legacy, size=len(json_string))
+    report("single pass", best_time(
+        lambda: format_json_lib.format_json_single_line_fields(json_string),
+        args.repeat), legacy, len(json_string))
+    data = json.loads(json_string)
+    report("single pass, parsed input", best_time(
+        lambda: format_json_lib.format_data_single_line_fields(data),
+        args.repeat), legacy, len(json_string))
+    report("generator (chunks)", best_time(
+        lambda: sum(1 for _ in format_json_lib.iter_format_json_single_line_fields(data)),
+        args.repeat), legacy, len(json_string))
+
+
+def benchmark_field_ids(args):
+    field_ids = synthetic_field_ids(args.sections * args.fields, 12)
+    normalize = convert_to_civiform_json.replace_numbers_in_string
+    assert [normalize(i) for i in field_ids] == [
+        legacy_replace_numbers_in_string(i) for i in field_ids]
+
+    print(f"replace_numbers_in_string: {len(field_ids)} ids with 12 numbers each")
+    legacy = best_time(
+        lambda: [legacy_replace_numbers_in_string(i) for i in field_ids],
+        args.repeat)
+    report("legacy (search and sub loop)", legacy)
+
+    def uncached():
+        normalize.cache_clear()
+        return [normalize(i) for i in field_ids]
+
+    report("single pass", best_time(uncached, args.repeat), legacy)
+    report("single pass, memoized", best_time(
+        lambda: [normalize(i) for i in field_ids], args.repeat), legacy)
+
+
+
+def benchmark_convert(args):
+    form_json = json.dumps(synthetic_form(args.sections, args.fields)[0])
+    field_count = args.sections * args.fields
+    print(f"convert_to_civiform_json: {field_count} fields")
+
+    def timed(function):
+        # Conversion normalizes its input in place: time it on fresh copies.
+        best = float("inf")
+        for _ in range(args.repeat):
+            form = json.loads(form_json)
+            started = time.perf_counter()
+            function(form)
+            best = min(best, time.perf_counter() - started)
+        return best
+
+    with open(os.devnull, "wb") as devnull:
+        def streamed(form):
+            convert_to_civiform_json.write_civiform_json(form, devnull)
+
+        for (name, function) in (
+                ("program (dicts)", convert_to_civiform_json.civiform_program),
+                ("program and JSON string",
+                 convert_to_civiform_json.convert_to_civiform_json),
+                ("JSON streamed to a file", streamed)):
+            seconds = timed(function)
+            print(f"  {name:<32} {seconds * 1000:9.2f} ms  {field_count / seconds:9.0f} fields/s")
+
+        for (name, function) in (
+                ("JSON string", convert_to_civiform_json.convert_to_civiform_json),
+                ("streamed to a file", streamed)):
+            form = json.loads(form_json)
+            tracemalloc.start()
+            function(form)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"  peak memory, {name:<19} {peak / 1e6:9.2f} MB")
+
+
+def benchmark_codec(args):
+    form = synthetic_form(args.sections, args.fields)
+    program = convert_to_civiform_json.civiform_program(
+        json.loads(json.dumps(form[0])))
+    print(f"json_codec ({json_codec.BACKEND}) vs json")
+    for (name, data) in (("intermediary", form), ("civiform", program)):
+        compact = json.dumps(data)
+        print(f"  {name}: {len(compact)} bytes")
+        for (label, baseline, function) in (
+                ("loads", lambda: json.loads(compact),
+                 lambda: json_codec.loads(compact)),
+                ("dumps", lambda: json.dumps(data),
+                 lambda: json_codec.dumps(data)),
+                ("dumps, indent=2", lambda: json.dumps(data, indent=2),
+                 lambda: json_codec.dumps(data, indent=2))):
+            legacy = best_time(baseline, args.repeat)
+            report(f"json {label}", legacy, size=len(compact))
+            report(f"json_codec {label}", best_time(function, args.repeat),
+                   legacy, len(compact))
+
+
+def benchmark_question_mapping(args):
+    # The sections of the synthetic form are its questions: hundreds by default.
+    pair = synthetic_program_pair(args.sections * 4)
+    similarity_matrix = pair.similarity_matrix
+    (golden_count, eval_count) = similarity_matrix.shape
+    print(f"regression_test_rules: {golden_count} x {eval_count} questions")
+    assert (regression_test_rules.generate_question_mapping(pair)[0] ==
+            legacy_question_mapping(similarity_matrix))
+
+    legacy = best_time(
+        lambda: legacy_question_mapping(similarity_matrix), args.repeat)
+    report("mapping, loops (golden->eval)", legacy)
+    report("mapping, NumPy (both ways)", best_time(
+        lambda: regression_test_rules.generate_question_mapping(pair),
+        args.repeat), legacy)
+    report("mapping, optimal assignment", best_time(
+        lambda: regression_test_rules.generate_question_mapping(
+            pair, optimal=True), args.repeat), legacy)
+    report("help text similarity rule", best_time(
+        lambda: regression_test_rules.rule_help_text_similarity(pair),
+        args.repeat))
+    report("TF-IDF similarity matrix", best_time(
+        lambda: regression_test_rules._similarity_matrix(
+            pair.golden.question_texts, pair.eval.question_texts),
+        args.repeat))
+
+
+BENCHMARKS = {
+    "format_json": benchmark_format_json,
+    "field_ids": benchmark_field_ids,
+    "convert": benchmark_convert,
+    "codec": benchmark_codec,
+    "question_mapping": benchmark_question_mapping,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("names", nargs="*", metavar="name",
+                        help=f"Benchmarks to run: {', '.join(BENCHMARKS)} (default: all).")
+    parser.add_argument("--sections", type=int, default=100,
+                        help="Sections of the synthetic form.")
+    parser.add_argument("--fields", type=int, default=40,
+                        help="Fields per section of the synthetic form.")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Runs of each benchmark; the fastest is reported.")
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark: {name}")
+    for name in args.names or BENCHMARKS:
+        BENCHMARKS[name](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+""" Conversion of intermediary JSON documents sent to the web app.
+
+/convert_to_civiform converts one document per request. Its batch variant,
+/convert_to_civiform_batch, takes many documents at once, as a JSON array or
+as NDJSON (one document per line), converts them in a pool of worker
+processes and returns one result per document, in request order. A
+document that cannot be converted gets an error result; the others are
+unaffected.
+
+Conversion is pure CPU work, so the pool uses processes rather than
+threads. A spawned process imports the parent's __main__ module, which is
+the web app when it is run as a script (e.g. by the Flask dev server). The
+web app then starts the pool before it serves requests (see start()), so
+that the workers only import this module and the converter.
+"""
+
+import asyncio
+import collections
+from concurrent.futures import ProcessPoolExecutor
+import json
+import json_codec
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import types
+
+from convert_to_civiform_json import convert_to_civiform_json, write_civiform_json
+
+# Worker processes converting batch documents, shared by all requests.
+CONVERT_WORKERS = int(os.environ.get("CONVERT_WORKERS", os.cpu_count() or 1))
+# Documents sent to a worker at once, to save round trips between processes.
+CHUNK_SIZE = 16
+
+# A line of an NDJSON request body that is not valid JSON.
+InvalidItem = collections.namedtuple('InvalidItem', ['error'])
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def convert_request_data(request_data, output_file=None):
+    """
+    Converts the intermediary JSON of a /convert_to_civiform request body to
+    CiviForm JSON.
+
+    Args:
+        request_data (dict): The parsed request body, with an
+            'intermediary_json' string.
+        output_file: A binary file to write the CiviForm JSON to as it is
+            generated (see convert_to_civiform_json.write_civiform_json),
+            rather than returning it in response_data.
+
+    Returns:
+        tuple: (response_data, status_code). response_data has a
+               'civiform_json' string (empty if written to output_file),
+               or an 'error' message.
+    """
+    intermediary_json_str = request_data.get('intermediary_json')
+
+    if not intermediary_json_str:
+        logging.error("No 'intermediary_json' field found in request.")
+        return {"error": "Missing 'intermediary_json' in request body"}, 400
+
+    # Parse the intermediary JSON string provided by the client
+    try:
+        intermediary_data = json_codec.loads(intermediary_json_str)
+        logging.info("Successfully parsed intermediary JSON from request.")
+    except json.JSONDecodeError as e:
+        logging.error(f"Invalid JSON received in 'intermediary_json': {e}")
+        return {"error": "Invalid JSON format provided in 'intermediary_json'", "details": str(e)}, 400
+
+    return convert_intermediary_data(intermediary_data, output_file)
+
+
+def convert_intermediary_data(intermediary_data, output_file=None):
+    """
+    Converts a parsed intermediary JSON document to CiviForm JSON.
+
+    Args:
+        intermediary_data: The document: a dict, or a list whose first
+            element is the dict to convert.
+        output_file: See convert_request_data.
+
+    Returns:
+        tuple: (response_data, status_code), as for convert_request_data.
+    """
+    # Check if the parsed data is a list and extract the first element if needed
+    data_to_convert = None
+    if isinstance(intermediary_data, list):
+        if not intermediary_data:
+            logging.error("Intermediary data list is empty.")
+            return {"error": "Intermediary JSON data is an empty list"}, 400
+        # Assume the relevant data is the first element of the list
+        data_to_convert = intermediary_data[0]
+    elif isinstance(intermediary_data, dict):
+         data_to_convert = intermediary_data
+         logging.info("Intermediary data is a dictionary, using it directly for conversion.")
+    else:
+         logging.error(f"Intermediary data is not a list or dict, type is {type(intermediary_data)}")
+         return {"error": "Unexpected format for intermediary JSON data"}, 400
+
+    if not isinstance(data_to_convert, dict):
+         logging.error(f"Data selected for conversion is not a dictionary (type: {type(data_to_convert)}). Cannot proceed.")
+         return {"error": "Selected data for conversion is not in the expected dictionary format."}, 400
+
+    # Perform the conversion
+    if output_file is not None:
+        write_civiform_json(data_to_convert, output_file)
+        logging.info("Conversion to CiviForm JSON successful.")
+        return {}, 200
+    civiform_json_result = convert_to_civiform_json(data_to_convert)
+    logging.info("Conversion to CiviForm JSON successful.")
+
+    # Return the resulting CiviForm JSON string
+    return {"civiform_json": civiform_json_result}, 200
+
+
+def convert_item(item):
+    """
+    Converts one document of a batch. Never raises.
+
+    Args:
+        item: Either a /convert_to_civiform request body (a dict with an
+            'intermediary_json' string or document), or the intermediary
+            document itself, or an InvalidItem.
+
+    Returns:
+        tuple: (response_data, status_code), as for convert_request_data.
+    """
+    try:
+        if isinstance(item, InvalidItem):
+            return {"error": item.error}, 400
+        if isinstance(item, dict) and "intermediary_json" in item:
+            if isinstance(item["intermediary_json"], str):
+                return convert_request_data(item)
+            return convert_intermediary_data(item["intermediary_json"])
+        return convert_intermediary_data(item)
+    except Exception as e:
+        return {"error": f"An error occurred during CiviForm JSON conversion: {e}"}, 500
+
+
+def request_items(body, mimetype):
+    """
+    Reads the documents of a batch request body.
+
+    Args:
+        body (bytes): The request body.
+        mimetype (str): Its content type: application/json for a JSON array,
+            or application/x-ndjson for one document per line.
+
+    Returns:
+        An iterable of items for convert_item. NDJSON lines are parsed
+        lazily; a line that is not valid JSON becomes an InvalidItem.
+
+    Raises:
+        ValueError: If the body is not a JSON array or NDJSON.
+    """
+    if mimetype == "application/x-ndjson":
+        return _iter_ndjson(body.splitlines())
+    if mimetype != "application/json":
+        raise ValueError("Request must be a JSON array or NDJSON.")
+    try:
+        items = json_codec.loads(body)
+    except ValueError as e:
+        raise ValueError(f"Invalid JSON request body: {e}")
+    if not isinstance(items, list):
+        raise ValueError("A JSON request body must be an array of documents.")
+    return items
+
+
+def _iter_ndjson(lines):
+    line_number = 0
+    for line in lines:
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            yield json_codec.loads(line)
+        except ValueError as e:
+            yield InvalidItem(f"Invalid JSON on line {line_number}: {e}")
+
+
+def item_id(item):
+    """ Returns the client's 'id' for a batch item, if it gave one. """
+    if isinstance(item, dict) and "intermediary_json" in item:
+        return item.get("id")
+    return None
+
+
+# spawn: forking a process that runs request threads could copy locks held
+# by those threads.
+_WORKER_CONTEXT = multiprocessing.get_context("spawn")
+
+
+def executor():
+    """ Returns the shared pool of conversion worker processes. """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=max(1, CONVERT_WORKERS),
+                mp_context=_WORKER_CONTEXT)
+        return _executor
+
+
+def start():
+    """
+    Starts all the worker processes of the pool. The web app calls this when
+    it runs as a script, once, before it serves requests.
+
+    The workers are started with __main__ replaced by an empty module, so
+    that they do not import the web app again, with its directory setup and
+    logging. This is safe only while no request is being served. The pool
+    starts no other worker later: in this Python version, a pool whose
+    worker died is broken rather than refilled.
+    """
+    pool = executor()
+    main_module = sys.modules["__main__"]
+    sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        # The pool launches a worker for each task submitted while none is
+        # idle, and the workers take far longer to start than this loop.
+        futures = [pool.submit(convert_items, [])
+                   for _ in range(max(1, CONVERT_WORKERS))]
+    finally:
+        sys.modules["__main__"] = main_module
+    for future in futures:
+        future.result()
+
+
+def _window():
+    # Chunks converted ahead of the one being returned. Bounds memory when a
+    # slow client reads a long stream of results.
+    return 2 * max(1, CONVERT_WORKERS)
+
+
+def convert_items(items):
+    """ Converts a chunk of batch items, in a worker process. """
+    return [convert_item(item) for item in items]
+
+
+def _chunks(items):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_converted(items):
+    """
+    Converts batch items in the worker pool, CHUNK_SIZE items per task,
+    keeping a bounded number of tasks in flight.
+
+    Args:
+        items: An iterable of items for convert_item.
+
+    Yields:
+        tuple: (index, item, response_data, status_code), in item order.
+    """
+    pending = collections.deque()
+    index = 0
+    try:
+        for chunk in _chunks(items):
+            pending.append(
+                (index, chunk, executor().submit(convert_items, chunk)))
+            index += len(chunk)
+            if len(pending) >= _window():
+                yield from _converted(*pending.popleft())
+        while pending:
+            yield from _converted(*pending.popleft())
+    finally:
+        # If the client went away, do not convert the rest.
+        for (_, _, future) in pending:
+            future.cancel()
+
+
+async def iter_converted_async(items):
+    """ Async version of iter_converted. """
+    pending = collections.deque()
+    index = 0
+    try:
+        for chunk in _chunks(items):
+            pending.append((index, chunk, asyncio.wrap_future(
+                executor().submit(convert_items, chunk))))
+            index += len(chunk)
+            if len(pending) >= _window():
+                for converted in await _converted_async(*pending.popleft()):
+                    yield converted
+        while pending:
+            for converted in await _converted_async(*pending.popleft()):
+                yield converted
+    finally:
+        for (_, _, future) in pending:
+            future.cancel()
+
+
+def _converted(first_index, chunk, future):
+    try:
+        results = future.result()
+    except Exception as e:  # E.g. a worker process died.
+        results = [_worker_error(e)] * len(chunk)
+    return _indexed_results(first_index, chunk, results)
+
+
+async def _converted_async(first_index, chunk, future):
+    try:
+        results = await future
+    except Exception as e:
+        results = [_worker_error(e)] * len(chunk)
+    return _indexed_results(first_index, chunk, results)
+
+
+def _indexed_results(first_index, chunk, results):
+    return [(first_index + offset, item, response_data, status)
+            for (offset, (item, (response_data, status)))
+            in enumerate(zip(chunk, results))]
+
+
+def _worker_error(e):
+    logging.error(f"Conversion worker failed: {e}")
+    return {"error": f"Conversion worker failed: {e}"}, 500
+
+
+def result_line(index, item, response_data, status):
+    """ Builds the result of one batch item, as a dict. """
+    result = {"index": index}
+    if item_id(item) is not None:
+        result["id"] = item_id(item)
+    if status != 200:
+        result["status"] = status
+    result.update(response_data)
+    return result
+
+
+def conversion_summary(results_count, fail_count):
+    """ Builds the final summary of a batch. """
+    return {"total_items": results_count,
+            "success_count": results_count - fail_count,
+            "fail_count": fail_count}
@@ -0,0 +1,67 @@
+import convert_batch_lib
+import json
+import os
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+DOCUMENT = {'title': 'Benefits Application', 'sections': []}
+
+
+class TestConvertBatch(unittest.TestCase):
+
+    def test_request_items_from_ndjson(self):
+        body = b'{"title": "A", "sections": []}\n\nnot json\n'
+        items = list(convert_batch_lib.request_items(body, 'application/x-ndjson'))
+        self.assertEqual(items[0], {'title': 'A', 'sections': []})
+        self.assertIsInstance(items[1], convert_batch_lib.InvalidItem)
+        self.assertIn('line 3', items[1].error)
+        with self.assertRaises(ValueError):
+            convert_batch_lib.request_items(b'{}', 'application/json')
+
+    def test_convert_item_forms_and_errors(self):
+        as_request = {'intermediary_json': json.dumps([DOCUMENT]), 'id': 'a'}
+        for item in (DOCUMENT, [DOCUMENT], as_request):
+            response_data, status = convert_batch_lib.convert_item(item)
+            self.assertEqual(status, 200)
+            self.assertIn('civiform_json', response_data)
+        self.assertEqual(convert_batch_lib.convert_item(42)[1], 400)
+        # A converter failure is reported, not raised.
+        self.assertEqual(convert_batch_lib.convert_item({'sections': []})[1], 500)
+        self.assertEqual(convert_batch_lib.result_line(
+            7, as_request, {'error': 'x'}, 400),
+            {'index': 7, 'id': 'a', 'status': 400, 'error': 'x'})
+
+    def test_iter_converted_keeps_order(self):
+        items = [DOCUMENT if i % 5 else 'bad' for i in range(40)]
+        results = list(convert_batch_lib.iter_converted(items))
+        self.assertEqual([index for (index, _, _, _) in results], list(range(40)))
+        self.assertEqual([status for (_, _, _, status) in results],
+                         [200 if i % 5 else 400 for i in range(40)])
+
+    def test_started_workers_do_not_import_the_main_module(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            marker = os.path.join(tmp_dir, 'imported')
+            script = os.path.join(tmp_dir, 'web_app.py')
+            with open(script, 'w') as f:
+                f.write(f'open({marker!r}, "w").close()\n')
+            main_module = types.ModuleType('__main__')
+            main_module.__file__ = script
+
+            with mock.patch.dict(sys.modules, {'__main__': main_module}), \
+                    mock.patch.object(convert_batch_lib, 'CONVERT_WORKERS', 2), \
+                    mock.patch.object(convert_batch_lib, '_executor', None):
+                convert_batch_lib.start()
+                self.assertIs(sys.modules['__main__'], main_module)
+                # Requests use the started workers.
+                results = list(convert_batch_lib.iter_converted(
+                    [DOCUMENT] * 40))
+                convert_batch_lib.executor().shutdown()
+            self.assertEqual([status for (_, _, _, status) in results],
+                             [200] * 40)
+            self.assertFalse(os.path.exists(marker))
+
+if __name__ == '__main__':
+    unittest.main()
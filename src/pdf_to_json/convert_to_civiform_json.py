@@ -1,12 +1,18 @@
 import json
+import json_codec
 import random
 import argparse
+import collections
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import glob
 import string
 import sys
 import os
 import uuid
 import logging
 import re
+import time
 
 # TODO
 # * templatize default config values such as "isRequired", "to-be-edited" etc
@@ -24,38 +30,42 @@ def configure_logging(debug_mode):
         level=level, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
+# Field types CiviForm supports. Others are converted as text.
+SUPPORTED_FIELD_TYPES = frozenset((
+    "name", "text", "number", "radio_button", "checkbox", "currency", "date",
+    "email", "address", "phone", "repeating_section", "fileupload"))
+
+MULTIOPTION_FIELD_TYPES = ("radio_button", "checkbox", "dropdown")
+
+
 # Replace type "textarea", "signature" as "text"
 # since CiviForm uses text for free form field
 # CiviForm does not have signature type
+def normalize_field(data):
+    """ Normalizes a field, section or form of the input, in place.
 
+    Called on each part of the input as it is converted, rather than on a
+    copy of the whole input beforehand.
 
-def replace_field_types(data):
-    if isinstance(data, dict):
-        if "type" in data:
-            data["type"] = data["type"].lower()
-            if data["type"] not in ("name", "text", "number", "radio_button",
-                                    "checkbox", "currency", "date", "email",
-                                    "address", "phone", "repeating_section",
-                                    "fileupload"):
-                logging.warning(
-                    f"Found unknown type that need to be replaced as text: {data}"
-                )
-                data["type"] = "text"
-        # make sure ID not null, and that id exist.
-        if "id" in data:
-            if data["id"] == "null":
-                new_id = "id-to-be-edited-" + uuid.uuid4().hex
-                data["id"] = new_id.lower()
-                logging.warning(
-                    f"Replaced 'id' with: {data['id']} in field: {data}"
-                )  #debug statement
-
-        return {k: replace_field_types(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        # Process each item in the list
-        return [replace_field_types(item) for item in data]
-    else:
-        return data
+    Args:
+      data: A dict of the input. Its "type", if any, is lowercased, or
+        replaced with "text" if CiviForm does not support it, and an "id" of
+        "null" is replaced with a unique placeholder.
+    """
+    if "type" in data:
+        data["type"] = data["type"].lower()
+        if data["type"] not in SUPPORTED_FIELD_TYPES:
+            logging.warning(
+                f"Found unknown type that need to be replaced as text: {data}"
+            )
+            data["type"] = "text"
+    # make sure ID not null, and that id exist.
+    if data.get("id") == "null":
+        new_id = "id-to-be-edited-" + uuid.uuid4().hex
+        data["id"] = new_id.lower()
+        logging.warning(
+            f"Replaced 'id' with: {data['id']} in field: {data}"
+        )  #debug statement
 
 
 def convert_to_base26(num):
@@ -76,9 +86,18 @@ def convert_to_base26(num):
     return ''.join(reversed(chars))
     
 
+# A number to encode in a name: a run of digits, without its leading zeros.
+_NUMBER = re.compile(r'[1-9]\d*')
+
+
+@functools.lru_cache(maxsize=65536)
 def replace_numbers_in_string(s):
     """ Replaces digits in a string with an alphabetic encoding.
 
+    Each number is encoded on its own, in a single pass over the string, so
+    "a1_b10" becomes "aa_bj". Memoized: forms repeat the same ids, and
+    conversions of many forms repeat the same id patterns.
+
     Args:
       s: A string, typically a field name.
 
@@ -86,63 +105,131 @@ def replace_numbers_in_string(s):
       String with any digits (other than a solitary 0) converted to
       a base 26 letter encoding.
     """
-    while (re.search('[1-9]\d*', s)):
-        match = re.search('[1-9]\d*', s)
-        if match:
-            s = re.sub(match.group(0),
-                       convert_to_base26(int(match.group(0))), s)
-        else:
-            break
-    return s
-
-def create_question(field, question_id, enumerator_id=None):
-    is_multioption = field["type"] in ["radio_button", "checkbox", "dropdown"]
-    is_enumerator = field["type"] == "enumerator"
-    is_fileupload = field["type"] == "fileupload"
-
-    question = {
-        "type":
-            "multioption" if is_multioption else
-            "fileupload" if is_fileupload else field["type"],
-        "config":
+    return _NUMBER.sub(lambda match: convert_to_base26(int(match.group(0))), s)
+
+
+class QuestionNames:
+    """ The question names of a program, kept unique.
+
+    Field ids become question names through replace_numbers_in_string, and
+    different ids (or the same id, repeated by the LLM) can end up with the
+    same name, which CiviForm rejects. A name already taken gets the first
+    free suffix "_b", "_c", ... in order of appearance, so a form always
+    converts to the same names.
+    """
+
+    def __init__(self):
+        self._taken = set()
+        # For each name, the suffix to try next.
+        self._next_suffix = {}
+
+    def unique_name(self, field_id):
+        """ Returns the question name for a field id, unique in the program. """
+        name = replace_numbers_in_string(field_id)
+        if name not in self._taken:
+            self._taken.add(name)
+            return name
+        suffix = self._next_suffix.get(name, 2)
+        while f"{name}_{convert_to_base26(suffix)}" in self._taken:
+            suffix += 1
+        unique = f"{name}_{convert_to_base26(suffix)}"
+        self._next_suffix[name] = suffix + 1
+        self._taken.add(unique)
+        logging.warning(
+            f"Question name '{name}' (field id '{field_id}') is taken, renamed to '{unique}'.")
+        return unique
+
+
+# The parts of a question that only depend on its field type, see
+# _question_template.
+_QuestionTemplate = collections.namedtuple(
+    '_QuestionTemplate',
+    ['question_type', 'is_multioption', 'validation_predicates'])
+
+_OPTION_ADMIN_NAME_SEPARATORS = re.compile(r'[^a-z0-9]+')
+
+
+@functools.lru_cache(maxsize=None)
+def _question_template(field_type):
+    """ Returns the _QuestionTemplate of a field type, built once per type. """
+    is_multioption = field_type in MULTIOPTION_FIELD_TYPES
+    question_type = "multioption" if is_multioption else field_type
+
+    # Set validationPredicates based on question type
+    validation_predicates = {"type": question_type}
+    if field_type == "enumerator":
+        validation_predicates.update(minEntities=None, maxEntities=None)
+    elif field_type == "fileupload":
+        validation_predicates["maxFiles"] = 3  #TODO default value
+    elif question_type == "address":
+        validation_predicates["disallowPoBox"] = False
+    elif question_type == "multioption":
+        # maxChoicesAllowed, which depends on the field, follows.
+        validation_predicates["minChoicesRequired"] = 1
+    elif question_type in ("id", "text"):
+        validation_predicates.update(minLength=None, maxLength=None)
+    elif question_type == "number":
+        validation_predicates.update(min=None, max=None)
+
+    return _QuestionTemplate(question_type, is_multioption,
+                             tuple(validation_predicates.items()))
+
+
+def create_question(field, question_id, enumerator_id=None,
+                    question_names=None):
+    """ Builds the CiviForm question of a (normalized) field.
+
+    Args:
+      field: The field, see normalize_field.
+      question_id: The question's id in the program.
+      enumerator_id: The id of the enumerator question of the repeating
+        section the field belongs to, if any.
+      question_names: The QuestionNames of the program, to keep the
+        question's name unique in it.
+
+    Returns:
+      The question, as a dict.
+    """
+    template = _question_template(field["type"])
+    validation_predicates = dict(template.validation_predicates)
+    config = {
+        "name":
+            question_names.unique_name(field["id"])
+            if question_names else replace_numbers_in_string(field["id"]),
+        "description": field["label"],
+        "questionText":
             {
-                "name": replace_numbers_in_string(field["id"]),
-                "description": field["label"],
-                "questionText":
-                    {
-                        "translations": {
-                            "en_US": field["label"]
-                        },
-                        "isRequired": True
-                    },
-                "questionHelpText":
-                    {
-                        "translations": {
-                            "en_US": field.get("help_text") or ""
-                        },
-                        "isRequired": True
-                    },
-                # Initialize validationPredicates with the basic structure
-                "validationPredicates":
-                    {
-                        "type":
-                            "multioption" if is_multioption else
-                            "fileupload" if is_fileupload else field["type"]
-                    },
-                "id": question_id,
-                "universal": False,
-                "displayMode" : "VISIBLE",
-                "primaryApplicantInfoTags": []
-            }
+                "translations": {
+                    "en_US": field["label"]
+                },
+                "isRequired": True
+            },
+        "questionHelpText":
+            {
+                "translations": {
+                    "en_US": field.get("help_text") or ""
+                },
+                "isRequired": True
+            },
+        "validationPredicates": validation_predicates,
+        "id": question_id,
+        "universal": False,
+        "displayMode" : "VISIBLE",
+        "primaryApplicantInfoTags": []
     }
+    # Conditionally add enumeratorId for repeated questions
+    if enumerator_id is not None:
+        config["enumeratorId"] = enumerator_id
+    question = {"type": template.question_type, "config": config}
 
-    if is_multioption:
+    if template.is_multioption:
         question_options = []
         option_admin_names = []
 
         if "options" in field:
             for idx, option in enumerate(field.get("options",), start=1):
-                option_admin_name = re.sub(r'[^a-z0-9]+', '_', option.lower())
+                option_admin_name = _OPTION_ADMIN_NAME_SEPARATORS.sub(
+                    '_', option.lower())
 
                 # check if option name is invalid (empty)
                 if not option_admin_name:
@@ -195,8 +282,12 @@ def create_question(field, question_id, enumerator_id=None):
             "type"] == "radio_button" else "CHECKBOX"
         question["optionAdminNames"] = option_admin_names
         question["options"] = question_options
+        if field["type"] == "radio_button":
+            validation_predicates["maxChoicesAllowed"] = 1
+        else:  # For other multioption types (like checkbox), keep the original logic
+            validation_predicates["maxChoicesAllowed"] = len(field.get("options",))
 
-    if is_enumerator:
+    if field["type"] == "enumerator":
         question["entityType"] = {
             "translations":
                 {
@@ -205,106 +296,61 @@ def create_question(field, question_id, enumerator_id=None):
             "isRequired": True
         }
 
-        question["config"]["validationPredicates"] = {
-            "type": "enumerator",
-            "minEntities": None,
-            "maxEntities": None
-        }
-
-    if is_fileupload:
-        question["config"]["validationPredicates"][
-            "maxFiles"] = 3  #TODO default value
-
-    # Conditionally add enumeratorId for repeated questions
-    if enumerator_id is not None:
-        question["config"]["enumeratorId"] = enumerator_id
-
-    # Set validationPredicates based on question type
-    if question["type"] == "address":
-        question["config"]["validationPredicates"]["disallowPoBox"] = False
-    elif question["type"] == "multioption":
-        question["config"]["validationPredicates"]["minChoicesRequired"] = 1
-        # Set maxChoicesAllowed to 1 if it's a radio button question
-        if field["type"] == "radio_button":
-            question["config"]["validationPredicates"]["maxChoicesAllowed"] = 1
-        else:  # For other multioption types (like checkbox), keep the original logic
-            question["config"]["validationPredicates"][
-                "maxChoicesAllowed"] = len(field.get("options",))
-    elif question["type"] == "id":
-        question["config"]["validationPredicates"]["minLength"] = None
-        question["config"]["validationPredicates"]["maxLength"] = None
-    elif question["type"] == "number":
-        question["config"]["validationPredicates"]["min"] = None
-        question["config"]["validationPredicates"]["max"] = None
-    elif question["type"] == "text":
-        question["config"]["validationPredicates"]["minLength"] = None
-        question["config"]["validationPredicates"]["maxLength"] = None
-
     return question
 
 
-def handle_repeating_section(section, question_id, block_id, output):
-    # entity_type_label = section["fields"][0]["label"] # using the first table column as entity_type
-    entity_type_label = section.get(
-        "entity_nickname") or section["fields"][0]["label"]
+def _question_definition(question_id, optional=True):
+    """ Returns the reference to a question in a block. """
+    return {
+        "id": question_id,
+        "optional": optional,
+        "addressCorrectionEnabled": False
+    }
 
-    enumerator_question = create_question(
-        {
-            "type": "enumerator",
-            "id": section["title"],
-            "label": entity_type_label
-        }, question_id)
-    output["questions"].append(enumerator_question)
-    enumerator_id = question_id
-    question_id += 1
 
+def _repeating_section_blocks(section, question_id, block_id):
+    """ Builds the two blocks of a repeating section: the enumerator screen,
+    and the repeated screen of its fields.
+    """
     # Create separate screen for the enumerator question
-    output["program"]["blockDefinitions"].append(
-        {
-            "id":
-                block_id,
-            "name":
-                section["title"],
-            "description":
-                section["title"],
-            "localizedName":
-                {
-                    "translations": {
-                        "en_US": section["title"]
-                    },
-                    "isRequired": True
-                },
-            "localizedDescription":
-                {
-                    "translations":
-                        {
-                            "en_US":
-                                section.get(
-                                    "help_text",
-                                    "localizedDescription-TO-BE-EDITED")
-                        },
-                    "isRequired": True
+    enumerator_block = {
+        "id":
+            block_id,
+        "name":
+            section["title"],
+        "description":
+            section["title"],
+        "localizedName":
+            {
+                "translations": {
+                    "en_US": section["title"]
                 },
-            "localizedEligibilityMessage":
-                None,
-            "hidePredicate":
-                None,
-            "optionalPredicate":
-                None,
-            "questionDefinitions":
-                [
+                "isRequired": True
+            },
+        "localizedDescription":
+            {
+                "translations":
                     {
-                        "id": enumerator_id,
-                        "optional": False,
-                        "addressCorrectionEnabled": False
-                    }
-                ]
-        })
-    block_id += 1  # Increment block_id after creating the enumerator block
+                        "en_US":
+                            section.get(
+                                "help_text",
+                                "localizedDescription-TO-BE-EDITED")
+                    },
+                "isRequired": True
+            },
+        "localizedEligibilityMessage":
+            None,
+        "hidePredicate":
+            None,
+        "optionalPredicate":
+            None,
+        "questionDefinitions":
+            [_question_definition(question_id, optional=False)]
+    }
 
     # Create repeated screen for the repeated questions
     repeated_block = {
-        "id": block_id,
+        "id": block_id + 1,
         "name": f"{section['title']} - Details",
         "description": f"Fields for {section['title']}",
         "localizedName":
@@ -324,53 +370,44 @@ def handle_repeating_section(section, question_id, block_id, output):
         "localizedEligibilityMessage": None,
         "hidePredicate": None,
         "optionalPredicate": None,
-        "questionDefinitions": [],
-        "repeaterId": block_id - 1  # Link to the enumerator screen's ID
+        "questionDefinitions": [
+            _question_definition(question_id + i)
+            for i in range(1, len(section["fields"]) + 1)
+        ],
+        "repeaterId": block_id  # Link to the enumerator screen's ID
     }
-
-    for field in section["fields"]:
-        question = create_question(field, question_id, enumerator_id)
-        question["config"]["questionText"]["translations"][
-            "en_US"] = f"{field['label']} for $this"
-        output["questions"].append(question)
-        repeated_block["questionDefinitions"].append(
-            {
-                "id": question_id,
-                "optional": True,
-                "addressCorrectionEnabled": False
-            })
-        question_id += 1
-
-    output["program"]["blockDefinitions"].append(repeated_block)
-    block_id += 1
-    return question_id, block_id
+    return [enumerator_block, repeated_block]
 
 
-def convert_to_civiform_json(unprocessed_input_json):
-    logging.info("converting to CiviForm json ... ")
+def _iter_blocks(input_json):
+    """ Yields the blocks (screens) of the program, one or two per section.
 
-    input_json = replace_field_types(unprocessed_input_json)
+    Normalizes the sections and their fields on the way, see normalize_field,
+    which _iter_questions relies on.
+    """
+    question_id = 1
+    block_id = 1
+    for section in input_json["sections"]:
+        normalize_field(section)
+        for field in section["fields"]:
+            normalize_field(field)
 
-    program_id = random.randint(1, 1000)
-    output = {
-        "program":
-            {
+        if section.get("type") == "repeating_section":
+            blocks = _repeating_section_blocks(section, question_id, block_id)
+            question_id += 1  # The enumerator question
+        else:
+            blocks = [{
                 "id":
-                    program_id,
-                "adminName":
-                    input_json["title"].lower().replace(" ", "_")[:8] +
-                    str(program_id),
-                "adminDescription":
-                    "program-adminDescription-TO-BE-EDITED",
-                "externalLink":
-                    "",
-                "displayMode":
-                    "PUBLIC",
-                "notificationPreferences": [],
+                    block_id,
+                "name":
+                    section["title"],
+                "description":
+                    "" if section.get("help_text") is None else section.get(
+                        "help_text", "block-description-TO-BE-EDITED"),
                 "localizedName":
                     {
                         "translations": {
-                            "en_US": input_json["title"]
+                            "en_US": section["title"]
                         },
                         "isRequired": True
                     },
@@ -379,139 +416,465 @@ def convert_to_civiform_json(unprocessed_input_json):
                         "translations":
                             {
                                 "en_US":
-                                    input_json.get("help_text") or
-                                    "program-localizedDescription-TO-BE-EDITED"
+                                    section.get(
+                                        "help_text",
+                                        "block-localizedDescription-TO-BE-EDITED")
                             },
                         "isRequired": True
                     },
-                "localizedShortDescription":
+                "localizedEligibilityMessage":
+                    None,
+                "hidePredicate":
+                    None,
+                "optionalPredicate":
+                    None,
+                "questionDefinitions": [
+                    _question_definition(question_id + i)
+                    for i in range(len(section["fields"]))
+                ]
+            }]
+        question_id += len(section["fields"])
+        block_id += len(blocks)
+        yield from blocks
+
+
+def _iter_questions(input_json):
+    """ Yields the questions of the program, in the order of the input's
+    fields, with ids matching the blocks of _iter_blocks.
+    """
+    question_id = 1
+    question_names = QuestionNames()
+    for section in input_json["sections"]:
+        enumerator_id = None
+        if section.get("type") == "repeating_section":
+            # entity_type_label = section["fields"][0]["label"] # using the first table column as entity_type
+            entity_type_label = section.get(
+                "entity_nickname") or section["fields"][0]["label"]
+            yield create_question(
+                {
+                    "type": "enumerator",
+                    "id": section["title"],
+                    "label": entity_type_label
+                }, question_id, question_names=question_names)
+            enumerator_id = question_id
+            question_id += 1
+
+        for field in section["fields"]:
+            question = create_question(
+                field, question_id, enumerator_id, question_names)
+            if enumerator_id is not None:
+                question["config"]["questionText"]["translations"][
+                    "en_US"] = f"{field['label']} for $this"
+            yield question
+            question_id += 1
+
+
+def _program_definition(input_json):
+    """ Builds the program of a (normalized) form, without its blocks. """
+    program_id = random.randint(1, 1000)
+    return {
+        "id":
+            program_id,
+        "adminName":
+            input_json["title"].lower().replace(" ", "_")[:8] +
+            str(program_id),
+        "adminDescription":
+            "program-adminDescription-TO-BE-EDITED",
+        "externalLink":
+            "",
+        "displayMode":
+            "PUBLIC",
+        "notificationPreferences": [],
+        "localizedName":
+            {
+                "translations": {
+                    "en_US": input_json["title"]
+                },
+                "isRequired": True
+            },
+        "localizedDescription":
+            {
+                "translations":
                     {
-                        "translations":
-                            {
-                                "en_US":
-                                    input_json.get("help_text") or
-                                    "program-localizedShortDescriptionTO-BE-EDITED"
-                            },
-                        "isRequired": True
+                        "en_US":
+                            input_json.get("help_text") or
+                            "program-localizedDescription-TO-BE-EDITED"
                     },
-                "localizedConfirmationMessage":
+                "isRequired": True
+            },
+        "localizedShortDescription":
+            {
+                "translations":
                     {
-                        "translations":
-                            {
-                                "en_US":
-                                    "program-localizedConfirmationMessageTO-BE-EDITED"
-                            },
-                        "isRequired": True
+                        "en_US":
+                            input_json.get("help_text") or
+                            "program-localizedShortDescriptionTO-BE-EDITED"
                     },
-                "blockDefinitions": [],
-                "programType":
-                    "DEFAULT",
-                "eligibilityIsGating":
-                    True,
-                "acls": {
-                    "tiProgramViewAcls": []
-                },
-                "localizedSummaryImageDescription":
-                    None,
-                "categories": [],
-                "bridgeDefinitions": {},
-                "applicationSteps":
-                    [
+                "isRequired": True
+            },
+        "localizedConfirmationMessage":
+            {
+                "translations":
+                    {
+                        "en_US":
+                            "program-localizedConfirmationMessageTO-BE-EDITED"
+                    },
+                "isRequired": True
+            },
+        "blockDefinitions": [],
+        "programType":
+            "DEFAULT",
+        "eligibilityIsGating":
+            True,
+        "acls": {
+            "tiProgramViewAcls": []
+        },
+        "localizedSummaryImageDescription":
+            None,
+        "categories": [],
+        "bridgeDefinitions": {},
+        "applicationSteps":
+            [
+                {
+                    "title":
                         {
-                            "title":
+                            "translations":
                                 {
-                                    "translations":
-                                        {
-                                            "en_US":
-                                                "program-applicationSteps TO-BE-EDITED"
-                                        },
-                                    "isRequired": True
+                                    "en_US":
+                                        "program-applicationSteps TO-BE-EDITED"
                                 },
-                            "description":
+                            "isRequired": True
+                        },
+                    "description":
+                        {
+                            "translations":
                                 {
-                                    "translations":
-                                        {
-                                            "en_US":
-                                                input_json.get("Instructions") or "program-applicationSteps description TO-BE-EDITED"
-                                        },
-                                    "isRequired": True
-                                }
+                                    "en_US":
+                                        input_json.get("Instructions") or "program-applicationSteps description TO-BE-EDITED"
+                                },
+                            "isRequired": True
                         }
-                    ]
-            },
-        "questions": []
+                }
+            ]
     }
 
-    question_id = 1
-    block_id = 1
-    for section in input_json["sections"]:
-        block = {
-            "id":
-                block_id,
-            "name":
-                section["title"],
-            "description":
-                "" if section.get("help_text") is None else section.get(
-                    "help_text", "block-description-TO-BE-EDITED"),
-            "localizedName":
-                {
-                    "translations": {
-                        "en_US": section["title"]
-                    },
-                    "isRequired": True
-                },
-            "localizedDescription":
-                {
-                    "translations":
-                        {
-                            "en_US":
-                                section.get(
-                                    "help_text",
-                                    "block-localizedDescription-TO-BE-EDITED")
-                        },
-                    "isRequired": True
-                },
-            "localizedEligibilityMessage":
-                None,
-            "hidePredicate":
-                None,
-            "optionalPredicate":
-                None,
-            "questionDefinitions": []
-        }
 
-        if section.get("type") == "repeating_section":
-            question_id, block_id = handle_repeating_section(
-                section, question_id, block_id, output)
-            # Note: block_id is incremented within handle_repeating_section
-        else:
-            for field in section["fields"]:
-                question = create_question(field, question_id)
-                output["questions"].append(question)
-                block["questionDefinitions"].append(
-                    {
-                        "id": question_id,
-                        "optional": True,
-                        "addressCorrectionEnabled": False
-                    })
-                question_id += 1
+def convert_to_civiform_json(unprocessed_input_json):
+    """ Converts an intermediary form to CiviForm program JSON.
+
+    Args:
+      unprocessed_input_json: The form (a dict). It is normalized in place,
+        see normalize_field.
+
+    Returns:
+      The CiviForm JSON string.
+    """
+    return json_codec.dumps_exact(
+        civiform_program(unprocessed_input_json), indent=2)
+
+
+def civiform_program(unprocessed_input_json):
+    """ Builds the CiviForm program of an intermediary form.
+
+    Returns:
+      The program and its questions, as a dict.
+    """
+    logging.info("converting to CiviForm json ... ")
+
+    input_json = unprocessed_input_json
+    normalize_field(input_json)
+
+    program = _program_definition(input_json)
+    program["blockDefinitions"].extend(_iter_blocks(input_json))
+    return {"program": program, "questions": list(_iter_questions(input_json))}
+
+
+# Encodes like json.dumps(obj, indent=2), without creating an encoder per call.
+_INDENTED_ENCODER = json.JSONEncoder(indent=2)
+
+# Where the blocks and questions go in the indented JSON of a program.
+_BLOCK_DEFINITIONS_KEY = '\n    "blockDefinitions": '
+_QUESTIONS_KEY = '\n  "questions": '
+
+
+def _iter_json_array(items, depth):
+    """ Yields a JSON array of items, piece by piece, as json.dumps(...,
+    indent=2) writes it at the given depth of nesting.
+    """
+    item_indent = "\n" + "  " * (depth + 1)
+    separator = "[" + item_indent
+    for item in items:
+        yield separator + _INDENTED_ENCODER.encode(item).replace(
+            "\n", item_indent)
+        separator = "," + item_indent
+    if separator.startswith("["):
+        yield "[]"
+    else:
+        yield "\n" + "  " * depth + "]"
+
+
+def iter_civiform_json(unprocessed_input_json):
+    """ Converts an intermediary form to CiviForm program JSON, piece by piece.
+
+    Joined, the pieces are exactly the output of convert_to_civiform_json,
+    but only one block or question is held in memory at a time, instead of
+    the whole program and its JSON.
+
+    Args:
+      unprocessed_input_json: The form (a dict). It is normalized in place,
+        see normalize_field.
+
+    Yields:
+      Strings of CiviForm JSON. A field that cannot be converted raises
+      ValueError after part of the JSON was yielded, see write_civiform_json.
+    """
+    logging.info("converting to CiviForm json ... ")
+
+    input_json = unprocessed_input_json
+    normalize_field(input_json)
+
+    # The program without blocks and questions. Its JSON is cut where they go
+    # (newlines only occur between values, never inside strings).
+    skeleton = _INDENTED_ENCODER.encode(
+        {"program": _program_definition(input_json), "questions": []})
+    head, _, tail = skeleton.partition(_BLOCK_DEFINITIONS_KEY + "[]")
+    program_tail, _, end = tail.partition(_QUESTIONS_KEY + "[]")
+
+    yield head + _BLOCK_DEFINITIONS_KEY
+    yield from _iter_json_array(_iter_blocks(input_json), 2)
+    yield program_tail + _QUESTIONS_KEY
+    yield from _iter_json_array(_iter_questions(input_json), 1)
+    yield end
+
+
+def write_civiform_json(unprocessed_input_json, f):
+    """ Converts an intermediary form and writes its CiviForm JSON to a binary
+    file as it is generated, see iter_civiform_json.
+
+    If the form cannot be converted, the exception is raised with part of
+    the JSON written. Use save_civiform_json to write a file by name.
+    """
+    for piece in iter_civiform_json(unprocessed_input_json):
+        f.write(piece.encode("utf-8"))
+
+
+def save_civiform_json(unprocessed_input_json, output_path):
+    """ Converts an intermediary form and saves its CiviForm JSON to a file.
+
+    The JSON is written as it is generated under a temporary name, and the
+    file renamed to output_path once complete: a form that cannot be
+    converted leaves no partial file behind.
+    """
+    tmp_path = f"{output_path}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            write_civiform_json(unprocessed_input_json, f)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# Intermediary files converted per task of a convert_many worker process.
+CONVERT_MANY_CHUNK_SIZE = 32
+
+# The outcome of converting one file with convert_many. error is None on
+# success; output_path is None on failure.
+ConversionResult = collections.namedtuple('ConversionResult', [
+    'input_path', 'output_path', 'error', 'input_bytes', 'seconds'])
+
+
+def output_path_for(input_path, output_dir=None):
+    """ Returns where the CiviForm JSON of an intermediary file is saved.
+
+    Args:
+      input_path: The intermediary JSON file.
+      output_dir: The output directory, by default the input's directory.
+
+    Returns:
+      "<output_dir>/<input name>-civiform.json".
+    """
+    base_name, _ = os.path.splitext(os.path.basename(input_path))
+    directory = output_dir if output_dir else os.path.dirname(input_path)
+    return os.path.join(directory, f"{base_name}-civiform.json")
+
+
+def is_many_files(path):
+    """ Whether the input path names many files: a directory, or a glob
+    pattern. A path that exists as given is never a pattern, even if it has
+    glob characters such as "[" in its name. """
+    if os.path.isdir(path):
+        return True
+    return not os.path.exists(path) and any(c in path for c in "*?[")
+
+
+def input_files(pattern):
+    """ Lists the intermediary JSON files named by a directory or glob.
 
-            output["program"]["blockDefinitions"].append(block)
-            block_id += 1
+    Args:
+      pattern: A directory, whose *.json files are listed (except the
+        *-civiform.json outputs of a previous conversion), or a glob pattern
+        such as "output-json/*-post-processed-formated-*.json". "**" matches
+        subdirectories. An existing file is listed as is.
+
+    Returns:
+      The sorted file paths.
+    """
+    if os.path.isdir(pattern):
+        return sorted(
+            os.path.join(pattern, name) for name in os.listdir(pattern)
+            if name.endswith(".json") and not name.endswith("-civiform.json"))
+    if os.path.isfile(pattern):
+        return [pattern]
+    return sorted(path for path in glob.glob(pattern, recursive=True)
+                  if os.path.isfile(path))
+
+
+def convert_file(input_path, output_path):
+    """ Converts an intermediary JSON file to a CiviForm JSON file.
+
+    The file may hold the form itself, or a list whose first element is the
+    form, as saved by the pipeline.
+
+    Returns:
+      A ConversionResult. Errors are reported in it, not raised.
+    """
+    started = time.perf_counter()
+    input_bytes = 0
+    try:
+        with open(input_path, "rb") as f:
+            data = f.read()
+        input_bytes = len(data)
+        unprocessed_input_json = json_codec.loads(data)
+        if isinstance(unprocessed_input_json, list):
+            if not unprocessed_input_json:
+                raise ValueError("the intermediary JSON is an empty list")
+            unprocessed_input_json = unprocessed_input_json[0]
+        save_civiform_json(unprocessed_input_json, output_path)
+        error = None
+    except Exception as e:
+        output_path = None
+        error = f"{type(e).__name__}: {e}"
+    return ConversionResult(input_path, output_path, error, input_bytes,
+                            time.perf_counter() - started)
+
+
+def _convert_files(paths):
+    """ Converts a chunk of (input_path, output_path) pairs. """
+    return [convert_file(input_path, output_path)
+            for (input_path, output_path) in paths]
+
+
+def _chunks(items, chunk_size):
+    for start in range(0, len(items), chunk_size):
+        yield items[start:start + chunk_size]
 
-    return json.dumps(output, indent=2)
+
+def convert_many(input_paths, output_dir=None, workers=None,
+                 chunk_size=CONVERT_MANY_CHUNK_SIZE):
+    """ Converts many intermediary JSON files in a pool of processes.
+
+    Each worker reads, converts and writes the files of a chunk of
+    chunk_size files; only their paths and results go between processes.
+
+    Args:
+      input_paths: The intermediary JSON files, e.g. from input_files().
+      output_dir: Where to save the CiviForm JSON, see output_path_for().
+      workers: Number of worker processes, by default one per CPU. With 1,
+        files are converted in this process.
+      chunk_size: Files per task sent to a worker.
+
+    Yields:
+      A ConversionResult per file, in input order.
+    """
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    paths = [(input_path, output_path_for(input_path, output_dir))
+             for input_path in input_paths]
+    chunks = _chunks(paths, max(1, chunk_size))
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(paths) <= chunk_size:
+        for chunk in chunks:
+            yield from _convert_files(chunk)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for results in executor.map(_convert_files, chunks):
+            yield from results
+
+
+def conversion_summary(results, elapsed_seconds):
+    """ Summarizes convert_many results: counts and throughput. """
+    converted = sum(1 for result in results if result.error is None)
+    input_bytes = sum(result.input_bytes for result in results)
+    elapsed_seconds = max(elapsed_seconds, 1e-9)
+    return {
+        "total_files": len(results),
+        "success_count": converted,
+        "fail_count": len(results) - converted,
+        "input_bytes": input_bytes,
+        "elapsed_seconds": round(elapsed_seconds, 3),
+        "files_per_second": round(len(results) / elapsed_seconds, 1),
+        "mb_per_second": round(input_bytes / elapsed_seconds / 1e6, 2),
+    }
+
+
+def main_many(args):
+    """ Converts the files named by a directory or glob, see convert_many. """
+    input_paths = input_files(args.input_file)
+    if not input_paths:
+        print(f"Error: No JSON files match '{args.input_file}'.")
+        sys.exit(1)
+    workers = args.workers or os.cpu_count() or 1
+    print(f"Converting {len(input_paths)} files with {workers} workers.")
+
+    started = time.perf_counter()
+    results = []
+    for result in convert_many(input_paths, args.output_dir, workers):
+        results.append(result)
+        if result.error is not None:
+            print(f"Error: {result.input_path}: {result.error}")
+    summary = conversion_summary(results, time.perf_counter() - started)
+
+    print(f"Converted {summary['success_count']} of {summary['total_files']} files "
+          f"({summary['fail_count']} failed) in {summary['elapsed_seconds']}s: "
+          f"{summary['files_per_second']} files/s, "
+          f"{summary['mb_per_second']} MB/s.")
+    if summary["fail_count"]:
+        sys.exit(1)
 
 
 def main():
     parser = argparse.ArgumentParser(
         description="Convert JSON to CiviForm format.")
-    parser.add_argument("input_file", help="Path to the input JSON file.")
+    parser.add_argument(
+        "input_file",
+        help="Path to the input JSON file, or a directory or glob pattern "
+        "(quoted) of files to convert in parallel. A path that exists is "
+        "never read as a pattern.")
     parser.add_argument("-o", "--output", help="Path to the output JSON file.")
+    parser.add_argument(
+        "--output-dir",
+        help="Output directory when converting many files (default: next to "
+        "each input). Outputs are named <input name>-civiform.json.")
+    parser.add_argument(
+        "-w", "--workers", type=int,
+        help="Worker processes when converting many files (default: one per "
+        "CPU).")
     parser.add_argument(
         "-d", "--debug", action="store_true", help="Enable debug mode.")
     args = parser.parse_args()
     configure_logging(args.debug)
 
+    if is_many_files(args.input_file):
+        if args.output:
+            parser.error("use --output-dir when converting many files")
+        if not args.debug:
+            # One line per converted file would drown out the errors.
+            logging.getLogger().setLevel(logging.WARNING)
+        main_many(args)
+        return
+
     base_filename = os.path.basename(args.input_file)
     base_name, _ = os.path.splitext(base_filename)
     output_filename = args.output if args.output else f"{base_name}-civiform.json"
@@ -519,12 +882,9 @@ def main():
 
     try:
         with open(args.input_file, "r") as f:
-            unprocessed_input_json = json.load(f)
-
-        civiform_json = convert_to_civiform_json(unprocessed_input_json)
+            unprocessed_input_json = json_codec.loads(f.read())
 
-        with open(output_filename, "w") as f:
-            f.write(civiform_json)
+        save_civiform_json(unprocessed_input_json, output_filename)
 
         logging.info(f"Converted JSON saved to {output_filename}. Done!")
 
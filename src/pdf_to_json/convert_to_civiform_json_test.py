@@ -0,0 +1,179 @@
+import convert_to_civiform_json as converter
+import copy
+import io
+import json
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+import uuid
+
+FORM = {
+    "title": "Test Form",
+    "help_text": "help",
+    "sections": [{
+        "title": "S1",
+        "help_text": "h",
+        "fields": [{"label": "Name", "type": "text", "id": "name1"}],
+    }],
+}
+
+
+class TestQuestionNames(unittest.TestCase):
+
+    def test_replace_numbers_in_string(self):
+        self.assertEqual(converter.replace_numbers_in_string("a1_b10"), "aa_bj")
+        self.assertEqual(converter.replace_numbers_in_string("line_0"), "line_0")
+        self.assertEqual(converter.replace_numbers_in_string("id_007"), "id_00g")
+        self.assertEqual(converter.replace_numbers_in_string("page100"), "pagecv")
+        # Each number on its own: "1" is not replaced inside "10".
+        self.assertEqual(converter.replace_numbers_in_string("x1y10"), "xayj")
+
+    def test_colliding_names_get_deterministic_suffixes(self):
+        names = converter.QuestionNames()
+        self.assertEqual(
+            [names.unique_name(field_id) for field_id in
+             ("name_1", "name_a", "name_a", "name_a_b", "name_1")],
+            ["name_a", "name_a_b", "name_a_c", "name_a_b_b", "name_a_d"])
+
+    def test_converted_program_has_unique_question_names(self):
+        form = {"title": "T", "sections": [{
+            "title": "S",
+            "fields": [{"label": "L", "type": "text", "id": field_id}
+                       for field_id in ("age_1", "age_a", "age_1")]}]}
+        civiform = json.loads(converter.convert_to_civiform_json(form))
+        self.assertEqual(
+            [question["config"]["name"] for question in civiform["questions"]],
+            ["age_a", "age_a_b", "age_a_c"])
+
+
+class TestConversion(unittest.TestCase):
+
+    def test_normalizes_fields_while_converting(self):
+        form = {"title": "T", "sections": [{
+            "title": "S",
+            "fields": [
+                {"label": "A", "type": "Radio_Button", "id": "a",
+                 "options": ["Yes", "No"]},
+                {"label": "B", "type": "signature", "id": "null"}]}]}
+        program = converter.civiform_program(form)
+
+        fields = form["sections"][0]["fields"]
+        self.assertEqual([field["type"] for field in fields],
+                         ["radio_button", "text"])
+        self.assertTrue(fields[1]["id"].startswith("id-to-be-edited-"))
+        self.assertEqual(
+            [question["config"]["validationPredicates"]
+             for question in program["questions"]],
+            [{"type": "multioption", "minChoicesRequired": 1,
+              "maxChoicesAllowed": 1},
+             {"type": "text", "minLength": None, "maxLength": None}])
+
+
+class TestStreaming(unittest.TestCase):
+
+    def converted(self, function, form):
+        random.seed(0)
+        with mock.patch.object(uuid, "uuid4", return_value=uuid.UUID(int=1)):
+            return function(copy.deepcopy(form))
+
+    def test_streamed_json_is_identical(self):
+        forms = [FORM, {"title": "Ñandú", "sections": []}, {
+            "title": "T",
+            "help_text": "h",
+            "sections": [
+                {"title": "Kids", "type": "Repeating_Section",
+                 "entity_nickname": "Kid",
+                 "fields": [{"label": "Age", "type": "number", "id": "null"}]},
+                {"title": "Empty", "fields": []},
+                {"title": "S", "help_text": None, "fields": [
+                    {"label": "Pick \"one\"\n", "type": "checkbox",
+                     "id": "p1", "options": ["A", "B"]}]}]}]
+        for form in forms:
+            expected = self.converted(converter.convert_to_civiform_json, form)
+            self.assertEqual(
+                self.converted(
+                    lambda f: "".join(converter.iter_civiform_json(f)), form),
+                expected)
+            output = io.BytesIO()
+            self.converted(
+                lambda f: converter.write_civiform_json(f, output), form)
+            self.assertEqual(output.getvalue().decode("utf-8"), expected)
+
+    def test_failed_save_leaves_no_file(self):
+        form = {"title": "T", "sections": [{"title": "S", "fields": [
+            {"label": "R", "type": "radio_button", "id": "r",
+             "options": ["Only"]}]}]}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "out.json")
+            with self.assertRaises(ValueError):
+                converter.save_civiform_json(form, path)
+            self.assertEqual(os.listdir(tmp_dir), [])
+
+
+class TestConvertMany(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.input_dir = os.path.join(self.tmp_dir.name, 'in')
+        self.output_dir = os.path.join(self.tmp_dir.name, 'out')
+        os.makedirs(self.input_dir)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.input_dir, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def test_converts_files_in_order_and_reports_errors(self):
+        paths = [self.write(f'{i}.json', json.dumps([FORM])) for i in range(5)]
+        paths.insert(2, self.write('bad.json', '{not json'))
+
+        results = list(converter.convert_many(
+            paths, self.output_dir, workers=2, chunk_size=2))
+
+        self.assertEqual([result.input_path for result in results], paths)
+        self.assertIsNotNone(results[2].error)
+        self.assertIsNone(results[2].output_path)
+        for result in results[:2] + results[3:]:
+            self.assertIsNone(result.error)
+            with open(result.output_path, encoding='utf-8') as f:
+                civiform = json.load(f)
+            self.assertEqual(
+                civiform["program"]["localizedName"]["translations"]["en_US"],
+                "Test Form")
+
+        summary = converter.conversion_summary(results, 1.0)
+        self.assertEqual((summary["success_count"], summary["fail_count"]),
+                         (5, 1))
+
+    def test_input_files_skips_previous_outputs(self):
+        form = self.write('a.json', json.dumps(FORM))
+        self.write('a-civiform.json', '{}')
+        self.write('notes.txt', '')
+        self.assertEqual(converter.input_files(self.input_dir), [form])
+        self.assertEqual(
+            converter.input_files(os.path.join(self.input_dir, '*.txt')),
+            [os.path.join(self.input_dir, 'notes.txt')])
+        self.assertEqual(
+            converter.output_path_for(form, self.output_dir),
+            os.path.join(self.output_dir, 'a-civiform.json'))
+
+    def test_existing_paths_are_not_patterns(self):
+        bracketed = self.write('form[1].json', json.dumps(FORM))
+        self.write('form1.json', json.dumps(FORM))
+        self.assertFalse(converter.is_many_files(bracketed))
+        self.assertEqual(converter.input_files(bracketed), [bracketed])
+        pattern = os.path.join(self.input_dir, 'form[0-9].json')
+        self.assertTrue(converter.is_many_files(pattern))
+        self.assertTrue(converter.is_many_files(self.input_dir))
+        self.assertEqual(converter.input_files(pattern),
+                         [os.path.join(self.input_dir, 'form1.json')])
+
+
+if __name__ == '__main__':
+    unittest.main()
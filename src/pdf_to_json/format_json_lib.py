@@ -0,0 +1,163 @@
+""" Readable formatting of intermediary JSON documents.
+
+Form fields (objects with "label", "type" and "id") are written on a single
+line; every other object and list is indented by four spaces, one member
+per line. The output is written in one pass into a list of pieces, handed
+out in chunks as it is written (see iter_format_json_single_line_fields);
+format_data_single_line_fields joins them into one string.
+"""
+
+import json
+import json_codec
+import logging
+
+_INDENT = "    "
+# Pieces written before iter_format_json_single_line_fields hands out a chunk.
+PIECES_PER_CHUNK = 4096
+
+_compact_encoder = json.JSONEncoder(separators=(',', ':'))
+_encode_string = json.encoder.encode_basestring_ascii
+# Checks that the C encoder encodes like the public one, see
+# _make_encode_compact.
+_ENCODER_SAMPLE = {"label": "Café \"A\"", "id": 1, "options": [1.5, None, True]}
+
+
+def _make_encode_compact():
+    """
+    Returns a function encoding a value like json.dumps(value,
+    separators=(',', ':')). json.dumps builds a new encoder on every call;
+    most of the formatting time goes into encoding the (many, small) field
+    objects, so build one encoder and reuse it.
+
+    The C encoder (json.encoder.c_make_encoder) is private to the json
+    module, and its arguments may change between Python versions: if it is
+    missing, or does not encode a sample like the public encoder, the public
+    encoder is used instead.
+    """
+    c_make_encoder = getattr(json.encoder, "c_make_encoder", None)
+    if c_make_encoder is None:
+        return _compact_encoder.encode
+    try:
+        # Arguments: markers (no cycle check: parsed JSON has no cycles),
+        # default, string encoder, indent, key and item separators,
+        # sort_keys, skipkeys, allow_nan.
+        c_encoder = c_make_encoder(
+            None, _compact_encoder.default, _encode_string, None, ':', ',',
+            False, False, True)
+        encode = lambda obj: "".join(c_encoder(obj, 0))
+        if encode(_ENCODER_SAMPLE) == _compact_encoder.encode(_ENCODER_SAMPLE):
+            return encode
+        logging.warning("Not using the C JSON encoder: its output differs.")
+    except Exception as e:
+        logging.warning(f"Not using the C JSON encoder: {e}")
+    return _compact_encoder.encode
+
+
+_encode_compact = _make_encode_compact()
+
+
+def _is_field(obj):
+    return "label" in obj and "type" in obj and "id" in obj
+
+
+def _encode_key(key):
+    if isinstance(key, str):
+        return _encode_string(key)
+    return _encode_compact(key)
+
+
+def _write(obj, level, pieces, pieces_per_chunk):
+    """
+    Appends the formatted JSON of obj to pieces. A generator: whenever
+    pieces_per_chunk or more pieces are pending, yields them joined and
+    clears the list.
+    """
+    if isinstance(obj, dict) and not _is_field(obj):
+        opening, closing = "{\n", "}"
+        members = obj.items()
+    elif isinstance(obj, list):
+        opening, closing = "[\n", "]"
+        members = ((None, item) for item in obj)
+    else:
+        # Field objects and scalars, on a single line.
+        pieces.append(_encode_compact(obj))
+        return
+
+    inner_indent = _INDENT * (level + 1)
+    pieces.append(opening)
+    separator = inner_indent
+    for (key, value) in members:
+        pieces.append(separator)
+        separator = ",\n" + inner_indent
+        if key is not None:
+            pieces.append(_encode_key(key))
+            pieces.append(": ")
+        if isinstance(value, (dict, list)):
+            yield from _write(value, level + 1, pieces, pieces_per_chunk)
+        else:
+            pieces.append(_encode_compact(value))
+        if len(pieces) >= pieces_per_chunk:
+            yield "".join(pieces)
+            pieces.clear()
+    # An empty object or list still gets its (empty) line: "{\n\n}".
+    pieces.append("\n" + _INDENT * level + closing)
+
+
+def format_data_single_line_fields(data):
+    """
+    Formats parsed JSON data like format_json_single_line_fields.
+
+    Args:
+        data: The parsed JSON (dicts, lists and scalars).
+
+    Returns:
+        str: The formatted JSON string.
+    """
+    return "".join(iter_format_json_single_line_fields(data))
+
+
+def iter_format_json_single_line_fields(data, pieces_per_chunk=PIECES_PER_CHUNK):
+    """
+    Generator variant of format_data_single_line_fields, for streaming
+    responses: yields the formatted JSON in chunks, as it is written.
+
+    Args:
+        data: The parsed JSON (dicts, lists and scalars).
+        pieces_per_chunk (int): Roughly how many pieces (keys, values and
+            punctuation) make up a chunk.
+
+    Yields:
+        str: Consecutive chunks of the formatted JSON string.
+    """
+    pieces = []
+    yield from _write(data, 0, pieces, max(1, pieces_per_chunk))
+    if pieces:
+        yield "".join(pieces)
+
+
+def format_json_single_line_fields(json_string: str) -> str:
+    """
+    Formats a JSON string to ensure all field attributes (including options)
+    are on a single line, while maintaining readability for nested structures.
+
+    Args:
+        json_string (str): The JSON string to format.
+
+    Returns:
+        str: The formatted JSON string.
+
+    Raises:
+        json.JSONDecodeError: If the input string is not valid JSON.
+        ValueError: If an unexpected error occurs during formatting.
+    """
+    try:
+        return format_data_single_line_fields(json_codec.loads(json_string))
+
+    except json.JSONDecodeError as e:
+        logging.error(f"Error decoding JSON: {e}")
+        raise  # Re-raise the exception to be handled by the caller
+    except Exception as e:
+        logging.error(f"An unexpected error occurred: {e}")
+        raise ValueError(
+            f"An unexpected error occurred during JSON formatting: {e}"
+        ) from e  # Raise a ValueError
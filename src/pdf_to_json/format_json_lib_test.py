@@ -0,0 +1,66 @@
+import benchmarks
+import format_json_lib
+import json
+import unittest
+from unittest import mock
+
+SAMPLES = [
+    [{'title': 'Form', 'sections': [
+        {'title': 'Applicant', 'fields': [
+            {'label': 'Name', 'type': 'name', 'id': 'name'},
+            {'label': 'Pets', 'type': 'checkbox', 'id': 'pets',
+             'options': ['Cat', 'Dog']}]},
+        {'title': 'Household', 'type': 'repeating_section', 'fields': []}]}],
+    {'empty_object': {}, 'empty_list': [], 'nested': [[1, 2.5], {'a': None}]},
+    {'unicode': 'café – 日本', 'escapes': 'quote " backslash \\ tab \t',
+     'numbers': [0, -1, 1e100, 3.14159], 'flags': [True, False]},
+    'just a string',
+    [],
+]
+
+
+class TestFormatJson(unittest.TestCase):
+
+    def test_matches_previous_implementation(self):
+        samples = SAMPLES + [benchmarks.synthetic_form(5, 7)]
+        for sample in samples:
+            json_string = json.dumps(sample)
+            self.assertEqual(
+                format_json_lib.format_json_single_line_fields(json_string),
+                benchmarks.legacy_format_json_single_line_fields(json_string))
+
+    def test_fields_on_one_line(self):
+        formatted = format_json_lib.format_json_single_line_fields(
+            json.dumps(SAMPLES[0]))
+        self.assertIn(
+            '\n                    {"label":"Pets","type":"checkbox","id":"pets","options":["Cat","Dog"]}\n',
+            formatted)
+        self.assertEqual(json.loads(formatted), SAMPLES[0])
+
+    def test_chunks_join_to_the_same_output(self):
+        data = benchmarks.synthetic_form(3, 4)
+        chunks = list(format_json_lib.iter_format_json_single_line_fields(
+            data, pieces_per_chunk=8))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(''.join(chunks),
+                         format_json_lib.format_data_single_line_fields(data))
+
+    def test_compact_encoder_falls_back_to_the_public_encoder(self):
+        def broken_make_encoder(*args):
+            raise TypeError("unexpected arguments")
+
+        for c_make_encoder in (None, broken_make_encoder):
+            with mock.patch.object(json.encoder, 'c_make_encoder',
+                                   c_make_encoder):
+                encode = format_json_lib._make_encode_compact()
+            for sample in SAMPLES:
+                self.assertEqual(encode(sample),
+                                 json.dumps(sample, separators=(',', ':')))
+
+    def test_invalid_json(self):
+        with self.assertRaises(json.JSONDecodeError):
+            format_json_lib.format_json_single_line_fields('{"a": ')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 """ Helper functions for generate_word_counts. """
 
 import json
+import json_codec
 import logging
 import os
 import re
@@ -119,7 +120,7 @@ def compute_frequencies(dictionary, directory):
                         json_string = json_string[0:-3]
 
                     try:
-                        json_obj = json.loads(json_string)
+                        json_obj = json_codec.loads(json_string)
                     except json.decoder.JSONDecodeError:
                         logging.warning(
                             f"JSON decode error for {entry}; skipping.")
@@ -0,0 +1,165 @@
+""" Validation of the intermediary JSON the LLM extracts from a PDF.
+
+An extract can be well-formed JSON and still unusable: a field without an
+id, a radio button with a single option, a repeating section with nothing
+to repeat. The converter only finds out at the end of the pipeline, after
+post-processing. validate_form() finds out right after extraction, so that
+llm_lib can request the page range again at the cost of one call.
+
+FORM_SCHEMA is a subset of JSON Schema (type, required, properties, items,
+minLength), plus "x-checks": functions for the rules of the converter that
+JSON Schema cannot express. compile_validator() turns a schema into nested
+closures once, at import, rather than interpreting it for every extract.
+"""
+
+# The Python types of the JSON Schema types used here.
+_PYTHON_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "null": type(None),
+}
+
+_JSON_TYPE_NAMES = {
+    dict: "object",
+    list: "array",
+    str: "string",
+    bool: "boolean",
+    int: "number",
+    float: "number",
+    type(None): "null",
+}
+
+
+def _check_field_options(field):
+    # The converter's rules for the options of radio buttons and checkboxes,
+    # see convert_to_civiform_json.create_question.
+    field_type = field.get("type")
+    if not isinstance(field_type, str) or \
+            field_type.lower() not in ("radio_button", "checkbox"):
+        return None
+    options = field.get("options")
+    if not isinstance(options, list):
+        options = []
+    if field_type.lower() == "radio_button" and len(options) < 2:
+        return "a radio_button field needs at least two options"
+    if not options:
+        return "a checkbox field needs at least one option"
+    if "" in options:
+        return "options cannot be empty strings"
+    return None
+
+
+def _check_repeating_section(section):
+    section_type = section.get("type")
+    if (isinstance(section_type, str) and
+            section_type.lower() == "repeating_section" and
+            not section.get("fields") and not section.get("entity_nickname")):
+        return "a repeating_section needs at least one field"
+    return None
+
+
+FIELD_SCHEMA = {
+    "type": "object",
+    "required": ["label", "type", "id"],
+    "properties": {
+        "label": {"type": "string"},
+        "type": {"type": "string", "minLength": 1},
+        "id": {"type": "string", "minLength": 1},
+        "help_text": {"type": ["string", "null"]},
+        "options": {"type": "array", "items": {"type": "string"}},
+    },
+    "x-checks": [_check_field_options],
+}
+
+SECTION_SCHEMA = {
+    "type": "object",
+    "required": ["title", "fields"],
+    "properties": {
+        "title": {"type": "string"},
+        "help_text": {"type": ["string", "null"]},
+        "type": {"type": "string"},
+        "entity_nickname": {"type": ["string", "null"]},
+        "fields": {"type": "array", "items": FIELD_SCHEMA},
+    },
+    "x-checks": [_check_repeating_section],
+}
+
+FORM_SCHEMA = {
+    "type": "object",
+    "required": ["title", "sections"],
+    "properties": {
+        "title": {"type": "string"},
+        "help_text": {"type": ["string", "null"]},
+        "Instructions": {"type": ["string", "null"]},
+        "sections": {"type": "array", "items": SECTION_SCHEMA},
+    },
+}
+
+
+def compile_validator(schema, name="value"):
+    """ Compiles a schema into a function that validates values against it.
+
+    Args:
+      schema: A schema, see the module docstring.
+      name: What to call the value in problem descriptions.
+
+    Returns:
+      A function taking a value and returning the list of its problems, as
+      strings such as "form.sections[0].fields[2]: missing 'id'". The list
+      is empty if the value is valid.
+    """
+    check = _compile(schema)
+
+    def validate(value):
+        problems = []
+        check(value, name, problems)
+        return problems
+
+    return validate
+
+
+def _compile(schema):
+    type_names = schema.get("type", [])
+    if isinstance(type_names, str):
+        type_names = [type_names]
+    python_types = tuple(_PYTHON_TYPES[type_name] for type_name in type_names)
+    expected = " or ".join(type_names)
+    required = tuple(schema.get("required", ()))
+    properties = tuple((key, _compile(property_schema))
+                       for (key, property_schema) in
+                       schema.get("properties", {}).items())
+    check_item = _compile(schema["items"]) if "items" in schema else None
+    min_length = schema.get("minLength")
+    extra_checks = tuple(schema.get("x-checks", ()))
+
+    def check(value, path, problems):
+        if python_types and not isinstance(value, python_types):
+            problems.append(
+                f"{path}: expected {expected}, not "
+                f"{_JSON_TYPE_NAMES.get(type(value), type(value).__name__)}")
+            return
+        if required:
+            for key in required:
+                if key not in value:
+                    problems.append(f"{path}: missing '{key}'")
+        if properties:
+            for (key, check_property) in properties:
+                if key in value:
+                    check_property(value[key], f"{path}.{key}", problems)
+        if check_item is not None:
+            for (i, item) in enumerate(value):
+                check_item(item, f"{path}[{i}]", problems)
+        if min_length is not None and isinstance(value, str) and \
+                len(value) < min_length:
+            problems.append(f"{path}: cannot be empty")
+        for extra_check in extra_checks:
+            problem = extra_check(value)
+            if problem is not None:
+                problems.append(f"{path}: {problem}")
+
+    return check
+
+
+# Validates one form of an extract: the whole PDF, or a range of pages.
+validate_form = compile_validator(FORM_SCHEMA, "form")
@@ -0,0 +1,129 @@
+import asyncio
+import intermediary_schema
+import json
+import llm_lib
+import pdf_to_civiform_gemini_test as app_test
+import tempfile
+import unittest
+
+FORM = {
+    "title": "Test Form",
+    "help_text": "help",
+    "sections": [{
+        "title": "S1",
+        "help_text": None,
+        "fields": [
+            {"label": "Name", "type": "text", "id": "name1"},
+            {"label": "Pick", "type": "Radio_Button", "id": "pick",
+             "options": ["Yes", "No"]},
+        ],
+    }, {
+        "title": "Kids",
+        "type": "repeating_section",
+        "entity_nickname": "Kid",
+        "fields": [],
+    }],
+}
+
+
+class TestValidateForm(unittest.TestCase):
+
+    def test_valid_form(self):
+        self.assertEqual(intermediary_schema.validate_form(FORM), [])
+
+    def test_reports_problems_with_their_path(self):
+        form = {"title": 3, "sections": [
+            {"title": "S", "fields": [
+                {"label": "A", "type": "radio_button", "id": "a",
+                 "options": ["Only"]},
+                {"label": "B", "type": "checkbox", "id": ""},
+                {"label": "C", "type": "checkbox", "id": "c",
+                 "options": ["x", ""]},
+                "not a field"]},
+            {"title": "R", "type": "Repeating_Section", "fields": []},
+            {"fields": []}]}
+        self.assertEqual(intermediary_schema.validate_form(form), [
+            "form.title: expected string, not number",
+            "form.sections[0].fields[0]: a radio_button field needs at least two options",
+            "form.sections[0].fields[1].id: cannot be empty",
+            "form.sections[0].fields[1]: a checkbox field needs at least one option",
+            "form.sections[0].fields[2]: options cannot be empty strings",
+            "form.sections[0].fields[3]: expected object, not string",
+            "form.sections[1]: a repeating_section needs at least one field",
+            "form.sections[2]: missing 'title'",
+        ])
+        self.assertEqual(intermediary_schema.validate_form([FORM]),
+                         ["form: expected object, not array"])
+
+
+class TestChunkExtract(unittest.TestCase):
+
+    def test_requests_failing_pages_again_and_keeps_the_best_response(self):
+        invalid = ('{"title": "T", "sections": [{"title": "S", "fields": '
+                   '[{"label": "L", "type": "radio_button", "id": "r"}]}]}')
+        chunk = llm_lib._ChunkExtract(0, 5)
+        chunk.add_response(invalid)
+        self.assertTrue(chunk.needs_request())
+        self.assertEqual(chunk.stage(), "pdf-extract-retry")
+        self.assertIn("at least two options", chunk.prompt())
+
+        chunk.add_response(None)  # Malformed, even after fix_malformed_json.
+        self.assertFalse(chunk.needs_request())
+        self.assertEqual(chunk.text, invalid)
+        self.assertEqual(len(chunk.problems), 1)
+
+        chunk = llm_lib._ChunkExtract(0, 5)
+        chunk.add_response('{"title": "T", "sections": []}')
+        self.assertFalse(chunk.needs_request())
+        self.assertEqual((chunk.requests, chunk.problems), (1, []))
+
+
+class TestWholeExtract(unittest.TestCase):
+    """ Counts the LLM calls made for the extract of a PDF of two chunks. """
+
+    INVALID = json.dumps({"title": "T", "sections": [{"title": "S", "fields": [
+        {"label": "L", "type": "radio_button", "id": "r"}]}]})
+
+    def setUp(self):
+        self.client = app_test.FakeClient()
+        self.pdf = app_test.make_pdf("Form", pages=llm_lib.PAGE_LIMIT + 1)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.addCleanup(llm_lib.artifacts.flush)
+
+    def extract(self, responses):
+        """ Extracts the PDF, sync then async, with `responses` first
+        answering each run. """
+        self.client.models.responses = list(responses)
+        extract, error = llm_lib.process_pdf_text_with_llm(
+            self.client, "gemini-test", self.pdf, "form", self.tmp_dir.name)
+        self.assertIsNone(error)
+        self.client.models.responses = list(responses)
+        async_extract, error = asyncio.run(llm_lib.run_steps_async(
+            llm_lib.process_pdf_text_steps(
+                "gemini-test", self.pdf, "form", self.tmp_dir.name),
+            self.client))
+        self.assertEqual(async_extract, extract)
+        return extract
+
+    def test_invalid_extract_is_corrected_with_one_request(self):
+        valid = json.dumps(dict(app_test.FORM, title="Corrected"))
+        extract = self.extract([self.INVALID, valid])
+        self.assertEqual(self.client.models.calls, 4)  # 2 per run.
+        self.assertEqual(extract[0]["title"], "Corrected")
+
+    def test_still_invalid_extract_is_kept(self):
+        extract = self.extract([self.INVALID] * 2)
+        self.assertEqual(self.client.models.calls, 4)
+        self.assertEqual(extract, [json.loads(self.INVALID)])
+
+    def test_malformed_extract_is_requested_in_chunks(self):
+        extract = self.extract(["not json"])
+        # The whole PDF, then its two chunks, in each run.
+        self.assertEqual(self.client.models.calls, 6)
+        self.assertEqual([form["title"] for form in extract],
+                         [app_test.FORM["title"]] * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,285 @@
+""" Per-job progress events for the PDF->CiviForm web app.
+
+A job is one conversion request (a single upload or a directory run).
+While a job is running, the pipeline publishes events to it: stage
+transitions, per-chunk completion, LLM token counts and log lines. The
+/jobs/<job_id>/events endpoint streams those events to the browser as
+server-sent events (SSE). Job ids are chosen by the server and cannot be
+guessed, see create_job().
+
+Each job keeps only the most recent MAX_EVENTS_PER_JOB events, so a long
+run never accumulates its whole log in memory. Subscribers that fall behind
+simply miss the oldest events.
+"""
+
+import asyncio
+import collections
+import contextvars
+import json
+import logging
+import re
+import secrets
+import threading
+import time
+
+MAX_EVENTS_PER_JOB = 500
+MAX_JOBS = 1000
+# Finished jobs are kept around briefly so that a late subscriber can still
+# read the final events.
+FINISHED_JOB_TTL_SECONDS = 300
+HEARTBEAT_SECONDS = 15
+# How often stream_events_async checks a job for new events.
+ASYNC_POLL_SECONDS = 0.25
+
+_JOB_ID_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+_current_job = contextvars.ContextVar('current_job', default=None)
+
+_jobs = collections.OrderedDict()
+_jobs_lock = threading.Lock()
+
+
+class Job:
+    """ A bounded, thread-safe event log for one conversion request. """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        # Whether a request runs the job, see start_job().
+        self.is_claimed = False
+        self.finished_at = None
+        self._events = collections.deque(maxlen=MAX_EVENTS_PER_JOB)
+        self._next_event_id = 1
+        self._condition = threading.Condition()
+
+    @property
+    def is_finished(self):
+        return self.finished_at is not None
+
+    def publish(self, event_type, data):
+        """ Appends an event and wakes up any waiting subscribers.
+
+        Args:
+          event_type: SSE event name, e.g. "stage", "chunk", "tokens", "log".
+          data: A JSON-serializable dict with the event payload.
+        """
+        with self._condition:
+            self._events.append((self._next_event_id, event_type, data))
+            self._next_event_id += 1
+            self._condition.notify_all()
+
+    def finish(self, status, **data):
+        """ Publishes the terminal "done" event and marks the job finished. """
+        self.publish("done", {"status": status, **data})
+        with self._condition:
+            self.finished_at = time.monotonic()
+            self._condition.notify_all()
+
+    def events_after(self, last_event_id, timeout):
+        """ Returns the events newer than last_event_id.
+
+        Blocks for up to `timeout` seconds if there are none yet.
+
+        Args:
+          last_event_id: The id of the last event the caller has seen.
+          timeout: Maximum number of seconds to wait for a new event.
+
+        Returns:
+          A list of (event_id, event_type, data) tuples, oldest first.
+        """
+        with self._condition:
+            if self._next_event_id - 1 <= last_event_id and not self.is_finished:
+                self._condition.wait(timeout)
+            return [event for event in self._events
+                    if event[0] > last_event_id]
+
+
+def _expire_jobs_locked():
+    """ Drops finished jobs past their TTL. Over MAX_JOBS, also drops the
+    oldest finished jobs, then the oldest jobs no request has claimed yet;
+    jobs that are running are kept.
+
+    Must be called with _jobs_lock held.
+    """
+    now = time.monotonic()
+    for job_id in [job_id for job_id, job in _jobs.items()
+                   if job.is_finished and
+                   now - job.finished_at > FINISHED_JOB_TTL_SECONDS]:
+        del _jobs[job_id]
+    for is_expendable in (lambda job: job.is_finished,
+                          lambda job: not job.is_claimed):
+        if len(_jobs) < MAX_JOBS:
+            return
+        for job_id in [job_id for job_id, job in _jobs.items()
+                       if is_expendable(job)][:len(_jobs) - MAX_JOBS + 1]:
+            del _jobs[job_id]
+
+
+def is_valid_job_id(job_id):
+    return bool(job_id) and _JOB_ID_RE.match(job_id) is not None
+
+
+def create_job():
+    """ Creates a job, with an id chosen by the server.
+
+    The ids cannot be guessed, so only the client that created a job (or was
+    sent its id) can read its events, which include the request's log.
+    Clients create the job before they send the upload that runs it, so
+    that they can subscribe to its event stream first.
+
+    Returns:
+      The Job.
+    """
+    with _jobs_lock:
+        return _new_job_locked()
+
+
+def _new_job_locked():
+    _expire_jobs_locked()
+    job = Job(secrets.token_urlsafe(16))
+    _jobs[job.job_id] = job
+    return job
+
+
+def get_job(job_id):
+    """ Returns the job with the given id, or None if there is none. """
+    if not is_valid_job_id(job_id):
+        return None
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def current_job():
+    """ Returns the Job running in the current context, or None. """
+    return _current_job.get()
+
+
+def start_job(job_id):
+    """ Makes a job current in the current context.
+
+    The web apps start a job for each request, in a context of its own (see
+    contextvars.copy_context()) that a streamed response keeps using after
+    the route returns. The caller is responsible for ending the returned
+    job, see end_job().
+
+    Args:
+      job_id: The id of a job from create_job() that no request has claimed
+        yet, sent by the client. Otherwise (e.g. if it is None), a new job
+        is created: its id is returned to the client with the response.
+
+    Returns:
+      The Job.
+    """
+    with _jobs_lock:
+        job = _jobs.get(job_id) if is_valid_job_id(job_id) else None
+        if job is None or job.is_claimed:
+            job = _new_job_locked()
+        job.is_claimed = True
+    _current_job.set(job)
+    return job
+
+
+def end_job(job, error=None):
+    """ Finishes a job started by start_job(), unless finish() was already
+    called on it: with an "error" status if `error` (an exception) is given.
+
+    Args:
+      job: The Job, or None.
+      error: The exception the request failed with, if it did.
+    """
+    if job is None or job.is_finished:
+        return
+    if error is None:
+        job.finish("finished")
+    else:
+        job.finish("error", error=str(error))
+
+
+def finish_current_job(status, **data):
+    """ Finishes the current job, if there is one, with the given status. """
+    job = _current_job.get()
+    if job is not None and not job.is_finished:
+        job.finish(status, **data)
+
+
+def publish(event_type, **data):
+    """ Publishes an event to the current job, if there is one. """
+    job = _current_job.get()
+    if job is not None:
+        job.publish(event_type, data)
+
+
+def format_sse(event_id, event_type, data):
+    """ Formats one event in the text/event-stream wire format. """
+    return (f"id: {event_id}\n"
+            f"event: {event_type}\n"
+            f"data: {json.dumps(data, ensure_ascii=False)}\n\n")
+
+
+def stream_events(job, last_event_id=0):
+    """ Yields a job's events as SSE messages until the job is finished.
+
+    A comment line is sent every HEARTBEAT_SECONDS so that proxies do not
+    close an idle connection while a long LLM call is in flight.
+
+    Args:
+      job: The Job to stream.
+      last_event_id: Resume after this event id (from the Last-Event-ID
+        header when the browser reconnects).
+
+    Yields:
+      Strings in the text/event-stream format.
+    """
+    yield "retry: 3000\n\n"
+    while True:
+        events = job.events_after(last_event_id, HEARTBEAT_SECONDS)
+        if not events:
+            if job.is_finished:
+                return
+            yield ": keepalive\n\n"
+            continue
+        for (event_id, event_type, data) in events:
+            last_event_id = event_id
+            yield format_sse(event_id, event_type, data)
+            if event_type == "done":
+                return
+
+
+async def stream_events_async(job, last_event_id=0):
+    """ Async version of stream_events, for the async serving mode.
+
+    Polls the job every ASYNC_POLL_SECONDS instead of blocking on it, so a
+    subscriber does not hold a thread while it waits.
+    """
+    yield "retry: 3000\n\n"
+    idle_seconds = 0.0
+    while True:
+        events = job.events_after(last_event_id, 0)
+        if not events:
+            if job.is_finished:
+                return
+            if idle_seconds >= HEARTBEAT_SECONDS:
+                idle_seconds = 0.0
+                yield ": keepalive\n\n"
+            await asyncio.sleep(ASYNC_POLL_SECONDS)
+            idle_seconds += ASYNC_POLL_SECONDS
+            continue
+        idle_seconds = 0.0
+        for (event_id, event_type, data) in events:
+            last_event_id = event_id
+            yield format_sse(event_id, event_type, data)
+            if event_type == "done":
+                return
+
+
+class JobLogHandler(logging.Handler):
+    """ Logging handler that forwards log records to the current job. """
+
+    def emit(self, record):
+        job = _current_job.get()
+        if job is None:
+            return
+        try:
+            job.publish("log", {"level": record.levelname,
+                                "message": self.format(record)})
+        except Exception:
+            self.handleError(record)
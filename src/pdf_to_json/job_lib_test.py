@@ -0,0 +1,111 @@
+import asyncio
+import contextvars
+import job_lib
+import logging
+import unittest
+
+
+class TestJob(unittest.TestCase):
+
+    def test_events_are_bounded(self):
+        job = job_lib.Job('bounded')
+        for i in range(job_lib.MAX_EVENTS_PER_JOB + 10):
+            job.publish('log', {'message': str(i)})
+        events = job.events_after(0, timeout=0)
+        self.assertEqual(len(events), job_lib.MAX_EVENTS_PER_JOB)
+        self.assertEqual(events[0][0], 11)
+
+    def test_unknown_job_id(self):
+        self.assertIsNone(job_lib.get_job('../etc'))
+        self.assertIsNone(job_lib.get_job(''))
+        self.assertIsNone(job_lib.get_job('never-created'))
+
+    def test_created_job_is_found(self):
+        job = job_lib.create_job()
+        self.assertTrue(job_lib.is_valid_job_id(job.job_id))
+        self.assertIs(job_lib.get_job(job.job_id), job)
+        self.assertIsNot(job_lib.create_job(), job)
+
+
+def run_in_job(function, job_id=None):
+    """ Runs function in a job, in a context of its own, the way the web apps
+    run a request. Returns the job, ended. """
+    def run():
+        job = job_lib.start_job(job_id)
+        try:
+            function()
+        except Exception as e:
+            job_lib.end_job(job, e)
+        else:
+            job_lib.end_job(job)
+        return job
+    return contextvars.copy_context().run(run)
+
+
+class TestStartJob(unittest.TestCase):
+
+    def test_claims_the_created_job(self):
+        job = job_lib.create_job()
+        self.assertIs(run_in_job(lambda: None, job.job_id), job)
+
+    def test_unknown_or_claimed_id_gets_a_new_job(self):
+        job = run_in_job(lambda: None, 'never-created')
+        self.assertNotEqual(job.job_id, 'never-created')
+        self.assertIs(job_lib.get_job(job.job_id), job)
+        self.assertIsNot(run_in_job(lambda: None, job.job_id), job)
+
+
+class TestRunJob(unittest.TestCase):
+
+    def test_stream_ends_with_done(self):
+        job = run_in_job(lambda: job_lib.publish(
+            'stage', stage='pdf-extract'))
+        self.assertIsNone(job_lib.current_job())
+        messages = list(job_lib.stream_events(job))
+        self.assertIn('event: stage\n', messages[1])
+        self.assertIn('event: done\n', messages[-1])
+        self.assertIn('"status": "finished"', messages[-1])
+
+    def test_async_stream_waits_for_done(self):
+        job = job_lib.create_job()
+
+        async def stream_and_finish():
+            async def finish_later():
+                await asyncio.sleep(0.3)
+                job.finish('finished')
+            finisher = asyncio.create_task(finish_later())
+            messages = [message async for message
+                        in job_lib.stream_events_async(job)]
+            await finisher
+            return messages
+
+        messages = asyncio.run(stream_and_finish())
+        self.assertIn('event: done\n', messages[-1])
+
+    def test_error_status(self):
+        def fail():
+            raise ValueError('boom')
+        job = run_in_job(fail)
+        (_, event_type, data) = job.events_after(0, timeout=0)[-1]
+        self.assertEqual(event_type, 'done')
+        self.assertEqual(data['status'], 'error')
+
+    def test_log_lines_go_to_current_job_only(self):
+        logger = logging.getLogger('job_lib_test')
+        logger.setLevel(logging.INFO)
+        # Not the root logger's handlers, e.g. the web app's JobLogHandler.
+        logger.propagate = False
+        handler = job_lib.JobLogHandler()
+        logger.addHandler(handler)
+        try:
+            logger.info('outside')
+            job = run_in_job(lambda: logger.info('inside'))
+        finally:
+            logger.removeHandler(handler)
+        logs = [data['message'] for (_, event_type, data)
+                in job.events_after(0, timeout=0) if event_type == 'log']
+        self.assertEqual(logs, ['inside'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+""" JSON encoding and decoding, accelerated by orjson when it is installed.
+
+The pipeline parses and writes JSON at every step: LLM responses, saved
+outputs, run manifests, cache entries, NDJSON results and progress events.
+orjson does both several times faster than the json module. Without it,
+everything here falls back to the json module.
+
+There are two kinds of output:
+
+  * dumps() is for JSON read by programs: NDJSON lines, progress events,
+    cache entries, manifests. With orjson it is UTF-8 (not \\u-escaped) and
+    may write floats differently from the json module (1e16 rather than
+    1e+16): the same JSON values, not the same bytes.
+  * dumps_exact() is byte for byte json.dumps, for the files compared with
+    goldens and downloaded by users, such as CiviForm JSON.
+
+loads() returns exactly what json.loads would, see its docstring.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# The library behind loads() and dumps().
+BACKEND = "orjson" if orjson is not None else "json"
+
+# orjson reads integers beyond 64 bits as floats, where json keeps them
+# exact. Documents with 19 digits in a row are left to json. (Mapping every
+# digit to "0" and searching for 19 zeros is several times faster than a
+# regular expression.)
+_LONG_DIGIT_RUN = "0" * 19
+_LONG_DIGIT_RUN_BYTES = b"0" * 19
+_DIGITS_TO_ZERO = str.maketrans("123456789", "000000000")
+_DIGITS_TO_ZERO_BYTES = bytes.maketrans(b"123456789", b"000000000")
+
+
+def loads(data):
+    """
+    Parses a JSON document, like json.loads.
+
+    orjson rejects some documents that json accepts (NaN and Infinity, lone
+    surrogates, UTF-16 bytes) and reads very long integers differently;
+    those documents are parsed by json.loads instead,
+    so the result is always the same.
+
+    Args:
+        data (str or bytes): The JSON document.
+
+    Returns:
+        The parsed value.
+
+    Raises:
+        json.JSONDecodeError: If the document is not valid JSON.
+    """
+    if orjson is not None:
+        if isinstance(data, str):
+            has_long_digit_run = _LONG_DIGIT_RUN in data.translate(_DIGITS_TO_ZERO)
+        else:
+            has_long_digit_run = (_LONG_DIGIT_RUN_BYTES in
+                                  bytes(data).translate(_DIGITS_TO_ZERO_BYTES))
+        if not has_long_digit_run:
+            try:
+                return orjson.loads(data)
+            except orjson.JSONDecodeError:
+                pass  # Let json decide, and report the error.
+    return json.loads(data)
+
+
+def dumps(obj, indent=None, sort_keys=False):
+    """
+    Serializes a value to JSON for programs to read (see the module
+    docstring), without escaping non-ASCII characters.
+
+    Args:
+        obj: The value: dicts, lists, strings, numbers, booleans and None.
+        indent (int): None for compact output, without any whitespace, or
+            the number of spaces to indent by. orjson only indents by 2;
+            other indents are written by json.
+        sort_keys (bool): Whether to write object keys in sorted order,
+            rather than in insertion order.
+
+    Returns:
+        str: The JSON document.
+    """
+    if orjson is not None and indent in (None, 2):
+        option = orjson.OPT_INDENT_2 if indent else 0
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, option=option).decode("utf-8")
+        except TypeError:
+            pass  # E.g. non-string keys, or integers beyond 64 bits.
+    return json.dumps(obj, ensure_ascii=False, indent=indent,
+                      separators=(",", ":") if indent is None else None,
+                      sort_keys=sort_keys)
+
+
+def dumps_exact(obj, **kwargs):
+    """
+    Serializes a value exactly as json.dumps(obj, **kwargs) does, byte for
+    byte, whether or not orjson is installed.
+    """
+    return json.dumps(obj, **kwargs)
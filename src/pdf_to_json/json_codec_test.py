@@ -0,0 +1,53 @@
+import json
+import json_codec
+import unittest
+
+DOCUMENT = {
+    "title": "Formulario de solicitud",
+    "sections": [{"fields": [
+        {"label": "Nombre", "type": "text", "id": "name", "options": []},
+        {"label": "Edad", "type": "number", "id": "age", "max": 1.5e16},
+    ]}],
+    "empty": {},
+    "flags": [True, False, None],
+}
+
+
+class TestJsonCodec(unittest.TestCase):
+
+    def test_loads_matches_json(self):
+        for document in (json.dumps(DOCUMENT), json.dumps(DOCUMENT).encode(),
+                         '[12345678901234567890123, -0.0, 1e400]',
+                         '{"a": NaN, "a": 2}', '"\\ud800"'):
+            self.assertEqual(repr(json_codec.loads(document)),
+                             repr(json.loads(document)))
+
+    def test_loads_raises_json_errors(self):
+        with self.assertRaises(json.JSONDecodeError):
+            json_codec.loads('{"a": ')
+
+    def test_dumps_round_trips(self):
+        for indent in (None, 2, 4):
+            output = json_codec.dumps(DOCUMENT, indent=indent)
+            self.assertEqual(json.loads(output), DOCUMENT)
+            self.assertIn("Formulario", output)
+        self.assertNotIn(" ", json_codec.dumps(DOCUMENT["flags"]))
+        # Non-string keys are left to json.
+        self.assertEqual(json_codec.dumps({1: "a"}), '{"1":"a"}')
+
+    def test_dumps_sort_keys(self):
+        for indent in (None, 2, 4):
+            output = json.loads(
+                json_codec.dumps(DOCUMENT, indent=indent, sort_keys=True))
+            self.assertEqual(output, DOCUMENT)
+            self.assertEqual(list(output), sorted(DOCUMENT))
+            field = output["sections"][0]["fields"][1]
+            self.assertEqual(list(field), sorted(field))
+
+    def test_dumps_exact_is_json_dumps(self):
+        self.assertEqual(json_codec.dumps_exact(DOCUMENT, indent=2),
+                         json.dumps(DOCUMENT, indent=2))
+
+
+if __name__ == '__main__':
+    unittest.main()
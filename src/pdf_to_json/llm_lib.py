@@ -1,15 +1,54 @@
 from google import genai
 from google.genai import types
+import artifact_writer
+import asyncio
+import collections
+import intermediary_schema
+import job_lib
 import json
+import json_codec
 from LLM_prompts import LLMPrompts
+import log_lib
 import logging
 import os
 import pymupdf
-import re
+import threading
 import traceback
 
 PAGE_LIMIT=5
 
+# Times the extract of a page range is requested again while it is malformed
+# or fails validation (see intermediary_schema), and the number of its
+# problems listed in the new request. The extract of the whole PDF is
+# requested again once, and only if it parses.
+EXTRACT_RETRIES = int(os.environ.get("EXTRACT_RETRIES", 1))
+MAX_REPORTED_PROBLEMS = 10
+
+# Maximum number of LLM calls in flight at once across all requests and
+# worker threads of this process, so that parallel runs stay within quota.
+MAX_CONCURRENT_LLM_CALLS = int(os.environ.get("MAX_CONCURRENT_LLM_CALLS", 8))
+_llm_call_slots = threading.BoundedSemaphore(MAX_CONCURRENT_LLM_CALLS)
+# The same limit for the async serving mode (async_app.py), which runs all its
+# LLM calls on one event loop. Created on first use, inside that loop.
+_async_llm_call_slots = None
+
+# Writes the output files in the background, see save_response_to_file.
+artifacts = artifact_writer.ArtifactWriter()
+
+def set_max_concurrent_llm_calls(limit):
+    """
+    Changes the process-wide limit on concurrent LLM calls.
+
+    Calls already waiting for a slot keep the previous limit.
+
+    Args:
+        limit (int): Maximum number of LLM calls in flight, at least 1.
+    """
+    global MAX_CONCURRENT_LLM_CALLS, _llm_call_slots, _async_llm_call_slots
+    MAX_CONCURRENT_LLM_CALLS = max(1, limit)
+    _llm_call_slots = threading.BoundedSemaphore(MAX_CONCURRENT_LLM_CALLS)
+    _async_llm_call_slots = None
+
 def initialize_gemini_client(
     api_key=None,
     api_key_file=os.path.expanduser("~/google_api_key")):
@@ -56,6 +95,143 @@ def initialize_gemini_client(
         logging.error(traceback.format_exc()) # Added traceback logging for init errors
         return None
 
+def generate_content(client, model_name, contents, stage):
+    """
+    Calls the LLM and publishes its token usage to the current job, if any.
+    Waits for a free slot if MAX_CONCURRENT_LLM_CALLS calls are in flight.
+
+    Args:
+        client: The initialized Gemini client.
+        model_name (str): The model to call.
+        contents (list): The prompt parts.
+        stage (str): Pipeline stage name reported with the token counts.
+
+    Returns:
+        The Gemini response object.
+    """
+    with _llm_call_slots:
+        response = client.models.generate_content(
+            model=model_name, contents=contents)
+    _publish_token_usage(response, model_name, stage)
+    return response
+
+async def generate_content_async(client, model_name, contents, stage):
+    """
+    Like generate_content, but awaits the async Gemini client (client.aio),
+    so that the event loop serves other requests while the call is in flight.
+    """
+    global _async_llm_call_slots
+    if _async_llm_call_slots is None:
+        _async_llm_call_slots = asyncio.BoundedSemaphore(MAX_CONCURRENT_LLM_CALLS)
+    async with _async_llm_call_slots:
+        response = await client.aio.models.generate_content(
+            model=model_name, contents=contents)
+    _publish_token_usage(response, model_name, stage)
+    return response
+
+def _publish_token_usage(response, model_name, stage):
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is not None:
+        job_lib.publish(
+            "tokens",
+            stage=stage,
+            model=model_name,
+            prompt_tokens=usage.prompt_token_count,
+            output_tokens=usage.candidates_token_count,
+            total_tokens=usage.total_token_count)
+
+# A call to the LLM. The pipeline steps (process_pdf_text_steps,
+# post_processing_steps, ...) are generators that yield an LLMRequest for each
+# call and are sent back its response, so that the same steps run with the
+# blocking client (run_steps) and with the async one (run_steps_async).
+LLMRequest = collections.namedtuple(
+    'LLMRequest', ['model_name', 'contents', 'stage'])
+
+def _next_step(steps, response, error):
+    """
+    Resumes steps with the response to its last LLMRequest, or with the
+    error the request raised.
+
+    Returns:
+        tuple: (request, result). request is the next LLMRequest, or None
+               once steps has returned result.
+    """
+    try:
+        if error is not None:
+            return steps.throw(error), None
+        return steps.send(response), None
+    except StopIteration as stop:
+        return None, stop.value
+
+def run_steps(steps, client):
+    """
+    Runs pipeline steps (a generator of LLMRequests), making their LLM calls
+    with generate_content.
+
+    Returns:
+        The value the steps return.
+    """
+    response, error = None, None
+    while True:
+        request, result = _next_step(steps, response, error)
+        if request is None:
+            return result
+        try:
+            response, error = generate_content(client, *request), None
+        except Exception as e:
+            response, error = None, e
+
+async def run_steps_async(steps, client):
+    """
+    Like run_steps, but awaits the LLM calls with generate_content_async.
+    The steps between the calls (PDF splitting, parsing, file I/O) run in
+    a worker thread, to keep the event loop free.
+    """
+    try:
+        response, error = None, None
+        while True:
+            request, result = await asyncio.to_thread(
+                _next_step, steps, response, error)
+            if request is None:
+                return result
+            try:
+                response, error = await generate_content_async(
+                    client, *request), None
+            except Exception as e:
+                response, error = None, e
+    finally:
+        # E.g. if the request is cancelled while a call is in flight.
+        steps.close()
+
+def api_model_name_for(model_name):
+    """Returns the model name in the "models/..." form the API expects."""
+    if not model_name.startswith("models/"):
+        return f"models/{model_name}"
+    return model_name
+
+def extract_response_text(response):
+    """
+    Extracts the text of an LLM response, without the ```json fence.
+
+    Returns:
+        str: The response text, or None if the response has no text.
+    """
+    # Add robust check based on actual library behavior
+    if hasattr(response, 'text'):
+        return response.text.strip("`").lstrip("json")  # Remove ``` and "json" if present
+    if (
+        hasattr(response, 'candidates') and response.candidates and
+        hasattr(response.candidates[0], 'content') and response.candidates[0].content.parts
+    ):
+        # Fallback to candidate structure if .text isn't available (more typical)
+        return (
+            response.candidates[0].content.parts[0].text
+            .strip("`")
+            .lstrip("json")
+            .strip()
+        )
+    return None
+
 def get_pdf_page_count(pdf_bytes):
     doc = pymupdf.open(stream=pdf_bytes, filetype="pdf")
     return len(doc)
@@ -72,27 +248,53 @@ def extract_pages_as_bytes(pdf_bytes, start_page, end_page):
     return new_doc.write()
 
 def fix_malformed_json(json_str, client, model_name):
+    return run_steps(fix_malformed_json_steps(json_str, model_name), client)
+
+def fix_malformed_json_steps(json_str, model_name):
+    """
+    Steps (see LLMRequest) that return json_str, stripped, if it parses;
+    otherwise the LLM's fix of it, or None if the fix does not parse either.
+    """
     try:
-        json.loads(json_str)
+        json_codec.loads(json_str)
         return json_str.strip()
     except json.JSONDecodeError as e:
-        print(f"Error parsing JSON: {e}")
+        logging.warning(f"Error parsing JSON, asking the LLM to fix it: {e}")
         # Attempt to fix by adding missing closing brackets/braces
         fix_malformed_json = LLMPrompts.fix_malformed_json_prompt(json_str)
-        fixed_json_str = client.models.generate_content(model=model_name, contents=[fix_malformed_json])
-        fixed_json_str = fixed_json_str.text.strip("`").lstrip("json")
-        try:
-            json.loads(fixed_json_str)
-            return fixed_json_str.strip()
-        except json.JSONDecodeError:
-            print("Failed to auto-fix JSON. Manual review needed.")
-            return None
+        fixed_json_str = yield LLMRequest(
+            model_name, [fix_malformed_json], "fix-malformed-json")
+        return _checked_fixed_json(fixed_json_str)
+
+def _checked_fixed_json(response):
+    fixed_json_str = response.text.strip("`").lstrip("json")
+    try:
+        json_codec.loads(fixed_json_str)
+        return fixed_json_str.strip()
+    except json.JSONDecodeError:
+        logging.error("Failed to auto-fix JSON. Manual review needed.")
+        return None
 
 def process_pdf_text_with_llm(client, model_name, file, base_name, work_dir):
-    """Sends extracted PDF text to Gemini and asks it to format the content into structured JSON."""
+    """
+    Sends extracted PDF text to Gemini and asks it to format the content into structured JSON.
+
+    Returns:
+        tuple: (extract, error). extract is the parsed JSON (a list with one
+               form per response), saved to the pdf-extract file, or None if
+               the LLM call failed, with error describing why.
+    """
+    return run_steps(
+        process_pdf_text_steps(model_name, file, base_name, work_dir), client)
+
+def process_pdf_text_steps(model_name, file, base_name, work_dir):
+    """
+    The steps (see LLMRequest) of process_pdf_text_with_llm, which returns
+    what they return.
+    """
 
-    prompt = LLMPrompts.pdf_to_json_prompt()
     logging.info(f"LLM processing input txt extracted from PDF...")
+    api_model_name = api_model_name_for(model_name)
 
     try:
         logging.debug(f"Sending PDF to LLM...")
@@ -100,44 +302,18 @@ def process_pdf_text_with_llm(client, model_name, file, base_name, work_dir):
         logging.info(f"Page count {page_count}")
         responses = []
 
-        if not model_name.startswith("models/"):
-            api_model_name = f"models/{model_name}"
-        else:
-            api_model_name = model_name
-
         input_file = types.Part.from_bytes(data=file, mime_type="application/pdf")
-        response = client.models.generate_content(
-            model=api_model_name,
-            contents=[input_file, prompt]
-        )
+        whole = _whole_extract(page_count)
+        while whole.needs_request():
+            response = yield LLMRequest(
+                api_model_name, [input_file, whole.prompt()], whole.stage())
 
-        # Add robust check based on actual library behavior
-        if hasattr(response, 'text'):
-            response_text = response.text.strip("`").lstrip("json")  # Remove ``` and "json" if present
-        elif (
-            hasattr(response, 'candidates') and response.candidates and
-            hasattr(response.candidates[0], 'content') and response.candidates[0].content.parts
-        ):
-            # Fallback to candidate structure if .text isn't available (more typical)
-            response_text = (
-                response.candidates[0].content.parts[0].text
-                .strip("`")
-                .lstrip("json")
-                .strip()
-            )
-        else:
-            # Cannot extract text, log the response structure for debugging
-            logging.error(f"Could not extract text from LLM response. Response object: {response}")
-            return None, "Failed to extract text from LLM response"
+            response_text = _extracted_text(response)
+            if response_text is None:
+                return None, "Failed to extract text from LLM response"
+            whole.add_response(response_text)
 
-        try:
-          json_response = json.loads(response_text.strip())
-          save_response_to_file(response_text.strip(),
-                                base_name,
-                                f"pdf-extract-{model_name}",
-                                work_dir)
-          responses.append(json_response)
-        except json.JSONDecodeError:
+        if not _append_whole_extract(whole, responses):
           logging.warning("Malformed json, needs processing in batches..")
 
           for start in range(0, page_count, PAGE_LIMIT):
@@ -148,49 +324,24 @@ def process_pdf_text_with_llm(client, model_name, file, base_name, work_dir):
                   data=chunk_bytes, mime_type="application/pdf"
               )
 
-              response = client.models.generate_content(
-                  model=api_model_name,
-                  contents=[input_file, prompt],
-              )
+              chunk = _ChunkExtract(start, end)
+              while chunk.needs_request():
+                  response = yield LLMRequest(
+                      api_model_name, [input_file, chunk.prompt()],
+                      chunk.stage())
+
+                  response_text = _extracted_text(response)
+                  if response_text is None:
+                      return None, "Failed to extract text from LLM response"
 
-              # Add robust check based on actual library behavior
-              if hasattr(response, 'text'):
-                  response_text = response.text.strip("`").lstrip("json")  # Remove ``` and "json" if present
-              elif (
-                  hasattr(response, 'candidates') and response.candidates and
-                  hasattr(response.candidates[0], 'content') and response.candidates[0].content.parts
-              ):
-                  # Fallback to candidate structure if .text isn't available (more typical)
-                  response_text = (
-                      response.candidates[0].content.parts[0].text
-                      .strip("`")
-                      .lstrip("json")
-                      .strip()
-                  )
-              else:
-                  # Cannot extract text, log the response structure for debugging
-                  logging.error(f"Could not extract text from LLM response. Response object: {response}")
-                  return None, "Failed to extract text from LLM response"
-
-              fixed_text_response = fix_malformed_json(response_text, client, model_name)
-              if fixed_text_response is not None:
-                  try:
-                      fixed_json = json.loads(fixed_text_response.strip())
-                      save_response_to_file(
-                          fixed_text_response.strip(),
-                          base_name,
-                          f"pdf-extract-{start}-{model_name}",
-                          work_dir,
-                      )
-                      responses.append(fixed_json)
-                  except json.JSONDecodeError:
-                      logging.warning(f"Skipping malformed JSON for pages {start}-{end}")
-              else:
-                  logging.warning(f"Skipping malformed JSON for pages {start}-{end}")
-
-        full_response = json.dumps(responses, ensure_ascii=False, indent=4)
-        save_response_to_file(full_response, base_name, f"pdf-extract-{model_name}", work_dir)
-        return full_response, None # Return response and None for error
+                  chunk.add_response((yield from fix_malformed_json_steps(
+                      response_text, model_name)))
+              _save_chunk_extract(chunk, base_name, model_name, work_dir,
+                                  page_count, responses)
+
+        save_response_to_file(json_codec.dumps(responses, indent=4),
+                              base_name, f"pdf-extract-{model_name}", work_dir)
+        return responses, None # Return response and None for error
 
     except Exception as e:
         error_details = f"Error in process_pdf_text_with_llm (model: {api_model_name}): {type(e).__name__} - {e}"
@@ -198,43 +349,189 @@ def process_pdf_text_with_llm(client, model_name, file, base_name, work_dir):
         logging.error(traceback.format_exc()) # Log full traceback
         return None, error_details # Return None for response and the error details
 
+def _extracted_text(response):
+    text = extract_response_text(response)
+    if text is None:
+        # Cannot extract text, log the response structure for debugging
+        logging.error(f"Could not extract text from LLM response. Response object: {response}")
+    return text
+
+def _checked_extract(response_text):
+    """
+    Parses and validates an extract, see intermediary_schema.
+
+    Returns:
+        tuple: (extract, problems). extract is None if the response is
+               missing or malformed JSON; problems is empty if it is valid.
+    """
+    if response_text is None:
+        return None, ["the output is not valid JSON"]
+    try:
+        extract = json_codec.loads(response_text.strip())
+    except json.JSONDecodeError as e:
+        return None, [f"the output is not valid JSON: {e}"]
+    return extract, intermediary_schema.validate_form(extract)
+
+def _problem_summary(problems):
+    summary = "; ".join(problems[:MAX_REPORTED_PROBLEMS])
+    if len(problems) > MAX_REPORTED_PROBLEMS:
+        summary += f" (and {len(problems) - MAX_REPORTED_PROBLEMS} more)"
+    return summary
+
+def _whole_extract(page_count):
+    """The _ChunkExtract of the whole PDF: if its response parses but fails
+    validation, it is requested again once; if it is malformed, the PDF is
+    processed in page chunks instead (see _append_whole_extract)."""
+    return _ChunkExtract(0, page_count, retries=1, retry_malformed=False)
+
+def _append_whole_extract(whole, responses):
+    """
+    Appends the extract of the whole PDF to responses, even if it still fails
+    validation. It is saved with the pdf-extract output, not on its own.
+
+    Returns:
+        bool: False if the response is malformed JSON, and the PDF needs to
+              be processed in page chunks instead.
+    """
+    if whole.extract is None:
+        return False
+    if whole.problems:
+        logging.warning(
+            f"Keeping the extract although it fails validation: "
+            f"{_problem_summary(whole.problems)}")
+    responses.append(whole.extract)
+    return True
+
+class _ChunkExtract:
+    """
+    The extract of pages start-end. It is requested again, up to `retries`
+    times, while it is malformed (unless retry_malformed is False) or fails
+    validation, with the problems of the last response listed in the prompt.
+    The response with the fewest problems is kept.
+    """
+
+    def __init__(self, start, end, retries=EXTRACT_RETRIES,
+                 retry_malformed=True):
+        self.start = start
+        self.end = end
+        self.retries = retries
+        self.retry_malformed = retry_malformed
+        self.requests = 0
+        self.text = None
+        self.extract = None
+        self.problems = []
+        self.last_problems = []
+
+    def needs_request(self):
+        if self.requests == 0:
+            return True
+        return (bool(self.last_problems) and self.requests <= self.retries and
+                (self.retry_malformed or self.extract is not None))
+
+    def prompt(self):
+        if self.requests == 0:
+            return LLMPrompts.pdf_to_json_prompt()
+        return LLMPrompts.pdf_to_json_retry_prompt(
+            self.last_problems[:MAX_REPORTED_PROBLEMS])
+
+    def stage(self):
+        return "pdf-extract" if self.requests == 0 else "pdf-extract-retry"
+
+    def add_response(self, response_text):
+        """Checks a (fixed) response, see fix_malformed_json."""
+        self.requests += 1
+        extract, self.last_problems = _checked_extract(response_text)
+        if extract is not None and (self.extract is None or
+                                    len(self.last_problems) < len(self.problems)):
+            self.text = response_text.strip()
+            self.extract = extract
+            self.problems = self.last_problems
+        if self.needs_request():
+            logging.warning(
+                f"Requesting pages {self.start}-{self.end} again: "
+                f"{_problem_summary(self.last_problems)}")
+
+def _save_chunk_extract(chunk, base_name, model_name, work_dir, page_count,
+                        responses):
+    """Saves the extract of a _ChunkExtract, unless it is malformed, and
+    publishes the chunk's status: success, invalid (kept, but still failing
+    validation) or skipped."""
+    pages = f"{chunk.start}-{chunk.end}"
+    if chunk.extract is None:
+        chunk_status = "skipped"
+        logging.warning(f"Skipping malformed JSON for pages {pages}")
+    else:
+        save_response_to_file(
+            chunk.text,
+            base_name,
+            f"pdf-extract-{chunk.start}-{model_name}",
+            work_dir,
+        )
+        responses.append(chunk.extract)
+        chunk_status = "invalid" if chunk.problems else "success"
+        if chunk.problems:
+            logging.warning(
+                f"Keeping pages {pages} although they fail validation: "
+                f"{_problem_summary(chunk.problems)}")
+    job_lib.publish("chunk", stage="pdf-extract",
+                    pages=pages, page_count=page_count,
+                    status=chunk_status, requests=chunk.requests)
+
+def response_file_path(base_name, output_suffix, output_directory):
+    """Returns the path save_response_to_file writes a response to."""
+    return os.path.join(output_directory, f"{base_name}-{output_suffix}.json")
+
 def save_response_to_file(response, base_name, output_suffix, output_directory):
     """
     Saves a given response string to a file inside the specified output directory.
     Assumes the directory already exists.
 
+    The file is written in the background, see artifact_writer.py. Use
+    artifacts.when_written() to act once it is on disk, and
+    artifacts.read_text() to read it back before then.
+
     Args:
         response (str): The string to be saved to the file.
         base_name (str): The base name of the file.
         output_suffix (str): The suffix to append to the filename.
         output_directory (str): The absolute path to the directory where the file should be saved.
+
+    Returns:
+        str: The path of the saved file, or None if saving failed.
     """
+    # Construct the path using the provided output directory
+    output_file_full = response_file_path(
+        base_name, output_suffix, output_directory)
     try:
-        # Construct the path using the provided output directory
-        output_file_full = os.path.join(
-            output_directory, f"{base_name}-{output_suffix}.json") # Use output_directory parameter
-
-        # Clean the response
-        cleaned_response = re.sub(r'^\s*```(?:json)?\s*|\s*```\s*$', '', response, flags=re.IGNORECASE)
-
-        # Save the file
-        with open(output_file_full, "w", encoding="utf-8") as f:
-            f.write(cleaned_response)
-
+        output_file_full = artifacts.write(
+            output_file_full, _strip_code_fence(response))
         logging.info(f"{output_suffix} Response saved to: {output_file_full}")
+        return output_file_full
 
     except Exception as e:
         logging.error(f"Error saving response to file '{output_file_full}': {e}")
         logging.error(traceback.format_exc())
-    
-def chunk_text(text, base_name, model_name):
-    """Splits JSON text into well-formed chunks based on title, help_text, and sections."""
-    try:
-        json_obj = json.loads(text)  # Validate input JSON
-    except json.JSONDecodeError:
-        logging.error("Invalid JSON input provided. Cannot split malformed JSON.")
-        return []
+        return None
 
+def _strip_code_fence(response):
+    """
+    Removes a Markdown code fence (```json ... ```) around a response, and
+    the whitespace inside it. Only looks at the ends of the response, rather
+    than running a regular expression over all of it.
+    """
+    stripped = response.lstrip()
+    if stripped.startswith("```"):
+        response = stripped[3:]
+        if response[:4].lower() == "json":
+            response = response[4:]
+        response = response.lstrip()
+    stripped = response.rstrip()
+    if stripped.endswith("```"):
+        response = stripped[:-3].rstrip()
+    return response
+
+def chunk_document(json_obj):
+    """Splits a parsed extract into chunks based on title, help_text, and sections."""
     logging.info("Starting chunking of JSON")
 
     # Ensure json_obj is not empty
@@ -252,48 +549,73 @@ def chunk_text(text, base_name, model_name):
       chunks.append(chunk)
     return chunks
 
-def post_processing_llm(client, model_name, text, base_name, output_json_dir):
-    """Sends extracted json text to Gemini and asks it to collate related fields into appropriate civiform types, in particular names and address."""
-    prompt_post_processing_json = LLMPrompts.post_process_json_prompt(text)
+def post_processing_llm(client, model_name, extract, base_name, output_json_dir):
+    """
+    Sends extracted json to Gemini and asks it to collate related fields into appropriate civiform types, in particular names and address.
+
+    Args:
+        extract: The parsed pdf-extract output, see process_pdf_text_with_llm.
+
+    Returns:
+        list: The parsed post-processed JSON, one form per chunk, or None if
+              post-processing failed.
+    """
+    return run_steps(post_processing_steps(
+        model_name, extract, base_name, output_json_dir), client)
+
+def post_processing_steps(model_name, extract, base_name, output_json_dir):
+    """
+    The steps (see LLMRequest) of post_processing_llm, which returns what
+    they return.
+    """
+    api_model_name = api_model_name_for(model_name)
 
     try:
-        chunks = chunk_text(text, base_name, model_name)
+        chunks = chunk_document(extract)
         aggregated_responses  = []   # Store processed responses as a single dictionary
         logging.info("post_processing_json_with_llm: Collating names, addresses ...")
 
-        if not model_name.startswith("models/"):
-            api_model_name = f"models/{model_name}"
-        else:
-            api_model_name = model_name
         for i, chunk in enumerate(chunks):
             prompt_post_processing_json = LLMPrompts.post_process_json_prompt(chunk)
 
-            response = client.models.generate_content(
-                model=api_model_name,
-                contents=[prompt_post_processing_json]
-                # TODO add safety_settings here
-                )
-
-            # Extract text robustly, similar to process_pdf_text_with_llm
-            if hasattr(response, 'text'):
-                 response_text = response.text.strip("`").lstrip(
-                     "json")
-            elif hasattr(response, 'candidates') and response.candidates and hasattr(response.candidates[0], 'content') and response.candidates[0].content.parts:
-                 response_text = response.candidates[0].content.parts[0].text.strip("`").lstrip("json").strip()
-            else:
-                 logging.error(f"Could not extract text from LLM post-processing response. Response object: {response}")
-                 return None # Treat as failure
+            # TODO add safety_settings here
+            response = yield LLMRequest(
+                api_model_name, [prompt_post_processing_json], "post-process")
 
-            aggregated_responses.append(json.loads(response_text))
-
-        result=json.dumps(aggregated_responses, ensure_ascii=False, indent=4)
-        if logging.getLogger().getEffectiveLevel() == logging.DEBUG:
-          save_response_to_file(result, base_name, f"post-processed-{model_name}", output_json_dir)
-        return result  # Return as a formatted JSON string
+            if not _append_post_processed_chunk(
+                    response, i, len(chunks), aggregated_responses):
+                return None # Treat as failure
 
+        return _post_processing_result(
+            aggregated_responses, base_name, model_name, output_json_dir)
 
     except Exception as e:
         error_details = f"Error during collating fields (model: {api_model_name}): {type(e).__name__} - {e}"
         logging.error(error_details)
         logging.error(traceback.format_exc()) # Log full traceback
         return None
+
+def _append_post_processed_chunk(response, i, chunk_count, aggregated_responses):
+    """
+    Parses the post-processing response for chunk i and appends it to
+    aggregated_responses.
+
+    Returns:
+        bool: False if the response has no text.
+    """
+    # Extract text robustly, similar to process_pdf_text_with_llm
+    text = extract_response_text(response)
+    if text is None:
+        logging.error(f"Could not extract text from LLM post-processing response. Response object: {response}")
+        return False
+
+    aggregated_responses.append(json_codec.loads(text))
+    job_lib.publish("chunk", stage="post-process", chunk=i + 1,
+                    chunk_count=chunk_count, status="success")
+    return True
+
+def _post_processing_result(aggregated_responses, base_name, model_name, output_json_dir):
+    if log_lib.is_enabled_for(logging.DEBUG):
+      save_response_to_file(json_codec.dumps(aggregated_responses, indent=4),
+                            base_name, f"post-processed-{model_name}", output_json_dir)
+    return aggregated_responses
@@ -0,0 +1,72 @@
+import asyncio
+import llm_lib
+import types
+import unittest
+
+
+class EchoModels:
+    """ Answers each call with its prompt, or raises it if it is an
+    exception. """
+
+    def generate_content(self, model, contents):
+        if isinstance(contents[0], Exception):
+            raise contents[0]
+        return contents[0]
+
+
+class AsyncEchoModels:
+
+    async def generate_content(self, model, contents):
+        return EchoModels().generate_content(model, contents)
+
+
+CLIENT = types.SimpleNamespace(
+    models=EchoModels(), aio=types.SimpleNamespace(models=AsyncEchoModels()))
+
+
+def steps():
+    """ Asks for two answers, then for an error, and returns them all. """
+    answers = [(yield llm_lib.LLMRequest("gemini-test", ["a"], "test"))]
+    answers.append((yield llm_lib.LLMRequest("gemini-test", ["b"], "test")))
+    try:
+        yield llm_lib.LLMRequest("gemini-test", [ValueError("c")], "test")
+    except ValueError as e:
+        answers.append(str(e))
+    return answers
+
+
+class TestRunSteps(unittest.TestCase):
+
+    def test_sync_and_async_drivers_answer_alike(self):
+        self.assertEqual(llm_lib.run_steps(steps(), CLIENT), ["a", "b", "c"])
+        self.assertEqual(asyncio.run(llm_lib.run_steps_async(steps(), CLIENT)),
+                         ["a", "b", "c"])
+
+    def test_async_driver_closes_cancelled_steps(self):
+        closed = []
+
+        def waiting_steps():
+            try:
+                yield llm_lib.LLMRequest("gemini-test", ["a"], "test")
+            finally:
+                closed.append(True)
+
+        async def cancel():
+            async def never_answer(model, contents):
+                await asyncio.Event().wait()
+
+            client = types.SimpleNamespace(aio=types.SimpleNamespace(
+                models=types.SimpleNamespace(generate_content=never_answer)))
+            task = asyncio.create_task(
+                llm_lib.run_steps_async(waiting_steps(), client))
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel())
+        self.assertEqual(closed, [True])
+
+
+if __name__ == '__main__':
+    unittest.main()
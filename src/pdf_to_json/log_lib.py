@@ -0,0 +1,189 @@
+""" Per-request log capture for the PDF->CiviForm web app.
+
+Each request captures its own log lines into a bounded ring buffer and
+filters them at its own log level. The capture is found through a context
+variable, so concurrent requests (threaded gunicorn, or worker threads that
+copy the request's context) never see each other's lines.
+
+The root logger level is the lowest level any active capture asks for, or
+the base level when no request wants more detail. Console handlers stay at
+the base level, so one DEBUG request does not flood the console with every
+other request's debug lines.
+"""
+
+import collections
+import contextvars
+import logging
+import sys
+import threading
+
+# The maximum number of lines kept per request. Older lines are dropped.
+MAX_LOG_LINES = 2000
+
+_current_capture = contextvars.ContextVar('current_log_capture', default=None)
+
+_base_level = logging.INFO
+_active_levels = collections.Counter()
+_levels_lock = threading.Lock()
+
+
+class LogCapture:
+    """ A bounded, thread-safe buffer of formatted log lines. """
+
+    def __init__(self, level=logging.INFO, max_lines=MAX_LOG_LINES):
+        self.level = level
+        self.dropped_lines = 0
+        self._lines = collections.deque(maxlen=max_lines)
+        self._lock = threading.Lock()
+        self._is_open = False
+
+    def open(self):
+        """ Asks the root logger for this capture's level until close(). """
+        with self._lock:
+            if self._is_open:
+                return
+            self._is_open = True
+        _add_active_level(self.level)
+
+    def close(self):
+        with self._lock:
+            if not self._is_open:
+                return
+            self._is_open = False
+        _remove_active_level(self.level)
+
+    def append(self, line):
+        with self._lock:
+            if len(self._lines) == self._lines.maxlen:
+                self.dropped_lines += 1
+            self._lines.append(line)
+
+    def getvalue(self):
+        """ Returns the captured lines as one newline-terminated string. """
+        with self._lock:
+            lines = list(self._lines)
+            dropped_lines = self.dropped_lines
+        if dropped_lines:
+            lines.insert(0, f"... {dropped_lines} earlier log lines dropped ...")
+        return "".join(line + "\n" for line in lines)
+
+
+def _update_root_level_locked():
+    """ Must be called with _levels_lock held. """
+    levels = [level for (level, count) in _active_levels.items() if count > 0]
+    logging.getLogger().setLevel(min(levels + [_base_level]))
+
+
+def _add_active_level(level):
+    with _levels_lock:
+        _active_levels[level] += 1
+        _update_root_level_locked()
+
+
+def _remove_active_level(level):
+    with _levels_lock:
+        _active_levels[level] -= 1
+        if _active_levels[level] <= 0:
+            del _active_levels[level]
+        _update_root_level_locked()
+
+
+def set_base_level(level):
+    """ Sets the level used for console output and for code outside requests.
+
+    Args:
+      level: A logging level, e.g. logging.INFO.
+    """
+    global _base_level
+    with _levels_lock:
+        _base_level = level
+        for handler in logging.getLogger().handlers:
+            if _is_console_handler(handler):
+                handler.setLevel(level)
+        _update_root_level_locked()
+
+
+def _is_console_handler(handler):
+    return (type(handler) is logging.StreamHandler and
+            handler.stream in (sys.stderr, sys.stdout))
+
+
+def parse_level(level_str, default=logging.INFO):
+    """ Converts a level name such as "DEBUG" to a logging level. """
+    level = getattr(logging, (level_str or '').upper(), None)
+    return level if isinstance(level, int) else default
+
+
+class RequestLevelFilter(logging.Filter):
+    """ Drops records below the log level of the current request's capture.
+
+    Outside of a capture, every record that reached the handler passes.
+    """
+
+    def filter(self, record):
+        capture = _current_capture.get()
+        return capture is None or record.levelno >= capture.level
+
+
+class CaptureHandler(logging.Handler):
+    """ Logging handler that appends records to the current capture. """
+
+    def emit(self, record):
+        capture = _current_capture.get()
+        if capture is None or record.levelno < capture.level:
+            return
+        try:
+            capture.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+
+def install(formatter):
+    """ Adds the capture handler to the root logger.
+
+    Args:
+      formatter: The logging.Formatter used for captured lines.
+    """
+    handler = CaptureHandler()
+    handler.setFormatter(formatter)
+    logging.getLogger().addHandler(handler)
+    set_base_level(_base_level)
+
+
+def start_capture(level=logging.INFO):
+    """ Makes a new capture current in the current context.
+
+    The web apps start a capture for each request, in a context of its own
+    (see contextvars.copy_context()) that a streamed response keeps using
+    after the route returns. The caller must call close() on the returned
+    LogCapture when it is done.
+
+    Args:
+      level: The request's log level.
+
+    Returns:
+      The LogCapture.
+    """
+    log_capture = LogCapture(level)
+    log_capture.open()
+    _current_capture.set(log_capture)
+    return log_capture
+
+
+def current_capture():
+    """ Returns the LogCapture of the current context, or None. """
+    return _current_capture.get()
+
+
+def captured_log():
+    """ Returns the lines captured so far in the current context. """
+    log_capture = _current_capture.get()
+    return log_capture.getvalue() if log_capture is not None else ""
+
+
+def is_enabled_for(level):
+    """ Whether the current request (or the base level) logs at `level`. """
+    log_capture = _current_capture.get()
+    if log_capture is not None:
+        return level >= log_capture.level
+    return level >= _base_level
@@ -0,0 +1,93 @@
+import contextvars
+import log_lib
+import logging
+import threading
+import unittest
+
+
+def captured(level, function):
+    """ Runs function with a capture at `level`, in a context of its own, the
+    way the web apps run a request. Returns the capture, closed. """
+    def run():
+        log_capture = log_lib.start_capture(level)
+        try:
+            function()
+        finally:
+            log_capture.close()
+        return log_capture
+    return contextvars.copy_context().run(run)
+
+
+class TestLogCapture(unittest.TestCase):
+
+    def setUp(self):
+        log_lib.set_base_level(logging.INFO)
+        self.handler = log_lib.CaptureHandler()
+        self.handler.setFormatter(logging.Formatter('%(message)s'))
+        # Only this handler: the web app's, when a test module imports it,
+        # would capture every line a second time.
+        root = logging.getLogger()
+        self.saved_handlers = root.handlers[:]
+        root.handlers = [self.handler]
+
+    def tearDown(self):
+        logging.getLogger().handlers = self.saved_handlers
+
+    def test_ring_buffer_is_bounded(self):
+        log_capture = log_lib.LogCapture(max_lines=3)
+        for i in range(5):
+            log_capture.append(str(i))
+        self.assertEqual(log_capture.getvalue(),
+                         "... 2 earlier log lines dropped ...\n2\n3\n4\n")
+
+    def test_per_request_level(self):
+        debug_capture = captured(
+            logging.DEBUG, lambda: logging.debug('debug line'))
+
+        def log_lines():
+            logging.debug('hidden line')
+            logging.info('info line')
+        info_capture = captured(logging.INFO, log_lines)
+        self.assertEqual(debug_capture.getvalue(), 'debug line\n')
+        self.assertEqual(info_capture.getvalue(), 'info line\n')
+
+    def test_root_level_restored(self):
+        captured(logging.DEBUG, lambda: self.assertEqual(
+            logging.getLogger().level, logging.DEBUG))
+        self.assertEqual(logging.getLogger().level, logging.INFO)
+
+    def test_concurrent_captures_are_isolated(self):
+        lines = {}
+        barrier = threading.Barrier(4)
+
+        def run(name):
+            def log_lines():
+                barrier.wait()
+                for i in range(50):
+                    logging.info(f"{name}-{i}")
+                barrier.wait()
+            lines[name] = captured(logging.INFO, log_lines).getvalue().split()
+
+        threads = [threading.Thread(target=run, args=(f"t{n}",))
+                   for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(lines), 4)
+        for (name, name_lines) in lines.items():
+            self.assertEqual(name_lines, [f"{name}-{i}" for i in range(50)])
+
+    def test_capture_follows_copied_context(self):
+        def log_from_worker():
+            context = contextvars.copy_context()
+            thread = threading.Thread(
+                target=context.run, args=(logging.info, 'from worker'))
+            thread.start()
+            thread.join()
+        log_capture = captured(logging.INFO, log_from_worker)
+        self.assertEqual(log_capture.getvalue(), 'from worker\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,18 +1,35 @@
 from pathlib import Path
-import json
+import admission_lib
+import collections
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import contextvars
+import convert_batch_lib
+import functools
+import json_codec
+import job_lib
 import llm_lib as llm
+import log_lib
 import pymupdf
-from flask import Flask, request, jsonify, render_template
+import run_manifest
+import storage_janitor
+from flask import Flask, Response, request, jsonify, render_template, send_file, stream_with_context
+from werkzeug.serving import is_running_from_reloader
 from werkzeug.utils import secure_filename
 import os
 import logging
 import re
+import response_lib
+import result_cache
 from convert_to_civiform_json import convert_to_civiform_json
+from format_json_lib import format_data_single_line_fields
 from LLM_prompts import LLMPrompts
-from io import StringIO
 import traceback # Import the traceback module
+import upload_lib
 import sys
+import tempfile
+import threading
 import argparse # Import argparse
+import batch_lib
 
 
 # This script extracts text from uploaded PDF files, uses Gemini LLM to
@@ -26,23 +43,38 @@ import argparse # Import argparse
 
 # run web server: python pdf_to_civiform_gemini.py
 # run command line: python pdf_to_civiform_gemini.py --input-file /path/to/file.pdf [--model-name model] [--log-level LEVEL]
+# run a batch: python pdf_to_civiform_gemini.py --input-directory /path/to/pdfs [--max-workers N] [--no-resume]
 # output files are stored in ~/pdf_to_civiform/output-json
 
 # --- Global Configuration ---
 DEFAULT_MODEL_NAME = "gemini-2.0-flash"
+# Number of PDFs processed at once by /upload_directory, unless the request
+# asks for a different number (up to MAX_DIRECTORY_WORKERS).
+DEFAULT_DIRECTORY_WORKERS = 4
+MAX_DIRECTORY_WORKERS = 16
 
 # Configure logging (Initial setup, level can be changed later via CLI)
 logging.basicConfig(
     level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Capture logging output for web display (if web server runs)
-log_stream = StringIO()
-log_handler = logging.StreamHandler(log_stream)
-log_handler.setFormatter(
+# Capture logging output of each request for web display (if web server
+# runs). Each request gets its own bounded buffer and log level.
+log_lib.install(
     logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-logging.getLogger().addHandler(log_handler)
+
+# Forward log lines to the job (if any) that is running in the current
+# request, so they can be streamed from /jobs/<job_id>/events.
+job_log_handler = job_lib.JobLogHandler()
+job_log_handler.setFormatter(
+    logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+job_log_handler.addFilter(log_lib.RequestLevelFilter())
+logging.getLogger().addHandler(job_log_handler)
 
 app = Flask(__name__)
+app.json = response_lib.JSONProvider(app)
+# Uploads are processed from memory (see upload_lib.py), so cap their size.
+# Larger requests are rejected with 413.
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get("MAX_UPLOAD_MB", "64")) * 1024 * 1024
 
 # --- Directory Setup ---
 try:
@@ -52,9 +84,21 @@ try:
 
     default_upload_dir = os.path.join(work_dir, 'uploads')
     output_json_dir = os.path.join(work_dir, "output-json")
+    # Checkpoint manifests of directory runs, see run_manifest.py.
+    runs_dir = os.path.join(work_dir, "runs")
+    # Output archives of batch uploads, see batch_lib.py.
+    batches_dir = os.path.join(work_dir, "batches")
+    # Final results of uploaded PDFs, see result_cache.py.
+    result_cache_dir = os.path.join(work_dir, "result_cache")
+    # Which PDF content owns each output filename prefix, see pipeline_names.
+    output_names_dir = os.path.join(work_dir, "output-names")
 
     os.makedirs(default_upload_dir, exist_ok=True)
     os.makedirs(output_json_dir, exist_ok=True)
+    os.makedirs(runs_dir, exist_ok=True)
+    os.makedirs(batches_dir, exist_ok=True)
+    os.makedirs(result_cache_dir, exist_ok=True)
+    os.makedirs(output_names_dir, exist_ok=True)
 
     logging.info(f"Using base directory: {work_dir}")
     logging.info(f"upload directory: {default_upload_dir}")
@@ -65,383 +109,1465 @@ except (ValueError, OSError) as e:
           f"Check path and permissions. Error: {e}", file=sys.stderr)
     sys.exit(f"Startup failed: Directory setup error.")
 
+upload_result_cache = result_cache.ResultCache(result_cache_dir)
+
+# Caps on conversions running at once, globally and per Gemini API key, see
+# admission_lib.py.
+admission = admission_lib.AdmissionController()
+
+# Age- and size-based eviction of uploads, outputs, archives, cache entries
+# and manifests, see storage_janitor.py. The PDF-extract outputs are written
+# directly to work_dir, which may hold other files: only those are managed
+# there.
+storage = storage_janitor.StorageJanitor(
+    roots=[(default_upload_dir, True), (output_json_dir, False),
+           (work_dir, False, "*-pdf-extract-*.json"), (batches_dir, False),
+           (result_cache_dir, False), (runs_dir, False)],
+    manifests_dir=runs_dir)
 
-def format_json_single_line_fields(json_string: str) -> str:
+
+def process_file(file_full, model_name, client, manifest=None,
+                 file_bytes=None, content_hash=None):
     """
-    Formats a JSON string to ensure all field attributes (including options)
-    are on a single line, while maintaining readability for nested structures.
+    Processes a single PDF file, extracts data, interacts with the LLM, and converts it to CiviForm JSON.
 
     Args:
-        json_string (str): The JSON string to format.
+        file_full (str): The full path to the PDF file.
+        model_name (str): The name of the LLM model to use.
+        client : The initialized Gemini client.
+        manifest (RunManifest, optional): Checkpoints of the run this file
+            belongs to. Stages already completed for this PDF's content are
+            not redone; their saved outputs are reused.
+        file_bytes (bytes, optional): The PDF's content, when the caller
+            already has it in memory (e.g. an upload). If None, the content
+            is read from file_full.
+        content_hash (str, optional): The SHA-256 hex digest of file_bytes,
+            if already computed.
 
     Returns:
-        str: The formatted JSON string.
-
+        dict: A dictionary containing 'intermediary_json' and 'civiform_json' strings, or None if processing fails.
     Raises:
-        json.JSONDecodeError: If the input string is not valid JSON.
-        ValueError: If an unexpected error occurs during formatting.
+        Exception: If LLM processing or post-processing fails.
+    """
+    return llm.run_steps(process_file_steps(
+        file_full, model_name, manifest, file_bytes, content_hash), client)
+
+
+def process_file_steps(file_full, model_name, manifest=None, file_bytes=None,
+                       content_hash=None):
+    """
+    The steps of process_file, which returns what they return: a generator
+    of the pipeline's LLM calls (see llm_lib.LLMRequest), so that the async
+    app (async_app.process_file_async) runs the same pipeline, and only
+    awaits the calls.
     """
     try:
-        data = json.loads(json_string)
-
-        def custom_dumps(obj, level=0):
-            if isinstance(obj, dict):
-                if "label" in obj and "type" in obj and "id" in obj:
-                    # Format field objects on a single line
-                    return json.dumps(
-                        obj, separators=(',', ':'), sort_keys=False)
-                else:
-                    # Format other dictionaries with indentation
-                    return "{\n" + "".join(
-                        f"{'    ' * (level + 1)}{json.dumps(k, separators=(',', ':'), sort_keys=False)}: {custom_dumps(v, level + 1)},\n"
-                        for k, v in obj.items())[:-2] + "\n" + (
-                            "    " * level) + "}"
-            elif isinstance(obj, list):
-                # Format lists with indentation and single-line fields
-                return "[\n" + "".join(
-                    f"{'    ' * (level + 1)}{custom_dumps(item, level + 1)},\n"
-                    for item in obj)[:-2] + "\n" + ("    " * level) + "]"
+        logging.info(f"Processing file: {file_full} ...")
+        with storage.in_use(file_full, prefixes=pipeline_prefixes(file_full)):
+            if file_bytes is None:
+                file_bytes = Path(file_full).read_bytes()
+            if content_hash is None:
+                content_hash = run_manifest.hash_bytes(file_bytes)
+            filename, base_name = pipeline_names(file_full, content_hash)
+            checkpoint = checkpoint_for(manifest, file_bytes, filename, content_hash)
+
+            completed = completed_result(checkpoint, filename)
+            if completed is not None:
+                return completed
+
+            # Stages pass parsed JSON to each other. It is serialized only
+            # to be saved, and parsed only when resuming from a saved output.
+            intermediary_json = resumed_output(checkpoint, "post-process", filename)
+            if intermediary_json is not None:
+                intermediary_data = json_codec.loads(intermediary_json)
             else:
-                return json.dumps(obj, separators=(',', ':'), sort_keys=False)
+                extract = resumed_data(checkpoint, "pdf-extract", filename)
+                if extract is None:
+                    job_lib.publish("stage", stage="pdf-extract", file=filename)
+                    extract, llm_error = yield from llm.process_pdf_text_steps(
+                        model_name, file_bytes, base_name, work_dir)
+                    record_extract(checkpoint, extract, llm_error,
+                                   file_full, base_name, model_name)
+
+                format_extract(extract, filename, base_name, model_name)
+
+                job_lib.publish("stage", stage="post-process", file=filename)
+                intermediary_data = yield from llm.post_processing_steps(
+                    model_name, extract, base_name, output_json_dir)
+                intermediary_json = format_post_processed(
+                    checkpoint, intermediary_data, file_full, base_name,
+                    model_name)
+
+            return convert_post_processed(
+                checkpoint, intermediary_json, intermediary_data, file_full,
+                base_name, model_name)
+    except Exception as e:
+        logging.error(f"Failed to process file {file_full}: {e}")
+        raise # Re-raise the exception to be caught in the route
 
-        return custom_dumps(data)
 
-    except json.JSONDecodeError as e:
-        logging.error(f"Error decoding JSON: {e}")
-        raise  # Re-raise the exception to be handled by the caller
-    except Exception as e:
-        logging.error(f"An unexpected error occurred: {e}")
-        raise ValueError(
-            f"An unexpected error occurred during JSON formatting: {e}"
-        ) from e  # Raise a ValueError
+# The result of run_pipeline: the intermediary and CiviForm JSON strings,
+# and the files saved for the PDF, see pipeline_output_paths.
+PipelineResult = collections.namedtuple(
+    'PipelineResult', ['intermediary_json', 'civiform_json', 'output_paths'])
 
 
-def process_file(file_full, model_name, client):
+def run_pipeline(file_full, model_name, client, manifest=None):
     """
-    Processes a single PDF file, extracts data, interacts with the LLM, and converts it to CiviForm JSON.
+    Runs the whole pipeline on a PDF in this process, for callers that
+    import this module rather than running it as a script (e.g.
+    regression_test.py). Unlike process_file, it returns once the output
+    files are on disk, and says where they are.
 
     Args:
         file_full (str): The full path to the PDF file.
         model_name (str): The name of the LLM model to use.
-        client : The initialized Gemini client.
+        client: The initialized Gemini client.
+        manifest (RunManifest, optional): See process_file.
 
     Returns:
-        dict: A dictionary containing 'intermediary_json' and 'civiform_json' strings, or None if processing fails.
+        PipelineResult: The JSON strings and the paths of the saved files.
+
     Raises:
-        Exception: If LLM processing or post-processing fails.
+        Exception: If a stage of the pipeline fails.
     """
+    file_bytes = Path(file_full).read_bytes()
+    content_hash = run_manifest.hash_bytes(file_bytes)
+    result = process_file(file_full, model_name, client, manifest,
+                          file_bytes=file_bytes, content_hash=content_hash)
+    if not result or not result.get("civiform_json"):
+        raise Exception(f"No CiviForm JSON was generated for {file_full}")
+    llm.artifacts.flush()
+    return PipelineResult(
+        result["intermediary_json"], result["civiform_json"],
+        pipeline_output_paths(file_full, model_name, content_hash))
+
+
+def process_upload(file_full, model_name, client, file_bytes, content_hash,
+                   use_cache=True):
+    """
+    Runs process_file on an uploaded PDF, through the result cache: a PDF
+    already converted with the same model is served from the cache, and
+    identical uploads being converted at the same time share one run.
+
+    Args:
+        file_full (str): Where the upload is saved.
+        model_name (str): The name of the LLM model to use.
+        client: The initialized Gemini client.
+        file_bytes (bytes): The PDF's content.
+        content_hash (str): The SHA-256 hex digest of file_bytes.
+        use_cache (bool): If False, always run the pipeline. The new result
+            is not cached either.
+
+    Returns:
+        dict: As for process_file.
+    """
+    if not use_cache:
+        return process_file(file_full, model_name, client,
+                            file_bytes=file_bytes, content_hash=content_hash)
+    result, status = upload_result_cache.get_or_compute(
+        upload_result_cache.key(content_hash, model_name),
+        functools.partial(process_file, file_full, model_name, client,
+                          file_bytes=file_bytes, content_hash=content_hash),
+        model_name)
+    report_cache_status(os.path.basename(file_full), status)
+    return result
+
+
+def report_cache_status(filename, status):
+    """ Logs and publishes how the result cache served a file, if it did. """
+    if status == result_cache.HIT:
+        logging.info(f"Served {filename} from the result cache.")
+    elif status == result_cache.JOINED:
+        logging.info(f"{filename} was converted by an identical request in flight.")
+    else:
+        return
+    job_lib.publish("stage", stage="done", file=filename, cached=status)
+
+
+# --- Pipeline steps, see process_file_steps ---
+
+def _name_prefix(file_full):
+    # The filename without extension, limited to 15 chars to avoid extremely
+    # long output filenames.
+    base_name, _ = os.path.splitext(os.path.basename(file_full))
+    return base_name[:15]
+
+
+def pipeline_names(file_full, content_hash):
+    """
+    Returns (filename, base_name) for a PDF. base_name, the prefix of the
+    PDF's output filenames, is the filename without extension, limited to 15
+    chars. Each base name belongs to the first PDF content that used it
+    (see _claim_output_name): a PDF with other content whose name starts
+    the same gets the first 8 hex digits of its content hash appended
+    instead, so that the two never share output files, and so neither do
+    their manifest entries, which are keyed by content hash.
+
+    Args:
+        file_full (str): The path of the PDF.
+        content_hash (str): The SHA-256 hex digest of the PDF's content.
+    """
+    prefix = _name_prefix(file_full)
+    for base_name in (prefix, f"{prefix}-{content_hash[:8]}",
+                      f"{prefix}-{content_hash}"):
+        if _claim_output_name(base_name, content_hash):
+            break
+    return os.path.basename(file_full), base_name
+
+
+def _claim_output_name(base_name, content_hash):
+    """
+    Claims an output base name for a PDF's content, unless another content
+    already owns it. A claim is a file in output_names_dir holding the
+    content hash. It is linked into place, which fails if it exists, so
+    concurrent runs (in any process) agree on the owner.
+
+    Returns:
+        bool: True if base_name belongs to content_hash.
+    """
+    path = os.path.join(output_names_dir, base_name)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
     try:
-        # Extract the base filename without extension
-        filename = os.path.basename(file_full)
-        base_name, _ = os.path.splitext(filename)
-        base_name = base_name[:
-                              15]  # limit to 15 chars to avoid extremely long filenames
-        logging.info(f"Processing file: {file_full} ...")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content_hash)
+        os.link(tmp_path, path)
+        return True
+    except FileExistsError:
+        with open(path, encoding="utf-8") as f:
+            return f.read() == content_hash
+    finally:
+        os.remove(tmp_path)
+
+
+def pipeline_prefixes(file_full):
+    """
+    Returns the filename prefixes of a PDF's outputs, to keep them from the
+    storage janitor while the PDF is processed. They are known before the
+    PDF is read: the prefixes cover the outputs of every PDF whose name
+    starts the same.
+    """
+    prefix = _name_prefix(file_full)
+    return [os.path.join(work_dir, f"{prefix}-"),
+            os.path.join(output_json_dir, f"{prefix}-")]
+
+
+def pipeline_output_paths(file_full, model_name, content_hash):
+    """
+    Returns the paths of the files the pipeline saves for a PDF, by stage:
+    'pdf-extract', 'format', 'post-process' and 'civiform'.
+    """
+    _, base_name = pipeline_names(file_full, content_hash)
+    return {
+        stage: llm.artifacts.output_path(
+            llm.response_file_path(prefix, suffix, directory))
+        for (stage, prefix, suffix, directory) in (
+            ("pdf-extract", base_name, f"pdf-extract-{model_name}", work_dir),
+            ("format", base_name, f"formated-{model_name}", output_json_dir),
+            ("post-process", f"{base_name}-post-processed",
+             f"formated-{model_name}", output_json_dir),
+            ("civiform", base_name, f"civiform-{model_name}", output_json_dir))
+    }
+
+
+def checkpoint_for(manifest, file_bytes, filename, content_hash=None):
+    """ Returns the checkpoint of a PDF in `manifest`, which may be None. """
+    if manifest is None:
+        return run_manifest.NO_CHECKPOINT
+    return manifest.checkpoint(file_bytes, filename, content_hash)
+
+
+def completed_result(checkpoint, filename):
+    """
+    Returns the saved result of a PDF whose stages are all done, or None.
+    """
+    post_processed_path = checkpoint.output("post-process")
+    civiform_path = checkpoint.output("civiform")
+    if not (post_processed_path and civiform_path):
+        return None
+    logging.info(f"Skipping {filename}: already completed in this run.")
+    job_lib.publish("stage", stage="done", file=filename, resumed=True)
+    return {
+        "intermediary_json": llm.artifacts.read_text(post_processed_path),
+        "civiform_json": llm.artifacts.read_text(civiform_path)
+    }
+
+
+def resumed_output(checkpoint, stage, filename):
+    """ Returns the saved output of a completed stage, or None. """
+    path = checkpoint.output(stage)
+    if not path:
+        return None
+    logging.info(f"Resuming {filename} from saved {stage} output.")
+    return llm.artifacts.read_text(path)
+
+
+def resumed_data(checkpoint, stage, filename):
+    """ Returns the parsed saved output of a completed stage, or None. """
+    output = resumed_output(checkpoint, stage, filename)
+    return None if output is None else json_codec.loads(output)
+
+
+def record_extract(checkpoint, extract, llm_error, file_full,
+                   base_name, model_name):
+    """ Checkpoints the pdf-extract stage, or raises if it failed. """
+    if extract is None:
+        raise Exception(f"LLM processing failed for file: {file_full}. Details: {llm_error}")
+    record_when_written(checkpoint, "pdf-extract", llm.artifacts.output_path(
+        llm.response_file_path(base_name, f"pdf-extract-{model_name}", work_dir)))
+
+
+def record_when_written(checkpoint, stage, output_path):
+    """
+    Checkpoints a stage once its output file, which is written in the
+    background, is on disk. A resumed run never finds a stage done without
+    its output.
+    """
+    if output_path:
+        llm.artifacts.when_written(
+            output_path, functools.partial(checkpoint.record, stage))
+
+
+def format_extract(extract, filename, base_name, model_name):
+    """ Formats and saves the (parsed) pdf-extract output. """
+    job_lib.publish("stage", stage="format", file=filename)
+    logging.info(f"Formating json  .... ")
+    llm.save_response_to_file(
+        format_data_single_line_fields(extract), base_name,
+        f"formated-{model_name}", output_json_dir)
 
-        filepath = Path(file_full)
-        file_bytes = filepath.read_bytes()
-        structured_json, llm_error = llm.process_pdf_text_with_llm(
-            client, model_name, file_bytes, base_name, work_dir)
-
-        if structured_json is None:
-            raise Exception(f"LLM processing failed for file: {file_full}. Details: {llm_error}")
-
-        logging.info(f"Formating json  .... ")
-        formated_json = format_json_single_line_fields(structured_json)
-        llm.save_response_to_file(
-            formated_json, base_name, f"formated-{model_name}", output_json_dir)
-
-        post_processed_json = llm.post_processing_llm(
-            client, model_name, formated_json, base_name, output_json_dir)
-        if post_processed_json is None:
-            raise Exception(f"LLM post-processing failed for file: {file_full}")
-
-        logging.info(f"Formating post processed json  .... ")
-        formated_post_processed_json = format_json_single_line_fields(
-            post_processed_json)
-        llm.save_response_to_file(
-            formated_post_processed_json, f"{base_name}-post-processed",
-            f"formated-{model_name}", output_json_dir)
-
-        parsed_json = json.loads(formated_post_processed_json)
-        civiform_json = convert_to_civiform_json(parsed_json[0])
-        llm.save_response_to_file(
-            civiform_json, base_name, f"civiform-{model_name}", output_json_dir)
-        logging.info(f"Done processing file: {file_full}")
-
-        # Return both the intermediary and CiviForm JSON
-        return {
-            "intermediary_json": formated_post_processed_json,
-            "civiform_json": civiform_json
-        }
+
+def format_post_processed(checkpoint, post_processed, file_full,
+                          base_name, model_name):
+    """
+    Formats, saves and checkpoints the (parsed) post-process output, or
+    raises if post-processing failed.
+
+    Returns:
+        str: The formatted JSON, which is the intermediary JSON of the result.
+    """
+    if post_processed is None:
+        raise Exception(f"LLM post-processing failed for file: {file_full}")
+
+    logging.info(f"Formating post processed json  .... ")
+    formated_post_processed_json = format_data_single_line_fields(
+        post_processed)
+    record_when_written(checkpoint, "post-process", llm.save_response_to_file(
+        formated_post_processed_json, f"{base_name}-post-processed",
+        f"formated-{model_name}", output_json_dir))
+    return formated_post_processed_json
+
+
+def convert_post_processed(checkpoint, intermediary_json, intermediary_data,
+                           file_full, base_name, model_name):
+    """
+    Converts the post-processed JSON to CiviForm JSON, saves and checkpoints it.
+
+    Args:
+        intermediary_json (str): The formatted post-processed JSON.
+        intermediary_data (list): The same, parsed. Its first form is
+            converted; the converter may modify it.
+
+    Returns:
+        dict: 'intermediary_json' and 'civiform_json' strings.
+    """
+    filename = os.path.basename(file_full)
+    job_lib.publish("stage", stage="civiform-convert", file=filename)
+    civiform_json = convert_to_civiform_json(intermediary_data[0])
+    record_when_written(checkpoint, "civiform", llm.save_response_to_file(
+        civiform_json, base_name, f"civiform-{model_name}", output_json_dir))
+    job_lib.publish("stage", stage="done", file=filename)
+    logging.info(f"Done processing file: {file_full}")
+
+    # Return both the intermediary and CiviForm JSON
+    return {
+        "intermediary_json": intermediary_json,
+        "civiform_json": civiform_json
+    }
+
+
+def runs_in_request_scope(route):
+    """
+    Runs a route in a context of its own, with a log capture at the level
+    given by the request's 'logLevel' form field (INFO by default) and the
+    job named by its 'jobId' form field (see POST /jobs), whose progress can
+    be streamed from /jobs/<job_id>/events. Requests without a jobId run in
+    a new job. The response names the job in its X-Job-Id header.
+
+    If the route returns a streamed response, the response body is generated
+    in the same context, and the capture and job stay open until the
+    response is closed.
+    """
+    @functools.wraps(route)
+    def wrapper(*args, **kwargs):
+        context = contextvars.copy_context()
+        return context.run(
+            _run_in_request_scope, context, route, args, kwargs)
+    return wrapper
+
+
+def _run_in_request_scope(context, route, args, kwargs):
+    log_capture = log_lib.start_capture(
+        log_lib.parse_level(request.form.get('logLevel')))
+    job = job_lib.start_job(request.form.get('jobId'))
+
+    def close_scope():
+        job_lib.end_job(job)
+        log_capture.close()
+
+    try:
+        response = app.make_response(route(*args, **kwargs))
     except Exception as e:
-        logging.error(f"Failed to process file {file_full}: {e}")
-        raise # Re-raise the exception to be caught in the route
+        job_lib.end_job(job, e)
+        log_capture.close()
+        raise
+    response.headers[JOB_ID_HEADER] = job.job_id
+
+    if response.is_streamed:
+        response.response = _iter_in_context(context, response.response)
+        response.call_on_close(close_scope)
+    else:
+        close_scope()
+    return response
+
+
+def requires_admission(request_slots=lambda: 1):
+    """
+    Admits a conversion route through the admission controller before it
+    runs, or answers 429 with a Retry-After header if the request cannot be
+    admitted. Apply it inside runs_in_request_scope.
+
+    The request's slots are held until its response is complete, which for a
+    streamed response is when the stream is closed.
+
+    Args:
+        request_slots: Returns the number of files the request processes at
+            once, read from the current request.
+    """
+    def decorator(route):
+        @functools.wraps(route)
+        def wrapper(*args, **kwargs):
+            try:
+                ticket = admission.acquire(
+                    request.form.get('geminiApiKey'), request_slots())
+            except admission_lib.AdmissionRejected as e:
+                return too_many_requests(e)
+            try:
+                response = app.make_response(route(*args, **kwargs))
+            except Exception:
+                ticket.release()
+                raise
+            if response.is_streamed:
+                response.call_on_close(ticket.release)
+            else:
+                ticket.release()
+            return response
+        return wrapper
+    return decorator
+
+
+def too_many_requests(rejection):
+    """ Builds the 429 response for a request that was not admitted. """
+    data, headers = rejection_response(rejection, request.path)
+    return jsonify(data), 429, headers
+
+
+def directory_request_slots():
+    """ The slots of a directory request: the files it processes at once. """
+    return parse_max_workers(request.form.get('maxWorkers'))
+
+
+def batch_request_slots():
+    """ The slots of a batch request: the files it processes at once. """
+    return batch_slots(request.files, request.form)
+
+
+def request_response_options():
+    """
+    Reads the response options (see response_lib) of the current request from
+    its query string, form fields or JSON body.
+    """
+    json_body = request.get_json(silent=True) if request.is_json else None
+    return response_lib.parse_response_options(
+        request.args, request.form,
+        json_body if isinstance(json_body, dict) else None)
+
+
+def json_response(data, options=None):
+    """
+    Like jsonify(data), with the request's response options applied: the
+    debug log and intermediary JSON can be omitted, and the pipeline JSON
+    minified.
+
+    Args:
+        data (dict): The response data.
+        options (ResponseOptions, optional): Defaults to the options of the
+            current request.
+    """
+    if options is None:
+        options = request_response_options()
+    return jsonify(response_lib.shape_response(data, options))
+
+
+@app.after_request
+def compress_response(response):
+    """
+    Compresses complete JSON and text responses for clients that accept
+    brotli or gzip. Streamed and file responses are sent as they are.
+    """
+    if (response.is_streamed or response.direct_passthrough or
+            not response_lib.should_compress(response)):
+        return response
+    response_lib.compress_body(
+        response, response.get_data(), request.accept_encodings)
+    return response
+
+
+def _iter_in_context(context, iterable):
+    """ Yields the items of `iterable`, running each step inside `context`. """
+    iterator = iter(iterable)
+    while True:
+        try:
+            yield context.run(next, iterator)
+        except StopIteration:
+            return
+
+
+def wants_ndjson():
+    """ See asks_for_ndjson. """
+    return asks_for_ndjson(request.values, request.accept_mimetypes)
+
+
+def ndjson_response(lines):
+    """ Streams NDJSON lines in the current request's context. """
+    return Response(stream_with_context(lines),
+                    mimetype='application/x-ndjson',
+                    headers={'X-Accel-Buffering': 'no'})
+
+
+# --- Request handling shared with async_app ---
+# The routes of both apps read their request (the async app with await),
+# then hand it to these helpers, so that the two apps answer alike.
+
+# Names the job of a request in its response, see runs_in_request_scope.
+JOB_ID_HEADER = 'X-Job-Id'
+# The response to a request for the events of a job that does not exist.
+UNKNOWN_JOB = {"error": "Unknown job id."}
+
+# The settings a conversion request sends as form fields.
+RequestSettings = collections.namedtuple('RequestSettings', [
+    'model_name', 'gemini_api_key', 'max_workers', 'use_cache', 'resume'])
+
+
+def request_settings(form):
+    """
+    Reads the settings of a conversion request from its form fields.
+
+    Args:
+        form: The request's form fields.
+
+    Returns:
+        RequestSettings: Send useCache=false to convert PDFs again even if
+            they were converted before, and resume=false to start a
+            directory run over.
+    """
+    settings = RequestSettings(
+        model_name=form.get('modelName', DEFAULT_MODEL_NAME),
+        gemini_api_key=form.get('geminiApiKey'),
+        max_workers=parse_max_workers(form.get('maxWorkers')),
+        use_cache=form.get('useCache', 'true').lower() != 'false',
+        resume=form.get('resume', 'true').lower() != 'false')
+    log_level = log_lib.current_capture().level
+    logging.info(f"Log level set to: {logging.getLevelName(log_level)}")
+    logging.info(f"Using model for request: {settings.model_name}")
+    return settings
+
+
+def gemini_client(api_key):
+    """
+    Initializes the Gemini client of a request.
+
+    Returns:
+        tuple: (client, None), or (None, error_data) where error_data is
+               the body of the 500 response to send instead.
+    """
+    client = llm.initialize_gemini_client(api_key=api_key)
+    if client is not None:
+        return client, None
+    error_message = "Failed to initialize Gemini client. Check API key configuration and logs."
+    logging.error(error_message)
+    return None, {"error": error_message, "debug_log": log_lib.captured_log()}
+
+
+def unexpected_error(error_message):
+    """
+    Logs an unexpected error of a request, with its traceback, and finishes
+    the request's job.
+
+    Returns:
+        dict: The body of the 500 response.
+    """
+    details = traceback.format_exc()
+    logging.error(error_message)
+    logging.error(details)
+    job_lib.finish_current_job("error", error=error_message)
+    return {"error": error_message, "details": details,
+            "debug_log": log_lib.captured_log()}
+
+
+def rejection_response(rejection, path):
+    """
+    Logs a request that was not admitted and finishes its job.
+
+    Args:
+        rejection (AdmissionRejected): Why the request was not admitted.
+        path (str): The request's path.
+
+    Returns:
+        tuple: (data, headers) of the 429 response.
+    """
+    logging.warning(f"Request to {path} rejected: {rejection.reason}")
+    job_lib.finish_current_job("rejected", error=rejection.reason)
+    return ({"error": f"{rejection.reason} Retry in {rejection.retry_after} seconds.",
+             "retry_after": rejection.retry_after},
+            {"Retry-After": str(rejection.retry_after)})
+
+
+def batch_slots(files, form):
+    """ The slots of a batch request: the files it processes at once. """
+    return min(max(1, len(files.getlist('files'))),
+               parse_max_workers(form.get('maxWorkers')))
+
+
+def asks_for_ndjson(values, accept_mimetypes):
+    """
+    Whether the client asked for results streamed as newline-delimited JSON,
+    either with a 'stream=true' form field or query parameter, or an Accept
+    header.
+
+    Args:
+        values: The request's query parameters and form fields.
+        accept_mimetypes: The request's parsed Accept header.
+    """
+    return (values.get('stream', '').lower() == 'true' or
+            accept_mimetypes.best_match(
+                ['application/json', 'application/x-ndjson']) ==
+            'application/x-ndjson')
+
+
+def metrics_data():
+    """ The body of the /metrics response, see metrics(). """
+    return {"admission": admission.metrics(),
+            "max_concurrent_llm_calls": llm.MAX_CONCURRENT_LLM_CALLS,
+            "storage": storage.metrics(),
+            "artifacts": llm.artifacts.metrics()}
+
+
+def last_event_id(headers):
+    """ The Last-Event-ID a reconnecting event stream resumes after, or 0. """
+    try:
+        return int(headers.get('Last-Event-ID', 0))
+    except ValueError:
+        return 0
+
+
+def upload_file_error(files):
+    """
+    Returns the (data, status) of the 400 response to an upload request
+    without a file, or None if it has one.
+    """
+    if 'file' not in files:
+        return {"error": "No file part"}, 400
+    if files['file'].filename == '':
+        return {"error": "No selected file"}, 400
+    return None
+
+
+def receive_upload(file):
+    """
+    Reads an uploaded PDF once: hashes it on the way in, and keeps a copy
+    under uploads/ without waiting for it. The pipeline gets the bytes.
+
+    Args:
+        file: The werkzeug FileStorage of the upload.
+
+    Returns:
+        tuple: (filename, file_full, upload), where file_full is where the
+               copy is saved and upload is the SpooledUpload.
+    """
+    filename = secure_filename(file.filename)
+    file_full = os.path.join(default_upload_dir, filename)
+    logging.info(f"Receiving file upload: {filename}")
+    upload = upload_lib.spool_upload(file.stream)
+    logging.info(f"Received {upload.size} bytes, sha256 {upload.content_hash}")
+    upload_lib.persist_in_background(upload.data, file_full)
+    return filename, file_full, upload
+
+
+def upload_result(filename, processing_result):
+    """
+    Returns the (data, status) of the response to an upload, given the
+    result of processing it (see process_file).
+    """
+    if processing_result is None:
+        error_message = f"Failed to process file '{filename}'."
+        logging.error(error_message)
+        job_lib.finish_current_job("error", error=error_message)
+        return {"error": error_message, "debug_log": log_lib.captured_log()}, 500
+    logging.info(f"Successfully processed '{filename}' via upload.")
+    logging.info(f"Length of intermediary json: {len(processing_result.get('intermediary_json', ''))}")
+    logging.info(f"Length of civiform_json: {len(processing_result.get('civiform_json', ''))}")
+    return {
+        "intermediary_json": processing_result.get("intermediary_json"),
+        "civiform_json": processing_result.get("civiform_json"),
+    }, 200
+
+
+def convert_to_temporary_file(request_data):
+    """
+    Converts a /convert_to_civiform request body, writing the CiviForm JSON
+    to a temporary file as it is generated (see civiform_download).
+
+    Returns:
+        tuple: (output, response_data, status). output is the temporary
+               file, at its start, or None if the conversion failed, in
+               which case response_data and status are the error response.
+    """
+    output = tempfile.TemporaryFile()
+    try:
+        response_data, status = convert_batch_lib.convert_request_data(
+            request_data, output)
+    except Exception:
+        output.close()
+        raise
+    if status != 200:
+        output.close()
+        return None, response_data, status
+    output.seek(0)
+    return output, response_data, status
+
+
+def conversion_items(data, mimetype):
+    """
+    Parses the body of a /convert_to_civiform_batch request.
+
+    Returns:
+        tuple: (items, None), or (None, (data, status)) of the error
+               response if the body is not a batch.
+    """
+    try:
+        return convert_batch_lib.request_items(data, mimetype), None
+    except ValueError as e:
+        logging.error(f"Invalid batch conversion request: {e}")
+        status = 400 if mimetype == "application/json" else 415
+        return None, ({"error": str(e)}, status)
+
+
+class ConversionLines:
+    """
+    The NDJSON lines of a /convert_to_civiform_batch response: one per
+    converted item, in order, then a summary line.
+
+    Lines are of the form {"index": ..., "civiform_json": ...} or
+    {"index": ..., "status": ..., "error": ...}, then {"summary": {...}}.
+    """
+
+    def __init__(self, options):
+        self.options = options
+        self.count = 0
+        self.fail_count = 0
+
+    def result_line(self, index, item, response_data, status):
+        self.count += 1
+        if status != 200:
+            self.fail_count += 1
+        return json_codec.dumps(response_lib.shape_response(
+            convert_batch_lib.result_line(index, item, response_data, status),
+            self.options)) + "\n"
+
+    def summary_line(self):
+        logging.info(f"Converted {self.count - self.fail_count} of {self.count} documents.")
+        return json_codec.dumps({"summary": convert_batch_lib.conversion_summary(
+            self.count, self.fail_count)}) + "\n"
+
+
+def collected_conversions(lines):
+    """ The body of a /convert_to_civiform_batch response that is not
+    streamed, given its NDJSON lines. """
+    lines = [json_codec.loads(line) for line in lines]
+    return {"results": lines[:-1], **lines[-1]}
+
+
+def file_result_of(filename, processing_output=None, error=None):
+    """
+    Builds and publishes the result of one PDF of a multi-file run (see
+    process_file_result).
+
+    Args:
+        filename (str): The PDF's filename.
+        processing_output (dict): What process_file returned, if it did.
+        error (Exception): What it raised, if it did.
+
+    Returns:
+        dict: {"success": bool, "error_message": str}.
+    """
+    file_result = {"success": False, "error_message": ""}
+    if error is not None:
+        file_result["error_message"] = f"Error processing {filename}: {error}"
+        logging.error(f"Error processing {filename}: {error}\n{traceback.format_exc()}")
+    elif processing_output and processing_output.get("civiform_json"):
+        file_result["success"] = True
+    else:
+        file_result["error_message"] = "Failed to process file."
+    job_lib.publish("file", file=filename, **file_result)
+    return file_result
+
+
+class FileRunLines:
+    """
+    The NDJSON lines of a multi-file run (a directory or a batch): one per
+    file, as soon as it is done, then a summary (or error) line.
+
+    Lines are of the form {"file": ..., "success": ..., "error_message": ...},
+    then {"summary": {...}} (or {"error": ..., "debug_log": ...}).
+    """
+
+    # What the run is, for the log and error messages.
+    kind = "run"
+
+    def __init__(self, name):
+        self.name = name
+        self.file_results = {}
+        logging.info(f"--- Processing {self.kind}: {name} ---")
+
+    def file_line(self, filename, file_result):
+        self.file_results[filename] = file_result
+        return json_codec.dumps({"file": filename, **file_result}) + "\n"
+
+    def summary(self):
+        return summarize_file_results(self.file_results)
+
+    def finish(self, summary):
+        """ Called with the summary before the summary line is written. """
+
+    def summary_line(self):
+        summary = self.summary()
+        self.finish(summary)
+        logging.info(f"--- {self.kind.capitalize()} Processing Complete: {self.name} ---")
+        logging.info(f"Summary: Total={summary['total_files']}, Success={summary['success_count']}, Failed={summary['fail_count']}")
+        return json_codec.dumps({"summary": summary}) + "\n"
+
+    def error_line(self, error):
+        error_message = f"An error occurred during {self.kind} processing: {error}"
+        logging.error(f"{error_message}\n{traceback.format_exc()}")
+        job_lib.finish_current_job("error", error=error_message)
+        return json_codec.dumps(
+            {"error": error_message, "debug_log": log_lib.captured_log()}) + "\n"
+
+
+class DirectoryRunLines(FileRunLines):
+    """ The NDJSON lines of a directory run, see FileRunLines. """
+
+    kind = "directory"
+
+    def summary(self):
+        return summarize_directory_results(self.name, self.file_results)
+
+
+class BatchRunLines(FileRunLines):
+    """
+    The NDJSON lines of a batch, see FileRunLines. The outputs of the
+    successful files are collected into the batch archive.
+
+    Use it as a context manager around the batch: its uploads and archive
+    are kept from the storage janitor until the `with` block exits, and an
+    archive left incomplete (e.g. because the client went away) is
+    discarded.
+    """
+
+    kind = "batch"
+
+    def __init__(self, batch_id, batch_upload_dir, file_count):
+        super().__init__(batch_id)
+        logging.info(f"Batch {batch_id}: {file_count} files")
+        self.archive = batch_lib.BatchArchive(
+            batch_lib.archive_path(batches_dir, batch_id))
+        self._in_use = storage.in_use(
+            os.path.join(batch_upload_dir, ""), self.archive.path)
+        self._completed = False
+
+    def __enter__(self):
+        self._in_use.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            if not self._completed:
+                self.archive.discard()
+        finally:
+            self._in_use.__exit__(*exc_info)
+
+    def file_line(self, filename, file_result, processing_output=None):
+        if processing_output is not None:
+            self.archive.add(filename, processing_output)
+        return super().file_line(filename, file_result)
+
+    def summary(self):
+        return batch_summary(self.name, self.file_results)
+
+    def finish(self, summary):
+        self.archive.close(summary)
+        self._completed = True
+
+
+def final_result(last_line):
+    """
+    Returns the (data, status) of a multi-file run's response that is not
+    streamed: its last NDJSON line, the summary or an error.
+    """
+    response_data = json_codec.loads(last_line)
+    return response_data, 500 if "error" in response_data else 200
+
+
+def batch_archive_file(batch_id):
+    """
+    Returns (path, None) of a finished batch's archive, or (None, (data,
+    status)) of the error response if there is none.
+    """
+    if not batch_lib.is_valid_batch_id(batch_id):
+        return None, ({"error": "Invalid batch id."}, 400)
+    path = batch_lib.archive_path(batches_dir, batch_id)
+    if not os.path.isfile(path):
+        return None, ({"error": "Batch archive not found. The batch may still be running."}, 404)
+    return path, None
 
 
 @app.route('/')
 def index():
-    log_stream.seek(0)
-    log_stream.truncate(0)
     return render_template('index.html', debug_log="")
 
 
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """
+    Creates a job, for the client to subscribe to its events before it
+    sends the request that runs it (as the 'jobId' form field).
+    """
+    return jsonify({"job_id": job_lib.create_job().job_id}), 201
+
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """
+    Streams the progress events of a job as server-sent events.
+
+    The client may subscribe before it sends the request that runs the job;
+    the stream ends after the job's "done" event.
+    """
+    job = job_lib.get_job(job_id)
+    if job is None:
+        return jsonify(UNKNOWN_JOB), 404
+
+    return Response(
+        job_lib.stream_events(job, last_event_id(request.headers)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.before_request
+def start_storage_janitor():
+    """ Starts the storage janitor with the first request it serves. """
+    storage.start()
+
+
+@app.route('/metrics')
+def metrics():
+    """
+    Admission queue depth, running conversions and rejection counts, the
+    storage janitor's reclaimed space, and the output files written or failed
+    in the background.
+    """
+    return jsonify(metrics_data())
+
+
 @app.route('/upload', methods=['POST'])
+@runs_in_request_scope
+@requires_admission()
 def upload_file():
-    log_stream.seek(0)
-    log_stream.truncate(0)
     try:
-        if 'file' not in request.files:
-            return jsonify({"error": "No file part"}), 400
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({"error": "No selected file"}), 400
-
-        filename = secure_filename(file.filename)
-        file_full = os.path.join(default_upload_dir, filename)
-        logging.info(f"Receiving file upload: {filename}")
-        file.save(file_full)
-        logging.info(f"File saved to: {file_full}")
-
-        # Get LLM model name, API key, and log level from the request
-        model_name = request.form.get('modelName', DEFAULT_MODEL_NAME) # Use default if not provided
-        gemini_api_key = request.form.get('geminiApiKey')
-        log_level_str = request.form.get('logLevel', 'INFO').upper()
-        log_level = getattr(logging, log_level_str, logging.INFO)
-        logging.getLogger().setLevel(log_level)
-        logging.info(f"Log level set to: {logging.getLevelName(log_level)}")
-        logging.info(f"Using model for request: {model_name}")
-
-        client = llm.initialize_gemini_client(api_key=gemini_api_key)
+        error = upload_file_error(request.files)
+        if error is not None:
+            data, status = error
+            return json_response(data), status
+        filename, file_full, upload = receive_upload(request.files['file'])
+        settings = request_settings(request.form)
+
+        client, error_data = gemini_client(settings.gemini_api_key)
         if client is None:
-            error_message = "Failed to initialize Gemini client. Check API key configuration and logs."
-            logging.error(error_message)
-            debug_log = log_stream.getvalue()
-            return jsonify({"error": error_message, "debug_log": debug_log}), 500
+            return json_response(error_data), 500
 
-        # Process the file
-        processing_result = process_file(file_full, model_name, client)
-
-        # Get logs generated during processing
-        debug_log = log_stream.getvalue()
-
-        if processing_result is None:
-             error_message = f"Failed to process file '{filename}'."
-             logging.error(error_message)
-             return jsonify({"error": error_message, "debug_log": debug_log}), 500
-        else:
-            logging.info(f"Successfully processed '{filename}' via upload.")
-            logging.info(f"Length of intermediary json: {len(processing_result.get('intermediary_json', ''))}")
-            logging.info(f"Length of civiform_json: {len(processing_result.get('civiform_json', ''))}")
-            # Return the dictionary containing both JSON strings
-            response_data = {
-                "intermediary_json": processing_result.get("intermediary_json"),
-                "civiform_json": processing_result.get("civiform_json"),
-            }
-            return jsonify(response_data)
+        processing_result = process_upload(
+            file_full, settings.model_name, client, upload.data,
+            upload.content_hash, settings.use_cache)
+        data, status = upload_result(filename, processing_result)
+        return json_response(data), status
 
     except Exception as e:
-        error_message = f"An unexpected error occurred during file upload/processing: {e}"
-        logging.error(error_message)
-        logging.error(traceback.format_exc()) # Log full traceback
-        debug_log = log_stream.getvalue()
-        return jsonify({"error": error_message, "details": traceback.format_exc(), "debug_log": debug_log}), 500
+        return json_response(unexpected_error(
+            f"An unexpected error occurred during file upload/processing: {e}")), 500
 
 @app.route('/convert_to_civiform', methods=['POST'])
+@runs_in_request_scope
 def handle_convert_to_civiform():
     """
     Endpoint to convert intermediary JSON (provided in request body)
     to CiviForm JSON.
     """
-    log_stream.seek(0)
-    log_stream.truncate(0)
     logging.info("Received request to convert intermediary JSON to CiviForm JSON.")
 
     if not request.is_json:
         logging.error("Request content type is not application/json")
-        return jsonify({"error": "Request must be JSON"}), 415
+        return json_response({"error": "Request must be JSON"}), 415
 
     try:
-        request_data = request.get_json()
-        intermediary_json_str = request_data.get('intermediary_json')
+        if request.args.get('download', '').lower() == 'true':
+            return civiform_download(request.get_json())
+        response_data, status = convert_batch_lib.convert_request_data(
+            request.get_json())
+        return json_response(response_data), status
 
-        if not intermediary_json_str:
-            logging.error("No 'intermediary_json' field found in request.")
-            return jsonify({"error": "Missing 'intermediary_json' in request body"}), 400
+    except Exception as e:
+        return json_response(unexpected_error(
+            f"An error occurred during CiviForm JSON conversion: {e}")), 500
 
-        # Parse the intermediary JSON string provided by the client
-        try:
-            intermediary_data = json.loads(intermediary_json_str)
-            logging.info("Successfully parsed intermediary JSON from request.")
-        except json.JSONDecodeError as e:
-            logging.error(f"Invalid JSON received in 'intermediary_json': {e}")
-            return jsonify({"error": "Invalid JSON format provided in 'intermediary_json'", "details": str(e)}), 400
-
-        # Check if the parsed data is a list and extract the first element if needed
-        data_to_convert = None
-        if isinstance(intermediary_data, list):
-            if not intermediary_data:
-                logging.error("Intermediary data list is empty.")
-                return jsonify({"error": "Intermediary JSON data is an empty list"}), 400
-            # Assume the relevant data is the first element of the list
-            data_to_convert = intermediary_data[0]
-        elif isinstance(intermediary_data, dict):
-             data_to_convert = intermediary_data
-             logging.info("Intermediary data is a dictionary, using it directly for conversion.")
-        else:
-             logging.error(f"Intermediary data is not a list or dict, type is {type(intermediary_data)}")
-             return jsonify({"error": "Unexpected format for intermediary JSON data"}), 400
 
-        if not isinstance(data_to_convert, dict):
-             logging.error(f"Data selected for conversion is not a dictionary (type: {type(data_to_convert)}). Cannot proceed.")
-             return jsonify({"error": "Selected data for conversion is not in the expected dictionary format."}), 400
+def civiform_download(request_data):
+    """
+    Converts a /convert_to_civiform request body and returns the CiviForm
+    JSON itself, as a file to download.
+
+    The JSON is written to a temporary file as it is generated, then
+    streamed from it: neither the program nor its JSON is held in memory,
+    and a form that cannot be converted still gets an error response.
+    """
+    output, response_data, status = convert_to_temporary_file(request_data)
+    if output is None:
+        return json_response(response_data), status
+    return send_file(output, mimetype='application/json', as_attachment=True,
+                     download_name='civiform.json')
+
+
+@app.route('/convert_to_civiform_batch', methods=['POST'])
+@runs_in_request_scope
+def handle_convert_to_civiform_batch():
+    """
+    Endpoint to convert many intermediary JSON documents to CiviForm JSON in
+    one request (see convert_batch_lib).
+
+    The body is a JSON array or NDJSON of documents, each either a
+    /convert_to_civiform request body (optionally with an 'id' echoed in its
+    result) or an intermediary document itself. Results come back in the
+    same order, streamed as NDJSON if the request is NDJSON or the client
+    asks for it (see wants_ndjson), followed by a summary.
+    """
+    logging.info("Received batch request to convert intermediary JSON to CiviForm JSON.")
+    items, error = conversion_items(request.get_data(), request.mimetype)
+    if error is not None:
+        data, status = error
+        return json_response(data), status
+
+    results = stream_conversions(items, request_response_options())
+    if wants_ndjson() or request.mimetype == "application/x-ndjson":
+        return ndjson_response(results)
+    return jsonify(collected_conversions(results))
 
-        # Perform the conversion
-        civiform_json_result = convert_to_civiform_json(data_to_convert)
-        logging.info("Conversion to CiviForm JSON successful.")
 
-        # Return the resulting CiviForm JSON string
-        return jsonify({"civiform_json": civiform_json_result})
+def stream_conversions(items, options):
+    """
+    Converts batch items in the worker pool and yields one NDJSON line per
+    item, in order, then a summary line.
 
+    Yields:
+        str: The lines of ConversionLines.
+    """
+    lines = ConversionLines(options)
+    for (index, item, response_data, status) in convert_batch_lib.iter_converted(items):
+        yield lines.result_line(index, item, response_data, status)
+    yield lines.summary_line()
+
+
+def process_file_result(file_full, model_name, client, manifest=None,
+                        file_bytes=None, content_hash=None, use_cache=False):
+    """
+    Processes one PDF file of a multi-file run (a directory or a batch).
+
+    Arguments are as for process_file. If use_cache is True, the file is
+    an upload and goes through the result cache (see process_upload).
+
+    Returns:
+        tuple: (file_result, processing_output). file_result is
+               {"success": bool, "error_message": str}; processing_output is
+               the dict returned by process_file, or None if it failed.
+               Errors are reported here rather than raised, so one bad file
+               does not stop the run.
+    """
+    filename = os.path.basename(file_full)
+    try:
+        if use_cache:
+            processing_output = process_upload(
+                file_full, model_name, client, file_bytes, content_hash)
+        else:
+            processing_output = process_file(
+                file_full, model_name, client, manifest, file_bytes,
+                content_hash)
     except Exception as e:
-        error_message = f"An error occurred during CiviForm JSON conversion: {e}"
-        logging.error(error_message)
-        logging.error(traceback.format_exc())
-        return jsonify({"error": error_message, "details": traceback.format_exc()}), 500
+        return file_result_of(filename, error=e), None
+    return file_result_of(filename, processing_output), processing_output
+
+
+def _process_directory_file(directory, filename, model_name, client, manifest):
+    """
+    Processes one PDF file of a directory run.
+
+    Returns:
+        dict: {"success": bool, "error_message": str}.
+    """
+    file_result, _ = process_file_result(
+        os.path.join(directory, filename), model_name, client, manifest)
+    return file_result
 
 
-def process_directory(directory, model_name, client):
+def open_run_manifest(directory, model_name, resume=True):
     """
-    Processes all PDF files in a given directory and returns summary information.
-    NOTE: This function currently does *not* return the individual JSON outputs,
-          only success/failure status per file. Modifying it to return all JSONs
-          could lead to very large responses.
+    Opens the checkpoint manifest of a directory run. Runs over the same
+    directory with the same model share a manifest, so restarting one
+    skips the files (and stages) that already completed.
 
     Args:
-        directory (str): The path to the directory containing PDF files.
-        model_name (str): The name of the LLM model to use.
-        client: The initialized Gemini client.
+        directory (str): The absolute path of the processed directory.
+        model_name (str): The name of the LLM model used.
+        resume (bool): If False, previous checkpoints are discarded.
 
     Returns:
-        dict: Dictionary containing summary details (total, success, fail, file_results).
+        RunManifest: The manifest of the run.
     """
-    success_count = 0
-    fail_count = 0
-    total_files = 0
+    run_id = run_manifest.run_id_for(directory, model_name)
+    return run_manifest.RunManifest.load(
+        os.path.join(runs_dir, f"{run_id}.json"),
+        run_info={"directory": directory, "model_name": model_name},
+        resume=resume)
 
-    abs_directory = os.path.abspath(os.path.expanduser(directory))
-    if not abs_directory.startswith(os.path.abspath(work_dir)):
-        logging.error(
-            f"Attempted access outside working directory: {directory}")
-        return {
-            "total_files": 0, "success_count": 0, "fail_count": 0, "file_results": {}
-        }
 
-    file_results = {}
-    logging.info(f"--- Processing Directory: {abs_directory} ---")
+def iter_process_directory(directory, model_name, client, max_workers=1,
+                           manifest=None):
+    """
+    Processes the PDF files in a directory, up to max_workers files at a time,
+    and yields each file's result as soon as that file is done.
 
-    if not os.path.isdir(abs_directory):
-         logging.error(f"Directory not found: {abs_directory}")
-         return {"total_files": 0, "success_count": 0, "fail_count": 0, "file_results": {}}
+    LLM calls from all workers share the process-wide limit in llm_lib
+    (MAX_CONCURRENT_LLM_CALLS).
 
+    Args:
+        directory (str): The absolute path of the directory containing PDF files.
+        model_name (str): The name of the LLM model to use.
+        client: The initialized Gemini client.
+        max_workers (int): Maximum number of files processed at once.
+        manifest (RunManifest, optional): Checkpoints to resume from and
+            record to.
 
-    for filename in os.listdir(abs_directory):
-        if filename.lower().endswith(".pdf"):
-            total_files += 1
-            file_full = os.path.join(abs_directory, filename)
-            file_results[filename] = {"success": False, "error_message": ""}
-            try:
-                processing_output = process_file(file_full, model_name, client)
-                if processing_output and processing_output.get("civiform_json"):
-                    success_count += 1
-                    file_results[filename]["success"] = True
-                else:
-                    fail_count += 1
-                    file_results[filename]["error_message"] = "Failed to process file."
-            except Exception as e:
-                fail_count += 1
-                error_message = f"Error processing {filename}: {e}"
-                file_results[filename]["error_message"] = error_message
-                logging.error(f"Error during directory processing for {filename}: {e}\n{traceback.format_exc()}")
-
-    logging.info(f"--- Directory Processing Complete: {abs_directory} ---")
-    logging.info(f"Summary: Total={total_files}, Success={success_count}, Failed={fail_count}")
-
-    current_debug_log = log_stream.getvalue()
-    log_stream.seek(0)
-    log_stream.truncate(0) # Clear stream after reading
+    Yields:
+        tuple: (filename, file_result), in completion order. file_result is a
+               dict with 'success' and 'error_message'.
+    """
+    filenames = sorted(filename for filename in os.listdir(directory)
+                       if filename.lower().endswith(".pdf"))
+    # The PDFs waiting their turn must not be evicted either.
+    with storage.in_use(os.path.join(directory, "")):
+        yield from iter_concurrently(
+            ((filename, _process_directory_file,
+              (directory, filename, model_name, client, manifest))
+             for filename in filenames),
+            max_workers, "process_directory")
+    if manifest is not None:
+        # Stages are checkpointed once their outputs are on disk. Wait for
+        # them, so that the manifest is complete when the run is.
+        llm.artifacts.flush()
+
+
+def iter_concurrently(tasks, max_workers, thread_name_prefix):
+    """
+    Runs tasks on a thread pool, up to max_workers at a time, and yields each
+    result as soon as it is ready.
 
+    Each task runs in a copy of the caller's context, so that its log lines
+    and progress events go to the caller's request.
+
+    Args:
+        tasks: Iterable of (key, function, args) tuples.
+        max_workers (int): Maximum number of tasks running at once.
+        thread_name_prefix (str): Name prefix of the pool's threads.
+
+    Yields:
+        tuple: (key, function(*args)), in completion order.
+    """
+    executor = ThreadPoolExecutor(
+        max_workers=max(1, max_workers), thread_name_prefix=thread_name_prefix)
+    try:
+        futures = {}
+        for (key, function, args) in tasks:
+            context = contextvars.copy_context()
+            futures[executor.submit(context.run, function, *args)] = key
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        # If the caller stops early (e.g. the client disconnected), do not
+        # start the tasks that are still queued.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def summarize_file_results(file_results):
+    """
+    Builds the summary of a multi-file run from its per-file results.
+
+    Args:
+        file_results (dict): Maps filenames to their file_result dicts.
+
+    Returns:
+        dict: total_files, success_count, fail_count and file_results.
+    """
+    success_count = sum(1 for file_result in file_results.values()
+                        if file_result["success"])
     return {
-        "total_files": total_files,
+        "total_files": len(file_results),
         "success_count": success_count,
-        "fail_count": fail_count,
+        "fail_count": len(file_results) - success_count,
         "file_results": file_results,
-        "debug_log": current_debug_log
     }
 
 
-@app.route('/upload_directory', methods=['POST'])
-def upload_directory():
+def summarize_directory_results(directory, file_results):
     """
-    Endpoint to process a directory of files and return a summary.
+    Builds the summary of a directory run from its per-file results.
+
+    Returns:
+        dict: processed_directory, then the summarize_file_results fields.
     """
+    return {"processed_directory": directory,
+            **summarize_file_results(file_results)}
 
-    log_stream.seek(0)
-    log_stream.truncate(0)
-    logging.info("Received request to process directory.")
 
-    # Get LLM model name, API key, and log level from the request
-    model_name = request.form.get('modelName', DEFAULT_MODEL_NAME)
-    gemini_api_key = request.form.get('geminiApiKey')
-    log_level_str = request.form.get('logLevel', 'INFO').upper()
-    log_level = getattr(logging, log_level_str, logging.INFO)
-    logging.getLogger().setLevel(log_level)
-    logging.info(f"Log level set to: {logging.getLevelName(log_level)}")
-    logging.info(f"Using model for request: {model_name}")
+def stream_directory_results(directory, model_name, client, max_workers,
+                             resume=True):
+    """
+    Processes the PDF files in a directory, up to max_workers at a time, and
+    yields one NDJSON line per file as soon as it is done, followed by a
+    final summary line.
+
+    Args:
+        directory (str): The absolute path of the directory.
+        model_name (str): The name of the LLM model to use.
+        client: The initialized Gemini client.
+        max_workers (int): Maximum number of files processed at once.
+        resume (bool): Skip the files and stages completed by a previous run
+            over the same directory with the same model.
+
+    Yields:
+        str: The lines of DirectoryRunLines.
+    """
+    lines = DirectoryRunLines(directory)
+    try:
+        manifest = open_run_manifest(directory, model_name, resume)
+        for (filename, file_result) in iter_process_directory(
+                directory, model_name, client, max_workers, manifest):
+            yield lines.file_line(filename, file_result)
+        yield lines.summary_line()
+    except Exception as e:
+        yield lines.error_line(e)
+
 
+def parse_max_workers(value):
+    """
+    Parses the 'maxWorkers' form field of a directory request, clamped to
+    [1, MAX_DIRECTORY_WORKERS]. Defaults to DEFAULT_DIRECTORY_WORKERS.
+    """
+    try:
+        max_workers = int(value if value is not None else DEFAULT_DIRECTORY_WORKERS)
+    except ValueError:
+        max_workers = DEFAULT_DIRECTORY_WORKERS
+    return min(max(1, max_workers), MAX_DIRECTORY_WORKERS)
 
-    directory_path_input = request.form.get('directoryPath', default_upload_dir) # Use default if not provided
+
+def requested_directory(directory_path_input):
+    """
+    Resolves the directory of a directory request.
+
+    Returns:
+        str: The absolute directory path, or None if it is outside the work
+             directory or is not a directory.
+    """
     directory_path = os.path.abspath(os.path.expanduser(directory_path_input))
 
     # Basic check to prevent accessing outside of the work dir
     if not directory_path.startswith(work_dir):
         logging.error(f"Requested directory outside work directory: {directory_path}")
-        debug_log = log_stream.getvalue() # Capture log before returning error
-        return jsonify({"error": "Invalid directory path.", "debug_log": debug_log}), 400
+        return None
 
     if not os.path.isdir(directory_path):
         logging.error(f"Invalid directory path: {directory_path}")
-        debug_log = log_stream.getvalue()
-        return jsonify({"error": "Invalid directory path.", "debug_log": debug_log}), 400
+        return None
+    return directory_path
 
 
-    client = llm.initialize_gemini_client(api_key=gemini_api_key)
+@app.route('/upload_directory', methods=['POST'])
+@runs_in_request_scope
+@requires_admission(directory_request_slots)
+def upload_directory():
+    """
+    Endpoint to process a directory of files and return a summary.
+
+    Up to 'maxWorkers' files are processed at once. If the client asks for
+    NDJSON (see wants_ndjson), each file's result is streamed as soon as it
+    is done, followed by the summary. Unless 'resume' is 'false', files and
+    stages completed by an earlier run over the same directory are skipped.
+    """
+
+    logging.info("Received request to process directory.")
+    settings = request_settings(request.form)
+    logging.info(f"Processing up to {settings.max_workers} files at once.")
+
+    directory_path = requested_directory(
+        request.form.get('directoryPath', default_upload_dir)) # Use default if not provided
+    if directory_path is None:
+        debug_log = log_lib.captured_log() # Capture log before returning error
+        return json_response({"error": "Invalid directory path.", "debug_log": debug_log}), 400
+
+    client, error_data = gemini_client(settings.gemini_api_key)
     if client is None:
-        error_message = "Failed to initialize Gemini client. Check API key or file."
-        logging.error(error_message)
-        debug_log = log_stream.getvalue()
-        return jsonify({"error": error_message, "debug_log": debug_log}), 500
+        return json_response(error_data), 500
 
-    try:
-        directory_result = process_directory(directory_path, model_name, client)
-        debug_log = directory_result.get("debug_log", "No debug log captured.")
-
-        response_data = {
-            "summary": {
-                "processed_directory": directory_path,
-                "total_files": directory_result["total_files"],
-                "success_count": directory_result["success_count"],
-                "fail_count": directory_result["fail_count"],
-                "file_results": directory_result["file_results"]
-            },
-        }
-        logging.info(f"Directory processing finished for: {directory_path}")
-        return jsonify(response_data)
-    except Exception as e:
-        error_message = f"An error occurred during directory processing: {e}"
-        logging.error(f"{error_message}\n{traceback.format_exc()}")
-        debug_log = log_stream.getvalue()
-        return jsonify({"error": error_message, "details": traceback.format_exc(), "debug_log": debug_log}), 500
+    results = stream_directory_results(
+        directory_path, settings.model_name, client, settings.max_workers,
+        settings.resume)
+    if wants_ndjson():
+        return ndjson_response(results)
+
+    # Without streaming, return the final line (the summary or the error).
+    for line in results:
+        pass
+    data, status = final_result(line)
+    logging.info(f"Directory processing finished for: {directory_path}")
+    return json_response(data), status
+
+
+def spool_batch_uploads(files, batch_upload_dir):
+    """
+    Reads the PDFs of a batch request and saves copies to batch_upload_dir
+    in the background (see upload_lib).
+
+    Args:
+        files (list): The werkzeug FileStorage objects of the request.
+        batch_upload_dir (str): Where to keep copies of the uploads.
+
+    Returns:
+        dict: Maps the batch's unique filenames to their SpooledUploads, in
+              upload order.
+    """
+    os.makedirs(batch_upload_dir, exist_ok=True)
+    uploads = {}
+    for (filename, file) in zip(
+            batch_lib.unique_filenames([file.filename for file in files]), files):
+        upload = upload_lib.spool_upload(file.stream)
+        logging.info(f"Received {filename}: {upload.size} bytes, sha256 {upload.content_hash}")
+        upload_lib.persist_in_background(
+            upload.data, os.path.join(batch_upload_dir, filename))
+        uploads[filename] = upload
+    return uploads
+
+
+def batch_summary(batch_id, file_results):
+    """ Builds the summary of a batch, with the URL of its output archive. """
+    return {"batch_id": batch_id,
+            "archive_url": f"/batches/{batch_id}/archive",
+            **summarize_file_results(file_results)}
+
+
+def stream_batch_results(batch_id, uploads, batch_upload_dir, model_name,
+                         client, max_workers, use_cache=True):
+    """
+    Processes the PDFs of a batch, up to max_workers at a time, and yields one
+    NDJSON line per file as soon as it is done, then a summary line. The
+    outputs of the successful files are collected into the batch archive.
+
+    Yields:
+        str: The lines of BatchRunLines.
+    """
+    with BatchRunLines(batch_id, batch_upload_dir, len(uploads)) as lines:
+        try:
+            for (filename, (file_result, processing_output)) in iter_concurrently(
+                    ((filename, process_file_result,
+                      (os.path.join(batch_upload_dir, filename), model_name, client,
+                       None, upload.data, upload.content_hash, use_cache))
+                     for (filename, upload) in uploads.items()),
+                    max_workers, "process_batch"):
+                yield lines.file_line(filename, file_result, processing_output)
+            yield lines.summary_line()
+        except Exception as e:
+            yield lines.error_line(e)
+
+
+@app.route('/upload_batch', methods=['POST'])
+@runs_in_request_scope
+@requires_admission(batch_request_slots)
+def upload_batch():
+    """
+    Endpoint to process many PDFs sent in one multipart request (as repeated
+    'files' fields).
+
+    Up to 'maxWorkers' files are processed at once. If the client asks for
+    NDJSON (see wants_ndjson), each file's result is streamed as soon as it
+    is done, followed by the summary; otherwise the summary is returned once
+    all files are done. The summary's 'archive_url' downloads a zip of all
+    the outputs.
+    """
+    logging.info("Received batch upload.")
+    files = [file for file in request.files.getlist('files') if file.filename]
+    if not files:
+        return json_response({"error": "No files selected"}), 400
+    settings = request_settings(request.form)
+    logging.info(f"Processing up to {settings.max_workers} files at once.")
+
+    client, error_data = gemini_client(settings.gemini_api_key)
+    if client is None:
+        return json_response(error_data), 500
+
+    batch_id = batch_lib.new_batch_id()
+    batch_upload_dir = os.path.join(default_upload_dir, f"batch-{batch_id}")
+    # Read every upload before responding: the request body cannot be read
+    # once the response has started streaming.
+    uploads = spool_batch_uploads(files, batch_upload_dir)
+    results = stream_batch_results(
+        batch_id, uploads, batch_upload_dir, settings.model_name, client,
+        settings.max_workers, settings.use_cache)
+
+    if wants_ndjson():
+        return ndjson_response(results)
+
+    # Without streaming, return the final line (the summary or the error).
+    for line in results:
+        pass
+    data, status = final_result(line)
+    return json_response(data), status
+
+
+@app.route('/batches/<batch_id>/archive')
+def batch_archive(batch_id):
+    """ Downloads the zip archive of a finished batch's outputs. """
+    path, error = batch_archive_file(batch_id)
+    if error is not None:
+        data, status = error
+        return jsonify(data), status
+    return send_file(path, mimetype='application/zip', as_attachment=True,
+                     download_name=f"civiform-batch-{batch_id}.zip")
 
 
 # --- Main Execution Block ---
@@ -449,7 +1575,7 @@ def upload_directory():
 if __name__ == '__main__':
     # --- Argument Parser Setup ---
     parser = argparse.ArgumentParser(
-        description="Process a PDF form file to CiviForm JSON using Gemini LLM. Runs as a web server if --input-file is not provided.",
+        description="Process a PDF form file to CiviForm JSON using Gemini LLM. Runs as a web server if neither --input-file nor --input-directory is provided.",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter
         )
 
@@ -459,6 +1585,24 @@ if __name__ == '__main__':
         default=None, # Default is None, indicating web server mode
         help='Path to a single PDF file to process (activates command-line mode).'
         )
+    parser.add_argument(
+        '--input-directory',
+        type=str,
+        default=None,
+        help='Path to a directory of PDF files to process (activates command-line batch mode). '
+             'Restarting the same batch resumes where it stopped.'
+        )
+    parser.add_argument(
+        '--max-workers',
+        type=int,
+        default=DEFAULT_DIRECTORY_WORKERS,
+        help='Number of PDF files processed at once in batch mode.'
+        )
+    parser.add_argument(
+        '--no-resume',
+        action='store_true',
+        help='In batch mode, reprocess every file instead of resuming a previous run.'
+        )
     parser.add_argument(
         '--model-name',
         type=str,
@@ -486,11 +1630,7 @@ if __name__ == '__main__':
         logging.info("--- Running in Command Line Mode ---")
 
         # Set log level based on command line arg for console output
-        log_level_cli = getattr(logging, args.log_level.upper(), logging.INFO)
-        logging.getLogger().setLevel(log_level_cli) # Set root logger level
-        for handler in logging.getLogger().handlers:
-             if isinstance(handler, logging.StreamHandler) and handler.stream == sys.stderr or handler.stream == sys.stdout:
-                   handler.setLevel(log_level_cli)
+        log_lib.set_base_level(log_lib.parse_level(args.log_level))
         logging.info(f"Console log level set to: {args.log_level}")
 
         # Validate input file path
@@ -509,29 +1649,57 @@ if __name__ == '__main__':
 
         # Process the single file
         try:
-            result_dict = process_file(
+            result = run_pipeline(
                 file_full=input_path,
                 model_name=args.model_name, # Pass model name
                 client=client               # Pass initialized client
             )
-            if result_dict and result_dict.get("civiform_json"):
-                logging.info(f"Successfully processed '{args.input_file}'.")
-                logging.info(f"Final CiviForm JSON saved in '{output_json_dir}'.")
-                sys.exit(0)
-            else:
-                 logging.error(f"Command-line processing completed for '{args.input_file}' but failed to generate required JSON output.")
-                 sys.exit(1)
-
+            logging.info(f"Successfully processed '{args.input_file}'.")
+            logging.info(f"Final CiviForm JSON saved in '{result.output_paths['civiform']}'.")
+            sys.exit(0)
 
         except Exception as e:
             logging.error(f"Command-line processing failed for '{args.input_file}'. See logs above for details.")
             logging.error(traceback.format_exc())
             sys.exit(1) # Exit with error code
 
+    elif args.input_directory:
+        # --- Command Line Batch Mode ---
+        logging.info("--- Running in Command Line Batch Mode ---")
+        log_lib.set_base_level(log_lib.parse_level(args.log_level))
+
+        input_directory = os.path.abspath(os.path.expanduser(args.input_directory))
+        if not os.path.isdir(input_directory):
+            logging.error(f"Input directory not found or is not a directory: {input_directory}")
+            sys.exit(1)
+
+        client = llm.initialize_gemini_client()
+        if client is None:
+            logging.error("Failed to initialize Gemini client. Check API key file/access. Exiting.")
+            sys.exit(1)
+
+        manifest = open_run_manifest(
+            input_directory, args.model_name, resume=not args.no_resume)
+        file_results = {}
+        for (filename, file_result) in iter_process_directory(
+                input_directory, args.model_name, client,
+                max(1, args.max_workers), manifest):
+            file_results[filename] = file_result
+            logging.info(f"{filename}: {'Success' if file_result['success'] else 'Fail'} {file_result['error_message']}")
+
+        summary = summarize_directory_results(input_directory, file_results)
+        logging.info(f"Summary: Total={summary['total_files']}, Success={summary['success_count']}, Failed={summary['fail_count']}")
+        logging.info(f"Run manifest: {manifest.path}")
+        sys.exit(0 if summary["fail_count"] == 0 else 1)
+
     else:
         # --- Web Server Mode ---
-        # No --input-file provided, run the Flask app
+        # No --input-file or --input-directory provided, run the Flask app
         logging.info("--- Running in Web Server Mode ---")
         logging.info(f"Starting Flask server...")
+        # The reloader (debug=True) serves from a child process: start the
+        # conversion workers there, before it serves requests.
+        if is_running_from_reloader():
+            convert_batch_lib.start()
         app.run(debug=True, host="0.0.0.0",
                 port=int(os.environ.get("PORT", args.port)))
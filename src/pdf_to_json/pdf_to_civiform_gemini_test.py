@@ -0,0 +1,121 @@
+import json
+import os
+import pymupdf
+import run_manifest
+import tempfile
+import threading
+import types
+import unittest
+from unittest import mock
+
+# The app creates its directories under ~ when imported.
+with mock.patch.dict(os.environ, {"HOME": tempfile.mkdtemp()}):
+    import pdf_to_civiform_gemini as app_module
+
+FORM = {"title": "Test Form", "help_text": "help", "sections": [
+    {"title": "Applicant", "help_text": "About you", "fields": [
+        {"label": "Full name", "type": "name", "id": "name"},
+        {"label": "Pick one", "type": "radio_button", "id": "pick",
+         "options": ["Yes", "No"]}]}]}
+
+
+class FakeModels:
+    """ Answers every Gemini call with a copy of FORM titled `title`, or
+    with the next of `responses`, if any are left. """
+
+    def __init__(self):
+        self.title = FORM["title"]
+        self.responses = []
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, model, contents):
+        with self._lock:
+            self.calls += 1
+            if self.responses:
+                text = self.responses.pop(0)
+            else:
+                text = json.dumps(dict(FORM, title=self.title))
+        return types.SimpleNamespace(text=f"```json\n{text}\n```",
+                                     usage_metadata=None)
+
+
+class FakeAsyncModels:
+
+    def __init__(self, models):
+        self.models = models
+
+    async def generate_content(self, model, contents):
+        return self.models.generate_content(model, contents)
+
+
+class FakeClient:
+    """ Stands in for genai.Client, sync (client.models) and async
+    (client.aio.models). """
+
+    def __init__(self):
+        self.models = FakeModels()
+        self.aio = types.SimpleNamespace(models=FakeAsyncModels(self.models))
+
+
+def make_pdf(text, pages=1):
+    """ Returns the bytes of a PDF with `text` on each page. """
+    document = pymupdf.open()
+    for page_number in range(pages):
+        document.new_page().insert_text((72, 72), f"{text} {page_number}")
+    return document.write()
+
+
+class TestOutputNames(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.client = FakeClient()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_pdf(self, filename, text):
+        path = os.path.join(self.tmp_dir.name, filename)
+        with open(path, "wb") as f:
+            f.write(make_pdf(text))
+        return path
+
+    def test_pdfs_with_the_same_name_prefix_keep_their_own_outputs(self):
+        # Both names start with "application_for".
+        first = self.write_pdf("application_form_2024.pdf", "First form")
+        second = self.write_pdf("application_form_2025.pdf", "Second form")
+        manifest = run_manifest.RunManifest.load(
+            os.path.join(self.tmp_dir.name, "run.json"))
+
+        results = {}
+        for (path, title) in ((first, "First"), (second, "Second")):
+            self.client.models.title = title
+            results[path] = app_module.run_pipeline(
+                path, "gemini-test", self.client, manifest)
+        # The first PDF keeps the plain name; the second one's name ends
+        # with its content hash.
+        with open(second, "rb") as f:
+            second_hash = run_manifest.hash_bytes(f.read())
+        self.assertEqual(
+            [os.path.basename(results[path].output_paths["civiform"])
+             for path in (first, second)],
+            ["application_for-civiform-gemini-test.json",
+             f"application_for-{second_hash[:8]}-civiform-gemini-test.json"])
+        for (path, title) in ((first, "First"), (second, "Second")):
+            with open(results[path].output_paths["civiform"]) as f:
+                self.assertIn(f'"{title}"', f.read())
+
+        # Resuming serves each PDF its own completed result.
+        calls = self.client.models.calls
+        self.client.models.title = "Not called"
+        for path in (first, second):
+            self.assertEqual(
+                app_module.process_file(path, "gemini-test", self.client,
+                                        manifest)["civiform_json"],
+                results[path].civiform_json)
+        self.assertEqual(self.client.models.calls, calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
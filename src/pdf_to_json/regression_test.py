@@ -5,14 +5,16 @@ See https://github.com/civiform/civiform/issues/9975:
 """
 
 import argparse
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed)
 import glob
 import json
 import llm_lib as llm
 import logging
+import multiprocessing
 import os
 from pathlib import Path
 import regression_test_rules as rules
-import subprocess
 import sys
 
 logging.basicConfig(level=logging.INFO)
@@ -24,6 +26,9 @@ RULE_WEIGHTS = {'rule_number_of_questions': 0.2,
                 'rule_help_text_similarity': 0.5,
                 }
 
+# Golden PDFs processed at once by parallel_regression_test.
+DEFAULT_WORKERS = 4
+
 def parse_arguments():
     """ Parse regression test arguments.
 
@@ -38,6 +43,16 @@ def parse_arguments():
                         default = 'testdata/goldens')
     parser.add_argument('-m', '--model',
                         default = 'gemini-2.0-flash-lite')
+    parser.add_argument('-w', '--workers', type = int,
+                        default = DEFAULT_WORKERS,
+                        help = 'Golden PDFs processed at once; 1 runs them '
+                        'one at a time, scoring in this process.')
+    parser.add_argument('--score-workers', type = int,
+                        help = 'Processes scoring the outputs (default: one '
+                        'per CPU).')
+    parser.add_argument('--max-llm-calls', type = int,
+                        help = 'Maximum LLM calls in flight at once (default: '
+                        'MAX_CONCURRENT_LLM_CALLS).')
 
     return(parser.parse_args())
 
@@ -69,72 +84,141 @@ def calculate_score(json_golden_str, json_eval_str):
     """
     score = 0
     normalize_weights(RULE_WEIGHTS)
+    # Parse both programs once, for all the rules.
+    pair = rules.ProgramPair.from_json(json_golden_str, json_eval_str)
     for (rule, weight) in RULE_WEIGHTS.items():
         if weight == 0.0:
             continue
         logging.info(f"\tChecking {rule} with weight {weight}")
-        eval_string = 'rules.' + rule + '(json_golden_str, json_eval_str)'
-        score += weight * eval(eval_string)
+        score += weight * rules.RULES[rule](pair)
     return score
 
 
-def regression_test(llm_client, directory, model_name):
-    """ Evaluate all of the PDF/JSON pairs in a directory.
+def golden_pairs(directory):
+    """ List the golden PDF/JSON pairs in a directory.
 
     Args:
-      llm_client: An initialized LLM object.
       directory: The name of the directory containing golden PDF/JSON pairs.
-      model_name: Name of the LLM to use (e.g., "gemini-2.0-flash")
 
     Returns:
-      A dict mapping the PDF filepaths to their regression scores.
+      The sorted paths of the golden PDFs without their extension, for which
+      there is both a .pdf and a .json file.
     """
-    pdfs = glob.glob(directory + '/*.pdf')
-    jsons = glob.glob(directory + '/*.json')
-    scores = {}
+    pdfs = sorted(glob.glob(directory + '/*.pdf'))
+    jsons = set(glob.glob(directory + '/*.json'))
+    roots = []
     for pdf in pdfs:
         (root, _) = os.path.splitext(pdf)
 
         # Ignore PDFs for which we don't have corresponding JSON.
         if root + '.json' in jsons:
-
-            logging.info(f"Evaluating {root}")
-
-            json_filepath = Path(root + '.json')
-            with open(json_filepath, 'r', encoding = 'utf-8-sig') as f:
-                json_golden_str = f.read()
-
-            # Run the pipeline.
-            subprocess.run(['python3', './pdf_to_civiform_gemini.py',
-                            '--input-file', pdf,
-                            '--model-name', model_name,
-                            ])
-
-            # TODO(orwant): Fix pdf_to_civiform_gemini to take
-            # work directories & filenames as arguments. Otherwise,
-            # we have to do this:
-            work_dir = os.path.expanduser("~/pdf_to_civiform")
-            default_upload_dir = os.path.join(work_dir, 'uploads')
-            output_json_dir = os.path.join(work_dir, "output-json")
-
-            # pdf_to_civiform_gemini should also provide a way to
-            # return the filepath of the generated Civiform JSON. Instead,
-            # we have to duplicate its logic here.
-            # TODO(orwant): Fix this.
-            filename = os.path.basename(pdf)
-            base_name, _ = os.path.splitext(filename)
-            base_name = base_name[:15]
-            output_suffix = f"civiform-{args.model}"
-            eval_filename = os.path.join(
-                output_json_dir, f"{base_name}-{output_suffix}.json")
-
-            with open(eval_filename, 'r', encoding = 'utf-8-sig') as f:
-                json_eval_str = f.read()
-
-            scores[root] = calculate_score(json_golden_str, json_eval_str)
-            logging.info(f"Score for {root}: {scores[root]}")
+            roots.append(root)
         else:
             logging.warning(f"No JSON found for {pdf}")
+    return roots
+
+
+def read_golden(root):
+    """ Read the golden JSON of a golden PDF, given without its extension. """
+    json_filepath = Path(root + '.json')
+    with open(json_filepath, 'r', encoding = 'utf-8-sig') as f:
+        return f.read()
+
+
+def run_golden(pipeline, llm_client, root, model_name):
+    """ Run the pipeline on a golden PDF.
+
+    Returns:
+      The CiviForm JSON string, or None if the pipeline failed.
+    """
+    logging.info(f"Evaluating {root}")
+    try:
+        result = pipeline.run_pipeline(root + '.pdf', model_name, llm_client)
+    except Exception as e:
+        logging.error(f"Pipeline failed for {root}.pdf: {e}")
+        return None
+    logging.info(f"CiviForm JSON saved to {result.output_paths['civiform']}")
+    return result.civiform_json
+
+
+def regression_test(llm_client, directory, model_name):
+    """ Evaluate all of the PDF/JSON pairs in a directory, one at a time.
+
+    Args:
+      llm_client: An initialized LLM object.
+      directory: The name of the directory containing golden PDF/JSON pairs.
+      model_name: Name of the LLM to use (e.g., "gemini-2.0-flash")
+
+    Returns:
+      A dict mapping the PDF filepaths (without extension) to their
+      regression scores, in sorted order. A PDF the pipeline fails on
+      scores 0.0.
+    """
+    # Importing the app sets up its directories and log capture, which only
+    # a regression run needs (not a test runner collecting this file).
+    import pdf_to_civiform_gemini as pipeline
+
+    scores = {}
+    for root in golden_pairs(directory):
+        json_eval_str = run_golden(pipeline, llm_client, root, model_name)
+        if json_eval_str is None:
+            scores[root] = 0.0
+        else:
+            scores[root] = calculate_score(read_golden(root), json_eval_str)
+        logging.info(f"Score for {root}: {scores[root]}")
+    return scores
+
+
+def parallel_regression_test(llm_client, directory, model_name,
+                             workers=DEFAULT_WORKERS, score_workers=None):
+    """ Evaluate all of the PDF/JSON pairs in a directory concurrently.
+
+    The pipeline runs on up to `workers` golden PDFs at once, in threads;
+    their LLM calls also share llm_lib's limit on concurrent calls (see
+    --max-llm-calls). Each output is scored as soon as it is ready, in a
+    pool of worker processes, since scoring is CPU bound.
+
+    Args:
+      llm_client: An initialized LLM object.
+      directory: The name of the directory containing golden PDF/JSON pairs.
+      model_name: Name of the LLM to use (e.g., "gemini-2.0-flash")
+      workers: Golden PDFs processed at once.
+      score_workers: Scoring processes, by default one per CPU.
+
+    Returns:
+      The same dict as regression_test, in the same order, whatever order
+      the goldens finish in.
+    """
+    import pdf_to_civiform_gemini as pipeline
+
+    roots = golden_pairs(directory)
+    score_workers = score_workers or os.cpu_count() or 1
+    score_futures = {}
+    # spawn: forking while pipeline threads run could copy their locks.
+    with ProcessPoolExecutor(
+            max_workers=score_workers,
+            mp_context=multiprocessing.get_context("spawn")) as scorer:
+        # Start the scoring processes, which take seconds to import the
+        # rules, while the first goldens run.
+        for _ in range(min(score_workers, len(roots))):
+            scorer.submit(int)
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as runner:
+            run_futures = {
+                runner.submit(run_golden, pipeline, llm_client, root,
+                              model_name): root
+                for root in roots}
+            for future in as_completed(run_futures):
+                root = run_futures[future]
+                json_eval_str = future.result()
+                if json_eval_str is not None:
+                    score_futures[root] = scorer.submit(
+                        calculate_score, read_golden(root), json_eval_str)
+
+        scores = {}
+        for root in roots:
+            scores[root] = (score_futures[root].result()
+                            if root in score_futures else 0.0)
+            logging.info(f"Score for {root}: {scores[root]}")
     return scores
 
 
@@ -147,11 +231,20 @@ def display_scores(scores):
     for pdf, score in scores.items():
         basename = os.path.basename(pdf)
         print(f"{basename}: ", "{:.2f}".format(score))
+    if scores:
+        print("Average: ", "{:.2f}".format(sum(scores.values()) / len(scores)))
 
 
 if __name__ == '__main__':
     args = parse_arguments()
+    if args.max_llm_calls:
+        llm.set_max_concurrent_llm_calls(args.max_llm_calls)
     llm_client = llm.initialize_gemini_client()
-    scores = regression_test(llm_client, args.directory, args.model)
+    if args.workers > 1:
+        scores = parallel_regression_test(llm_client, args.directory,
+                                          args.model, args.workers,
+                                          args.score_workers)
+    else:
+        scores = regression_test(llm_client, args.directory, args.model)
     display_scores(scores)
         
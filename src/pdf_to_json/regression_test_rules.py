@@ -2,13 +2,22 @@
 
 Each rule should output a number between 0.0 (worst) and 1.0 (best).
 
-The name of every rule begins with "rule_". 
+The name of every rule begins with "rule_". Rules are registered in RULES
+with the @rule decorator, and take a ProgramPair: the golden and evaluated
+programs, each parsed once into a ProgramView, and what the rules compare
+them with (such as the similarity matrix of their questions), computed
+once for all the rules.
 
-These are called by regression_test() in regression_test.py.
+These are called by calculate_score() in regression_test.py.
 """
 
-import json
-# "pip install scikit-learn" to install these.
+import functools
+import json_codec
+import logging
+# "pip install numpy scipy scikit-learn" to install these. They are not
+# in python_dependencies.txt: only the regression test needs them.
+import numpy
+from scipy.optimize import linear_sum_assignment
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 
@@ -19,6 +28,77 @@ from sklearn.metrics.pairwise import cosine_similarity
 # of the other.
 _INDEX_PENALTY_EXPONENT = 0.9
 
+
+# The registered rules, by name, see rule().
+RULES = {}
+
+
+class ProgramView:
+    """ A CiviForm program, parsed once, with what the rules read from it.
+
+    The parsed program is shared by all the rules, which must not modify it.
+
+    Attributes:
+      program: The parsed program.
+      questions: Its questions, see extract_questions().
+      question_texts: The most informative text of each question, see
+        extract_question_texts().
+      question_types: The type of each question.
+      question_text_count: The number of occurrences of "questionText" in
+        the JSON string.
+    """
+
+    def __init__(self, json_str):
+        self.program = json_codec.loads(json_str)
+        self.questions = extract_questions(self.program)
+        self.question_texts = _question_texts(self.questions)
+        self.question_types = [question.get('type')
+                               for question in self.questions]
+        self.question_text_count = json_str.count('questionText')
+
+
+class ProgramPair:
+    """ The golden and evaluated programs scored by the rules.
+
+    Attributes:
+      golden: The ProgramView of the golden program.
+      eval: The ProgramView of the program to be evaluated.
+    """
+
+    def __init__(self, golden, eval):
+        self.golden = golden
+        self.eval = eval
+
+    @classmethod
+    def from_json(cls, json_golden_str, json_eval_str):
+        return cls(ProgramView(json_golden_str), ProgramView(json_eval_str))
+
+    @functools.cached_property
+    def similarity_matrix(self):
+        """ See generate_question_similarity_matrix(). """
+        return _similarity_matrix(self.golden.question_texts,
+                                  self.eval.question_texts)
+
+
+def takes_pair(function):
+    """ Lets a function of a ProgramPair also be called with the golden and
+    evaluated JSON strings, as in function(json_golden_str, json_eval_str).
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if len(args) == 2:
+            return function(ProgramPair.from_json(*args), **kwargs)
+        return function(*args, **kwargs)
+    return wrapper
+
+
+def rule(function):
+    """ Registers a rule in RULES under its name, see takes_pair(). """
+    wrapper = takes_pair(function)
+    RULES[function.__name__] = wrapper
+    return wrapper
+
+
 def score_missed_questions(num_json_questions, num_golden_questions):
     """ Score the number of missed questions.
 
@@ -74,12 +154,13 @@ def score_extra_questions(num_json_questions, num_golden_questions):
              (num_golden_questions - num_json_questions)))
 
 
-def rule_number_of_questions(json_golden_str, json_eval_str):
+@rule
+def rule_number_of_questions(pair):
     """ Compares the number of questions in the JSONs.
 
     Args:
-      json_golden_str: A JSON string of the golden CiviForm. 
-      json_eval_str: A JSON string of the CiviForm to be evaluated.
+      pair: The ProgramPair of the golden CiviForm and the CiviForm to be
+        evaluated.
 
     Returns:
       Float in [0.0, 1.0] indicating the fidelity of the JSON to be evaluated.
@@ -89,8 +170,8 @@ def rule_number_of_questions(json_golden_str, json_eval_str):
 
     # We count occurrences of "questionText" to determine the number
     # of questions in the JSON.
-    num_golden_questions = json_golden_str.count('questionText')
-    num_json_questions = json_eval_str.count('questionText')
+    num_golden_questions = pair.golden.question_text_count
+    num_json_questions = pair.eval.question_text_count
 
     if num_golden_questions == num_json_questions:
         score = 1.0
@@ -137,17 +218,17 @@ def extract_questions(json_obj):
 
 
 
-def rule_correct_field_types(json_golden_str, json_eval_str):
+@rule
+def rule_correct_field_types(pair):
     """
     Args:
-      json_golden_str: A JSON string of the golden program.
-      json_eval_str: A JSON string of the program to be evaluated.
+      pair: The ProgramPair of the golden program and the program to be
+        evaluated. Their question types are pair.golden.question_types and
+        pair.eval.question_types.
 
     Returns:
       Float in [0.0, 1.0] indicating the similarity of the question texts.
     """
-    golden_questions = extract_questions(json.loads(json_golden_str))
-    json_questions = extract_questions(json.loads(json_eval_str))
     # TODO(orwant): Implement this.
     return 0.5
 
@@ -161,7 +242,10 @@ def extract_question_texts(json_str):
     Returns:
       A list of question (or description) strings.
     """
-    questions = extract_questions(json.loads(json_str))
+    return ProgramView(json_str).question_texts
+
+
+def _question_texts(questions):
     result = []
     for question in questions:
         if 'config' in question:
@@ -176,7 +260,8 @@ def extract_question_texts(json_str):
     return result
 
 
-def generate_question_similarity_matrix(json_golden_str, json_eval_str):
+@takes_pair
+def generate_question_similarity_matrix(pair):
     """ Generate the similarity matrix of questions in two programs.
 
     The similarity matrix has dimension N x M, where N is the number of
@@ -185,17 +270,19 @@ def generate_question_similarity_matrix(json_golden_str, json_eval_str):
     perfectly, that matrix will be the identity matrix, and so the return
     value of this method will be 1.0.
 
+    It is computed once per pair, see ProgramPair.similarity_matrix.
+
     Args:
-      json_golden_str: A JSON string of the golden program.
-      json_eval_str: A JSON string of the program to be evaluated.
+      pair: The ProgramPair of the golden program and the program to be
+        evaluated.
 
     Returns:
       A 2D matrix of the similarities between program questions.
     """
-    # First, extract the question texts.
-    questions_golden = extract_question_texts(json_golden_str)
-    questions_eval = extract_question_texts(json_eval_str)
+    return pair.similarity_matrix
 
+
+def _similarity_matrix(questions_golden, questions_eval):
     if len(questions_golden) == 0 or len(questions_eval) == 0:
         return [[]]
 
@@ -217,58 +304,83 @@ def generate_question_similarity_matrix(json_golden_str, json_eval_str):
     return similarity_matrix
 
 
-def generate_question_mapping(json_golden_str, json_eval_str):
+@functools.lru_cache(maxsize=8)
+def index_penalties(num_golden, num_eval):
+    """ The penalties for the distance between question indices.
+
+    Args:
+      num_golden: The number of questions in the golden program.
+      num_eval: The number of questions in the program to be evaluated.
+
+    Returns:
+      A read-only num_golden x num_eval array, where [i][j] is
+      _INDEX_PENALTY_EXPONENT ** |i - j|.
+    """
+    # Powers of each distance, computed as Python floats (as the loops did),
+    # so that ties between questions break the same way.
+    powers = numpy.array([_INDEX_PENALTY_EXPONENT ** distance
+                          for distance in range(max(num_golden, num_eval))])
+    distances = numpy.abs(numpy.arange(num_golden)[:, numpy.newaxis] -
+                          numpy.arange(num_eval)[numpy.newaxis, :])
+    penalties = powers[distances]
+    penalties.flags.writeable = False
+    return penalties
+
+
+def _last_argmax(matrix, axis):
+    # The index of the last maximum of each row (axis=1) or column (axis=0),
+    # or -1 if that maximum is negative.
+    if matrix.shape[axis] == 0:
+        return [-1] * matrix.shape[1 - axis]
+    reversed_matrix = numpy.flip(matrix, axis=axis)
+    indices = matrix.shape[axis] - 1 - reversed_matrix.argmax(axis=axis)
+    indices[matrix.max(axis=axis) < 0] = -1
+    return indices.tolist()
+
+
+@takes_pair
+def generate_question_mapping(pair, optimal=False):
     """ Map the questions between programs using question texts.
 
     Args:
-      json_golden_str: A JSON string of the golden program.
-      json_eval_str: A JSON string of the program to be evaluated.
+      pair: The ProgramPair of the golden program and the program to be
+        evaluated.
+      optimal: If True, map each question to at most one question of the
+        other program, maximizing the sum of the penalized similarities.
 
     Returns:
       Two arrays, one mapping questions from the golden to the eval,
-      and the other mapping from eval to the golden.
+      and the other mapping from eval to the golden. Questions without
+      a mapping are mapped to -1.
     """
-
-    similarity_matrix = generate_question_similarity_matrix(
-        json_golden_str, json_eval_str)
-
-    def index_penalty(index1, index2):
-        return _INDEX_PENALTY_EXPONENT ** abs(index1 - index2)
-
-    # First, loop by row to find the golden->eval mappings.
-    # This gets a little complicated. Instead of always picking the question
-    # with the highest similarity, we penalize based on distance in the array,
-    # so that if there are two questions that seem similar based on wording,
-    # we choose the one whose index is closest to the golden index.
-    golden_to_eval = [None] * len(similarity_matrix)
-    for golden_index in range(len(similarity_matrix)):
-        best_index = -1
-        best_value = 0
-        for eval_index in range(len(similarity_matrix[0])):
-            penalized_value = (index_penalty(golden_index, eval_index) *
-                               similarity_matrix[golden_index][eval_index])
-            if (best_value <= penalized_value):
-                best_index = eval_index
-                best_value = penalized_value
-        golden_to_eval[golden_index] = best_index
-
-    # Now, the converse: loop by column to find the eval->golden mappings.
-    # These are not guaranteed to be symmetrical!
-    eval_to_golden = [None] * len(similarity_matrix[0])
-    for eval_index in range(len(similarity_matrix[0])):
-        best_index = -1
-        best_value = 0
-        for golden_index in range(len(similarity_matrix)):
-            penalized_value = (index_penalty(golden_index, eval_index) *
-                               similarity_matrix[golden_index][eval_index])
-            if (best_value <= penalized_value):
-                best_index = eval_index
-                best_value = penalized_value
-        eval_to_golden[eval_index] = best_index
-
-    return(golden_to_eval, eval_to_golden)
-
-def rule_help_text_similarity(json_golden_str, json_eval_str):
+    similarity_matrix = numpy.asarray(pair.similarity_matrix, dtype=float)
+    (num_golden, num_eval) = similarity_matrix.shape
+
+    # Instead of always picking the question with the highest similarity,
+    # we penalize based on distance in the array, so that if there are two
+    # questions that seem similar based on wording, we choose the one whose
+    # index is closest to the other index.
+    penalized_matrix = (index_penalties(num_golden, num_eval) *
+                        similarity_matrix)
+
+    if optimal:
+        golden_to_eval = [-1] * num_golden
+        eval_to_golden = [-1] * num_eval
+        for (golden_index, eval_index) in zip(
+                *linear_sum_assignment(penalized_matrix, maximize=True)):
+            golden_to_eval[golden_index] = int(eval_index)
+            eval_to_golden[eval_index] = int(golden_index)
+        return (golden_to_eval, eval_to_golden)
+
+    # Otherwise, each question maps to the best one in its row (golden->eval)
+    # or column (eval->golden), the last one in case of a tie. These are not
+    # guaranteed to be symmetrical!
+    return (_last_argmax(penalized_matrix, axis=1),
+            _last_argmax(penalized_matrix, axis=0))
+
+
+@rule
+def rule_help_text_similarity(pair):
     """ Compute the similarity of the help texts in two programs.
 
     This rule compares the help texts of two programs. Often the
@@ -287,22 +399,16 @@ def rule_help_text_similarity(json_golden_str, json_eval_str):
     questions.
 
     Args:
-      json_golden_str: A JSON string of the golden program.
-      json_eval_str: A JSON string of the program to be evaluated.
+      pair: The ProgramPair of the golden program and the program to be
+        evaluated.
 
     Returns:
       Float in [0.0, 1.0] indicating the similarity of the question texts.
     """
-    similarity_matrix = generate_question_similarity_matrix(
-        json_golden_str, json_eval_str)
-
-    # Average the highest scores.
-    sum = 0.0
-    for i in range(len(similarity_matrix)):
-        highest = 0.0
-        for j in range(len(similarity_matrix[0])):
-            if similarity_matrix[i][j] > highest:
-                highest = similarity_matrix[i][j]
-        sum += highest
-
-    return(sum / len(similarity_matrix))
+    similarity_matrix = numpy.asarray(pair.similarity_matrix, dtype=float)
+    if similarity_matrix.shape[1] == 0:
+        return 0.0
+
+    # Average the highest scores (added in order, as floats).
+    highest = numpy.maximum(similarity_matrix.max(axis=1), 0.0)
+    return sum(highest.tolist(), 0.0) / len(highest)
@@ -98,5 +98,43 @@ class TestGenerateQuestionMapping(unittest.TestCase):
         self.assertEqual(golden_to_eval[0], 0)
         self.assertEqual(golden_to_eval[15], 15)
 
+def program_str(*texts):
+    return json.dumps({'program': {}, 'questions': [
+        {'type': 'text', 'config': {'questionText': {
+            'translations': {'en_US': text}}}}
+        for text in texts]})
+
+
+class TestProgramPair(unittest.TestCase):
+
+    def test_rules_share_one_parse(self):
+        golden = program_str('What is your name?', 'Where do you live?')
+        evaluated = program_str('Where do you live?', 'Your full name',
+                                'Household income')
+        pair = rules.ProgramPair.from_json(golden, evaluated)
+        self.assertEqual(pair.golden.question_types, ['text', 'text'])
+        self.assertIs(pair.similarity_matrix, pair.similarity_matrix)
+        for rule in ('rule_number_of_questions', 'rule_help_text_similarity'):
+            self.assertEqual(rules.RULES[rule](pair),
+                             rules.RULES[rule](golden, evaluated))
+        self.assertEqual(rules.generate_question_mapping(pair),
+                         rules.generate_question_mapping(golden, evaluated))
+
+
+class TestQuestionMappingModes(unittest.TestCase):
+
+    def test_greedy_and_optimal_mappings(self):
+        golden = program_str('home address', 'home address', 'date of birth')
+        evaluated = program_str('home address', 'date of birth')
+        # Greedily, both golden addresses map to the eval address.
+        self.assertEqual(
+            rules.generate_question_mapping(golden, evaluated),
+            ([0, 0, 1], [0, 2]))
+        # An optimal assignment maps each question at most once.
+        self.assertEqual(
+            rules.generate_question_mapping(golden, evaluated, optimal=True),
+            ([0, -1, 1], [0, 2]))
+
+
 if __name__ == '__main__':
     unittest.main()
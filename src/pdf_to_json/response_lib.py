@@ -0,0 +1,176 @@
+""" Smaller API responses: trimming options and content-negotiated compression.
+
+Clients can ask for less in a response:
+
+  * debugLog=false    omits the debug log.
+  * minify=true       returns the intermediary and CiviForm JSON without
+                      indentation.
+  * civiformOnly=true returns only the CiviForm JSON.
+
+Responses are compressed with brotli (if the brotli package is installed)
+or gzip when the client accepts it and the body is large enough to gain
+from it. Streamed responses (progress events, NDJSON results) are sent
+uncompressed, so that each line reaches the client as soon as it is written.
+
+Both apps encode their JSON responses and decode JSON requests with
+json_codec, see JSONProvider.
+"""
+
+import collections
+from flask.json.provider import DefaultJSONProvider
+import gzip
+import json_codec
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available.
+    brotli = None
+
+# Bodies smaller than this are not worth compressing.
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 6
+# Brotli's default quality (11) is far too slow for per-request use.
+BROTLI_QUALITY = 5
+
+_COMPRESSIBLE_MIMETYPES = ("application/json", "application/x-ndjson",
+                           "text/html", "text/plain", "text/css",
+                           "application/javascript")
+
+# Fields holding pipeline JSON documents as strings.
+_JSON_DOCUMENT_FIELDS = ("intermediary_json", "civiform_json")
+
+ResponseOptions = collections.namedtuple(
+    'ResponseOptions', ['omit_debug_log', 'minify', 'civiform_only'])
+
+DEFAULT_OPTIONS = ResponseOptions(
+    omit_debug_log=False, minify=False, civiform_only=False)
+
+
+class JSONProvider(DefaultJSONProvider):
+    """ The apps' JSON provider (app.json): jsonify() and request.get_json()
+    use json_codec. Keys are sorted as by Flask's default provider (unless
+    sort_keys is turned off), and non-ASCII characters are not escaped.
+    Values json_codec cannot encode, such as decimals, are left to Flask's
+    encoder. """
+
+    def dumps(self, obj, **kwargs):
+        if set(kwargs) <= {"indent", "separators", "sort_keys"}:
+            try:
+                return json_codec.dumps(
+                    obj, indent=kwargs.get("indent"),
+                    sort_keys=kwargs.get("sort_keys", self.sort_keys))
+            except TypeError:
+                pass
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return json_codec.loads(s)
+
+
+def _is_true(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() in ("true", "1", "yes")
+
+
+def parse_response_options(*sources):
+    """ Reads the response options of a request.
+
+    Args:
+      *sources: Dict-like request values (query string, form fields, JSON
+        body), in increasing order of precedence. None is skipped.
+
+    Returns:
+      A ResponseOptions.
+    """
+    values = {}
+    for source in sources:
+        if source is None:
+            continue
+        for name in ("debugLog", "minify", "civiformOnly"):
+            if name in source:
+                values[name] = source.get(name)
+    return ResponseOptions(
+        omit_debug_log=not _is_true(values.get("debugLog", True)),
+        minify=_is_true(values.get("minify", False)),
+        civiform_only=_is_true(values.get("civiformOnly", False)))
+
+
+def minify_json(json_string):
+    """ Returns a JSON document without whitespace between tokens. """
+    return json_codec.dumps(json_codec.loads(json_string))
+
+
+def shape_response(data, options):
+    """ Applies response options to a response dict.
+
+    Args:
+      data: The response dict, e.g. {"intermediary_json": ...,
+        "civiform_json": ..., "debug_log": ...}.
+      options: A ResponseOptions.
+
+    Returns:
+      A new dict; `data` is not modified.
+    """
+    data = dict(data)
+    if options.omit_debug_log:
+        data.pop("debug_log", None)
+    if options.civiform_only:
+        data.pop("intermediary_json", None)
+    if options.minify:
+        for field in _JSON_DOCUMENT_FIELDS:
+            if isinstance(data.get(field), str):
+                try:
+                    data[field] = minify_json(data[field])
+                except ValueError:
+                    pass  # Not valid JSON: return it unchanged.
+    return data
+
+
+def choose_encoding(accept_encodings):
+    """ Picks the content encoding to use for a client.
+
+    Args:
+      accept_encodings: The request's parsed Accept-Encoding header (a
+        werkzeug Accept object, e.g. flask.request.accept_encodings).
+
+    Returns:
+      "br", "gzip", or None for no compression.
+    """
+    supported = ["br", "gzip"] if brotli is not None else ["gzip"]
+    return accept_encodings.best_match(supported)
+
+
+def compress(data, encoding):
+    """ Compresses bytes with "br" or "gzip". """
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def should_compress(response):
+    """ Whether a complete (non-streamed) response is worth compressing. """
+    return (200 <= response.status_code < 300 and
+            "Content-Encoding" not in response.headers and
+            response.mimetype in _COMPRESSIBLE_MIMETYPES)
+
+
+def compress_body(response, body, accept_encodings):
+    """ Compresses a response body in place, if the client accepts it.
+
+    Args:
+      response: A Flask or Quart response whose body is `body`, and that
+        should_compress() accepted.
+      body: The response body, as bytes.
+      accept_encodings: The request's parsed Accept-Encoding header.
+    """
+    response.vary.add("Accept-Encoding")
+    if len(body) < MIN_COMPRESS_BYTES:
+        return
+    encoding = choose_encoding(accept_encodings)
+    if encoding is None:
+        return
+    response.set_data(compress(body, encoding))
+    response.headers["Content-Encoding"] = encoding
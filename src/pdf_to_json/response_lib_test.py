@@ -0,0 +1,98 @@
+import decimal
+import flask
+import gzip
+import json
+import response_lib
+import unittest
+from werkzeug.datastructures import Accept
+
+
+class TestResponseOptions(unittest.TestCase):
+
+    def test_parse_response_options(self):
+        options = response_lib.parse_response_options(
+            {'debugLog': 'false', 'minify': 'true'}, None,
+            {'minify': False, 'civiformOnly': True})
+        self.assertEqual(options, response_lib.ResponseOptions(
+            omit_debug_log=True, minify=False, civiform_only=True))
+        self.assertEqual(response_lib.parse_response_options(),
+                         response_lib.DEFAULT_OPTIONS)
+
+    def test_shape_response(self):
+        data = {'intermediary_json': '{\n  "a": 1\n}',
+                'civiform_json': '{\n  "b": [1, 2]\n}',
+                'debug_log': 'log'}
+        shaped = response_lib.shape_response(data, response_lib.ResponseOptions(
+            omit_debug_log=True, minify=True, civiform_only=True))
+        self.assertEqual(shaped, {'civiform_json': '{"b":[1,2]}'})
+        # The original is left alone.
+        self.assertIn('debug_log', data)
+
+
+class TestJSONProvider(unittest.TestCase):
+
+    def setUp(self):
+        self.app = flask.Flask(__name__)
+        self.app.json = response_lib.JSONProvider(self.app)
+
+        @self.app.route('/echo', methods=['POST'])
+        def echo():
+            return flask.jsonify(flask.request.get_json())
+
+        self.client = self.app.test_client()
+
+    def test_round_trip(self):
+        data = {'b': 'café', 'a': [1, 2.5, None, True]}
+        response = self.client.post('/echo', json=data)
+        self.assertEqual(response.get_data(as_text=True),
+                         '{"a":[1,2.5,null,true],"b":"café"}\n')
+
+        self.app.json.sort_keys = False
+        response = self.client.post('/echo', json=data)
+        self.assertEqual(response.get_data(as_text=True),
+                         '{"b":"café","a":[1,2.5,null,true]}\n')
+
+    def test_other_values_use_the_flask_encoder(self):
+        with self.app.app_context():
+            response = flask.jsonify({'amount': decimal.Decimal('1.50')})
+        self.assertEqual(response.get_json(), {'amount': '1.50'})
+
+
+class TestCompression(unittest.TestCase):
+
+    def setUp(self):
+        self.app = flask.Flask(__name__)
+
+        @self.app.route('/<int:size>')
+        def respond(size):
+            response = flask.jsonify({'data': 'x' * size})
+            if response_lib.should_compress(response):
+                response_lib.compress_body(
+                    response, response.get_data(),
+                    flask.request.accept_encodings)
+            return response
+
+        self.client = self.app.test_client()
+
+    def test_gzip(self):
+        response = self.client.get(
+            '/5000', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        body = json.loads(gzip.decompress(response.get_data()))
+        self.assertEqual(len(body['data']), 5000)
+
+    def test_small_or_unaccepted_bodies_are_not_compressed(self):
+        small = self.client.get('/10', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', small.headers)
+        identity = self.client.get('/5000')
+        self.assertNotIn('Content-Encoding', identity.headers)
+
+    def test_choose_encoding(self):
+        self.assertIsNone(response_lib.choose_encoding(Accept()))
+        self.assertEqual(
+            response_lib.choose_encoding(Accept([('gzip', 1)])), 'gzip')
+
+
+if __name__ == '__main__':
+    unittest.main()
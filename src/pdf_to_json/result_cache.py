@@ -0,0 +1,176 @@
+""" End-to-end result cache for uploaded PDFs.
+
+Stores the final intermediary and CiviForm JSON of a pipeline run, keyed by
+the PDF's content hash, the model and PIPELINE_VERSION, so uploading the
+same PDF again with the same model returns at once without calling the LLM.
+
+Lookups are single-flight: while a result is being computed, identical
+requests wait for that computation instead of starting their own.
+"""
+
+from concurrent.futures import Future
+import asyncio
+import hashlib
+import json_codec
+import logging
+import os
+import threading
+import time
+
+# Part of every cache key. Bump it whenever a change to the prompts,
+# post-processing or the CiviForm conversion changes the pipeline's output,
+# so that results of the previous pipeline are no longer served.
+PIPELINE_VERSION = 1
+
+# get_or_compute statuses.
+HIT = "hit"        # Served from the cache.
+JOINED = "joined"  # Waited for an identical in-flight computation.
+MISS = "miss"      # Computed by this caller.
+
+
+class ResultCache:
+    """ A directory of cached pipeline results, one JSON file per key.
+
+    Safe to share between threads. The async methods must all be called from
+    the same event loop.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._async_in_flight = {}
+
+    def key(self, content_hash, model_name):
+        """ Returns the cache key of a PDF's result with a given model. """
+        key = f"{content_hash}\n{model_name}\n{PIPELINE_VERSION}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        """ Returns the cached result for `key`, or None. """
+        try:
+            with open(self.path(key), "r", encoding="utf-8") as f:
+                entry = json_codec.loads(f.read())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable result cache entry {key}: {e}")
+            return None
+        try:
+            # Mark the entry as recently used, so that the storage janitor
+            # evicts unused entries first.
+            os.utime(self.path(key))
+        except OSError:
+            pass
+        return {"intermediary_json": entry["intermediary_json"],
+                "civiform_json": entry["civiform_json"]}
+
+    def put(self, key, result, model_name=None):
+        """ Stores a result, a dict with 'intermediary_json' and 'civiform_json'. """
+        entry = {
+            "intermediary_json": result["intermediary_json"],
+            "civiform_json": result["civiform_json"],
+            "model_name": model_name,
+            "pipeline_version": PIPELINE_VERSION,
+            "created": time.time(),
+        }
+        path = self.path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(json_codec.dumps(entry))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # A failed write only costs a recomputation next time.
+            logging.error(f"Error saving result cache entry '{path}': {e}")
+
+    def get_or_compute(self, key, compute, model_name=None):
+        """ Returns the result for `key`, computing it at most once at a time.
+
+        Args:
+          key: A key from key().
+          compute: Called without arguments to compute the result on a miss.
+            Its exceptions are raised to every caller waiting for it, and
+            nothing is cached.
+          model_name: Saved with the entry, for reference.
+
+        Returns:
+          (result, status), where status is HIT, JOINED or MISS.
+        """
+        result = self.get(key)
+        if result is not None:
+            return result, HIT
+
+        with self._lock:
+            flight = self._in_flight.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = Future()
+                self._in_flight[key] = flight
+        if not is_leader:
+            return flight.result(), JOINED
+
+        try:
+            # A computation may have finished since the lookup above.
+            result = self.get(key)
+            if result is not None:
+                flight.set_result(result)
+                return result, HIT
+            result = compute()
+            if _is_complete(result):
+                self.put(key, result, model_name)
+            flight.set_result(result)
+            return result, MISS
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    async def get_or_compute_async(self, key, compute, model_name=None):
+        """ Async version of get_or_compute.
+
+        Args:
+          compute: A coroutine function, awaited without arguments on a miss.
+        """
+        result = await asyncio.to_thread(self.get, key)
+        if result is not None:
+            return result, HIT
+
+        flight = self._async_in_flight.get(key)
+        if flight is not None:
+            # shield: a cancelled follower must not cancel the computation.
+            return await asyncio.shield(flight), JOINED
+
+        flight = asyncio.get_running_loop().create_future()
+        self._async_in_flight[key] = flight
+        try:
+            result = await asyncio.to_thread(self.get, key)
+            if result is not None:
+                flight.set_result(result)
+                return result, HIT
+            result = await compute()
+            if _is_complete(result):
+                await asyncio.to_thread(self.put, key, result, model_name)
+            flight.set_result(result)
+            return result, MISS
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except BaseException as e:
+            flight.set_exception(e)
+            # Followers re-raise it; the leader's own exception is raised
+            # below, so do not warn about an unretrieved exception.
+            flight.exception()
+            raise
+        finally:
+            del self._async_in_flight[key]
+
+
+def _is_complete(result):
+    return bool(result and result.get("civiform_json"))
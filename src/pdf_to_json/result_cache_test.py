@@ -0,0 +1,75 @@
+import asyncio
+import result_cache
+import tempfile
+import threading
+import unittest
+
+RESULT = {'intermediary_json': '[]', 'civiform_json': '{"program": {}}'}
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = result_cache.ResultCache(self.tmp_dir.name)
+        self.key = self.cache.key('abc', 'gemini-2.5-flash')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_key_depends_on_model(self):
+        self.assertNotEqual(self.key, self.cache.key('abc', 'gemini-2.5-pro'))
+
+    def test_concurrent_requests_share_one_computation(self):
+        calls = []
+        release = threading.Event()
+        statuses = []
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return RESULT
+
+        def request():
+            statuses.append(self.cache.get_or_compute(self.key, compute)[1])
+
+        threads = [threading.Thread(target=request) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        while not self.cache._in_flight:
+            pass
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(statuses.count(result_cache.MISS), 1)
+        self.assertEqual(self.cache.get_or_compute(self.key, compute),
+                         (RESULT, result_cache.HIT))
+
+    def test_failures_are_not_cached(self):
+        def fail():
+            raise ValueError('boom')
+        with self.assertRaises(ValueError):
+            self.cache.get_or_compute(self.key, fail)
+        self.assertIsNone(self.cache.get(self.key))
+
+    def test_async_requests_share_one_computation(self):
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return RESULT
+
+        async def run():
+            return await asyncio.gather(*[
+                self.cache.get_or_compute_async(self.key, compute)
+                for _ in range(4)])
+
+        statuses = sorted(status for (_, status) in asyncio.run(run()))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(statuses, [result_cache.JOINED] * 3 + [result_cache.MISS])
+
+
+if __name__ == '__main__':
+    unittest.main()
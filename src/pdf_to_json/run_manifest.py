@@ -0,0 +1,178 @@
+""" Checkpoint manifests for resumable directory runs.
+
+A run manifest records, for each PDF of a directory run, the SHA-256 hash of
+its content, the pipeline stages that have completed and the files those
+stages wrote. When the same run is started again (same directory, same
+model), files whose stages are all done are skipped, and partially processed
+files resume after their last completed stage instead of calling the LLM
+again.
+
+Entries are keyed by content hash, not by filename, so a renamed PDF still
+resumes and a replaced PDF with the same name starts over.
+"""
+
+import hashlib
+import json_codec
+import logging
+import os
+import threading
+import time
+
+# Pipeline stages, in order. Each one is checkpointed once its output file
+# has been written.
+STAGES = ("pdf-extract", "post-process", "civiform")
+
+MANIFEST_VERSION = 1
+
+
+def hash_bytes(data):
+    """ Returns the hex SHA-256 digest of a bytes-like object. """
+    return hashlib.sha256(data).hexdigest()
+
+
+def run_id_for(directory, model_name):
+    """ Derives a stable run id from the directory and model of a run. """
+    key = f"{os.path.abspath(directory)}\n{model_name}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+def recorded_outputs(path):
+    """ Returns the output files recorded in the manifest at `path`.
+
+    An unreadable manifest records nothing.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json_codec.loads(f.read())
+        return [output_path for entry in data.get("files", {}).values()
+                for output_path in entry["stages"].values()]
+    except (OSError, ValueError, KeyError, AttributeError):
+        return []
+
+
+class FileCheckpoint:
+    """ The checkpoint of one PDF within a run manifest. """
+
+    def __init__(self, manifest, content_hash, filename):
+        self.manifest = manifest
+        self.content_hash = content_hash
+        self.filename = filename
+
+    def output(self, stage):
+        """ Returns the saved output of a completed stage, or None.
+
+        A stage whose output file has since been deleted counts as not done.
+        """
+        path = self.manifest.stage_output(self.content_hash, stage)
+        if path and os.path.isfile(path):
+            return path
+        return None
+
+    def record(self, stage, output_path):
+        """ Marks a stage as completed, with the file it wrote. """
+        if output_path:
+            self.manifest.record_stage(
+                self.content_hash, self.filename, stage, output_path)
+
+
+class _NoCheckpoint:
+    """ Stands in for a FileCheckpoint when a run is not checkpointed. """
+
+    def output(self, stage):
+        return None
+
+    def record(self, stage, output_path):
+        pass
+
+
+NO_CHECKPOINT = _NoCheckpoint()
+
+
+class RunManifest:
+    """ A JSON manifest of completed stages, saved after every update.
+
+    Safe to share between the worker threads of one run. Saves are atomic
+    (write to a temporary file, then rename), so a crash never leaves a
+    truncated manifest behind.
+    """
+
+    def __init__(self, path, run_info=None, files=None):
+        self.path = path
+        self.run_info = run_info or {}
+        self._files = files or {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, run_info=None, resume=True):
+        """ Opens the manifest at `path`, or starts a new one.
+
+        Args:
+          path: Where the manifest is stored.
+          run_info: A dict describing the run (directory, model), saved in
+            the manifest for reference.
+          resume: If False, any existing manifest is discarded.
+
+        Returns:
+          A RunManifest.
+        """
+        if resume and os.path.isfile(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json_codec.loads(f.read())
+                if data.get("version") == MANIFEST_VERSION:
+                    logging.info(f"Resuming run from manifest: {path}")
+                    return cls(path, run_info, data.get("files", {}))
+                logging.warning(
+                    f"Ignoring run manifest with unknown version: {path}")
+            except (OSError, ValueError) as e:
+                logging.warning(f"Ignoring unreadable run manifest {path}: {e}")
+        return cls(path, run_info)
+
+    def checkpoint(self, file_bytes, filename, content_hash=None):
+        """ Returns the FileCheckpoint for a PDF, given its content.
+
+        Args:
+          file_bytes: The PDF's content.
+          filename: The PDF's name, for reference.
+          content_hash: hash_bytes(file_bytes), if the caller already has it.
+        """
+        if content_hash is None:
+            content_hash = hash_bytes(file_bytes)
+        return FileCheckpoint(self, content_hash, filename)
+
+    def stage_output(self, content_hash, stage):
+        with self._lock:
+            entry = self._files.get(content_hash)
+            if entry is None:
+                return None
+            return entry["stages"].get(stage)
+
+    def record_stage(self, content_hash, filename, stage, output_path):
+        with self._lock:
+            entry = self._files.setdefault(
+                content_hash, {"filename": filename, "stages": {}})
+            entry["filename"] = filename
+            entry["stages"][stage] = output_path
+            entry["updated"] = time.time()
+            self._save_locked()
+
+    def output_paths(self):
+        """ Returns every output file recorded in the manifest. """
+        with self._lock:
+            return [path for entry in self._files.values()
+                    for path in entry["stages"].values()]
+
+    def _save_locked(self):
+        data = {
+            "version": MANIFEST_VERSION,
+            "run": self.run_info,
+            "files": self._files,
+        }
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(json_codec.dumps(data, indent=2))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            # A failed checkpoint only costs a redo on restart.
+            logging.error(f"Error saving run manifest '{self.path}': {e}")
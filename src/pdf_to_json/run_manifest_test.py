@@ -0,0 +1,50 @@
+import os
+import run_manifest
+import tempfile
+import unittest
+
+
+class TestRunManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.manifest_path = os.path.join(self.tmp_dir.name, 'run.json')
+        self.output_path = os.path.join(self.tmp_dir.name, 'a-pdf-extract.json')
+        with open(self.output_path, 'w') as f:
+            f.write('[]')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_resume_by_content(self):
+        manifest = run_manifest.RunManifest.load(self.manifest_path)
+        manifest.checkpoint(b'pdf bytes', 'a.pdf').record(
+            'pdf-extract', self.output_path)
+
+        reloaded = run_manifest.RunManifest.load(self.manifest_path)
+        # A renamed file with the same content resumes.
+        checkpoint = reloaded.checkpoint(b'pdf bytes', 'renamed.pdf')
+        self.assertEqual(checkpoint.output('pdf-extract'), self.output_path)
+        self.assertIsNone(checkpoint.output('civiform'))
+        # Different content starts over.
+        self.assertIsNone(
+            reloaded.checkpoint(b'other bytes', 'a.pdf').output('pdf-extract'))
+
+    def test_missing_output_is_not_done(self):
+        manifest = run_manifest.RunManifest.load(self.manifest_path)
+        checkpoint = manifest.checkpoint(b'pdf bytes', 'a.pdf')
+        checkpoint.record('pdf-extract', self.output_path)
+        os.remove(self.output_path)
+        self.assertIsNone(checkpoint.output('pdf-extract'))
+
+    def test_no_resume_discards_checkpoints(self):
+        manifest = run_manifest.RunManifest.load(self.manifest_path)
+        manifest.checkpoint(b'pdf bytes', 'a.pdf').record(
+            'pdf-extract', self.output_path)
+        fresh = run_manifest.RunManifest.load(self.manifest_path, resume=False)
+        self.assertIsNone(
+            fresh.checkpoint(b'pdf bytes', 'a.pdf').output('pdf-extract'))
+
+
+if __name__ == '__main__':
+    unittest.main()
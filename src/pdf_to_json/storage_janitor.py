@@ -0,0 +1,289 @@
+""" Retention and size-capped eviction of the web app's stored files.
+
+Every conversion leaves files behind: the uploaded PDF, its pdf-extract,
+formated, post-processed and CiviForm JSON, and possibly a batch archive, a
+result cache entry and a run manifest. The storage janitor periodically
+deletes the files older than STORAGE_MAX_AGE_HOURS and then, while the total
+still exceeds STORAGE_MAX_MB, the least recently modified ones.
+
+It never deletes:
+
+  * files in use by a running conversion, see StorageJanitor.in_use(),
+  * files modified in the last STORAGE_GRACE_MINUTES, which a request may
+    still be writing or about to read,
+  * outputs recorded by a run manifest that is kept, so that the run can
+    still be resumed. A manifest expires STORAGE_MAX_AGE_HOURS after its
+    last update, and its outputs can be deleted from the next sweep on.
+
+Sweeps run in a background thread and delete in small batches with a pause
+in between, so that they never hold up conversions for long.
+"""
+
+import collections
+import contextlib
+import fnmatch
+import logging
+import os
+import threading
+import time
+
+import run_manifest
+
+# 0 disables the corresponding limit (or, for the interval, the janitor).
+MAX_AGE_SECONDS = float(os.environ.get("STORAGE_MAX_AGE_HOURS", 7 * 24)) * 3600
+MAX_BYTES = int(float(os.environ.get("STORAGE_MAX_MB", 2048)) * 1024 * 1024)
+GRACE_SECONDS = float(os.environ.get("STORAGE_GRACE_MINUTES", 10)) * 60
+SWEEP_INTERVAL_SECONDS = float(os.environ.get("STORAGE_SWEEP_INTERVAL_SECONDS", 600))
+
+# Files deleted between two pauses of a sweep.
+DELETE_BATCH_SIZE = 100
+DELETE_PAUSE_SECONDS = 0.05
+
+SweepReport = collections.namedtuple('SweepReport', [
+    'scanned_files', 'scanned_bytes', 'deleted_files', 'reclaimed_bytes',
+    'protected_files', 'remaining_bytes', 'duration_seconds'])
+
+_StoredFile = collections.namedtuple('_StoredFile', ['path', 'size', 'mtime'])
+
+
+class StorageJanitor:
+    """ Evicts old files from a set of directories, by age and total size.
+
+    Args:
+      roots: (directory, recursive) pairs of the directories to manage. Only
+        the files directly in a non-recursive directory are managed. A
+        third element, a filename pattern (see fnmatch), limits a directory
+        to the files it matches, e.g. when it also holds other files.
+      manifests_dir: The directory of run manifests (see run_manifest.py),
+        whose outputs are kept as long as the manifest is. Usually also a
+        root.
+      max_age_seconds: Files older than this are deleted. 0 keeps files
+        regardless of age.
+      max_bytes: Cap on the total size of the managed files. 0 for no cap.
+      grace_seconds: Files modified more recently than this are kept.
+    """
+
+    def __init__(self, roots, manifests_dir=None,
+                 max_age_seconds=MAX_AGE_SECONDS, max_bytes=MAX_BYTES,
+                 grace_seconds=GRACE_SECONDS):
+        self.roots = [(os.path.abspath(root[0]), root[1],
+                       root[2] if len(root) > 2 else None) for root in roots]
+        self.manifests_dir = manifests_dir
+        self.max_age_seconds = max_age_seconds
+        self.max_bytes = max_bytes
+        self.grace_seconds = grace_seconds
+        self._lock = threading.Lock()
+        self._in_use = collections.Counter()
+        self._sweep_lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+        self._totals = collections.Counter()
+        self._last_report = None
+        self._last_sweep_at = None
+
+    @contextlib.contextmanager
+    def in_use(self, *paths, prefixes=()):
+        """ Keeps files from being deleted while the `with` block runs.
+
+        Args:
+          *paths: Files, kept if their path is the same, and directories,
+            given with a trailing separator (os.path.join(directory, "")),
+            whose files are all kept.
+          prefixes: Filename prefixes (e.g. the output prefix
+            "<output dir>/<base_name>-" of a PDF). Every file whose path
+            starts with one of them is kept.
+        """
+        # (is_prefix, path) pairs.
+        keys = [(True, os.path.abspath(path) + os.sep)
+                if path.endswith(os.sep) else (False, os.path.abspath(path))
+                for path in paths if path]
+        keys += [(True, os.path.abspath(prefix)) for prefix in prefixes]
+        with self._lock:
+            self._in_use.update(keys)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_use.subtract(keys)
+                for key in keys:
+                    if self._in_use[key] <= 0:
+                        del self._in_use[key]
+
+    def _is_in_use(self, path):
+        with self._lock:
+            return (False, path) in self._in_use or any(
+                is_prefix and path.startswith(prefix)
+                for (is_prefix, prefix) in self._in_use)
+
+    def start(self, interval_seconds=SWEEP_INTERVAL_SECONDS):
+        """ Starts sweeping in a background thread, once. Safe to call again. """
+        if interval_seconds <= 0:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, args=(interval_seconds,),
+                name="storage_janitor", daemon=True)
+        self._thread.start()
+        logging.info(f"Storage janitor started: sweeping every {interval_seconds:g}s.")
+
+    def stop(self):
+        """ Stops the background thread after its current batch. """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self, interval_seconds):
+        while not self._stopped.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.error(f"Storage sweep failed: {e}")
+            self._stopped.wait(interval_seconds)
+
+    def sweep(self, now=None):
+        """ Deletes expired files, then the oldest ones while over the size cap.
+
+        Args:
+          now: The current time.time(), for tests.
+
+        Returns:
+          A SweepReport.
+        """
+        with self._sweep_lock:
+            started = time.monotonic()
+            now = time.time() if now is None else now
+            stored_files = sorted(self._scan(), key=lambda f: f.mtime)
+            kept_outputs = self._manifest_outputs(now)
+
+            def is_protected(stored_file):
+                return (now - stored_file.mtime < self.grace_seconds or
+                        stored_file.path in kept_outputs or
+                        self._is_in_use(stored_file.path))
+
+            scanned_bytes = sum(f.size for f in stored_files)
+            remaining_bytes = scanned_bytes
+            evictions = []
+            protected_files = 0
+            # Oldest first: expired files, then as many more as the cap needs.
+            for stored_file in stored_files:
+                if is_protected(stored_file):
+                    protected_files += 1
+                    continue
+                is_expired = (self.max_age_seconds > 0 and
+                              now - stored_file.mtime > self.max_age_seconds)
+                is_over_cap = self.max_bytes > 0 and remaining_bytes > self.max_bytes
+                if is_expired or is_over_cap:
+                    evictions.append(stored_file)
+                    remaining_bytes -= stored_file.size
+
+            deleted_files, reclaimed_bytes = self._delete(evictions, is_protected)
+            self._remove_empty_directories()
+
+            report = SweepReport(
+                scanned_files=len(stored_files),
+                scanned_bytes=scanned_bytes,
+                deleted_files=deleted_files,
+                reclaimed_bytes=reclaimed_bytes,
+                protected_files=protected_files,
+                remaining_bytes=scanned_bytes - reclaimed_bytes,
+                duration_seconds=round(time.monotonic() - started, 3))
+            with self._lock:
+                self._totals["sweeps"] += 1
+                self._totals["deleted_files"] += deleted_files
+                self._totals["reclaimed_bytes"] += reclaimed_bytes
+                self._last_report = report
+                self._last_sweep_at = now
+            if deleted_files:
+                logging.info(f"Storage sweep: deleted {deleted_files} files, reclaimed {reclaimed_bytes} bytes; {report.remaining_bytes} bytes remain.")
+            if self.max_bytes > 0 and report.remaining_bytes > self.max_bytes:
+                logging.warning(f"Stored files use {report.remaining_bytes} bytes, over the {self.max_bytes} byte cap, but the rest are in use or recent.")
+            return report
+
+    def _scan(self):
+        for (directory, recursive, pattern) in self.roots:
+            yield from _scan_directory(directory, recursive, pattern)
+
+    def _manifest_outputs(self, now):
+        """ Returns the outputs recorded by the run manifests being kept. """
+        outputs = set()
+        if not self.manifests_dir:
+            return outputs
+        for stored_file in _scan_directory(self.manifests_dir, False):
+            if not stored_file.path.endswith(".json"):
+                continue
+            if (self.max_age_seconds > 0 and
+                    now - stored_file.mtime > self.max_age_seconds):
+                continue
+            outputs.update(os.path.abspath(path) for path in
+                           run_manifest.recorded_outputs(stored_file.path))
+        return outputs
+
+    def _delete(self, evictions, is_protected):
+        """ Deletes files in batches, re-checking each one just before. """
+        deleted_files = 0
+        reclaimed_bytes = 0
+        for (i, stored_file) in enumerate(evictions):
+            if i and i % DELETE_BATCH_SIZE == 0:
+                if self._stopped.wait(DELETE_PAUSE_SECONDS):
+                    break
+            try:
+                # Skip files rewritten since the scan, or now in use.
+                if os.stat(stored_file.path).st_mtime != stored_file.mtime:
+                    continue
+                if is_protected(stored_file):
+                    continue
+                os.remove(stored_file.path)
+            except OSError:
+                continue  # Already gone, or not ours to delete.
+            deleted_files += 1
+            reclaimed_bytes += stored_file.size
+        return deleted_files, reclaimed_bytes
+
+    def _remove_empty_directories(self):
+        """ Removes emptied subdirectories (e.g. of batch uploads). """
+        for (directory, recursive, _) in self.roots:
+            if not recursive:
+                continue
+            for (path, _, _) in os.walk(directory, topdown=False):
+                if path == directory or self._is_in_use(path + os.sep):
+                    continue
+                try:
+                    os.rmdir(path)  # Fails unless empty.
+                except OSError:
+                    pass
+
+    def metrics(self):
+        """ Returns the limits, the last sweep's report and running totals. """
+        with self._lock:
+            return {
+                "max_age_seconds": self.max_age_seconds,
+                "max_bytes": self.max_bytes,
+                "last_sweep_at": self._last_sweep_at,
+                "last_sweep": (self._last_report._asdict()
+                               if self._last_report else None),
+                **{name: self._totals[name] for name in (
+                    "sweeps", "deleted_files", "reclaimed_bytes")},
+            }
+
+
+def _scan_directory(directory, recursive, pattern=None):
+    """ Yields the regular files of a directory, without following links,
+    whose name matches `pattern`, if given. """
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            if entry.is_file(follow_symlinks=False):
+                if pattern and not fnmatch.fnmatchcase(entry.name, pattern):
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                yield _StoredFile(os.path.abspath(entry.path), stat.st_size,
+                                  stat.st_mtime)
+            elif recursive and entry.is_dir(follow_symlinks=False):
+                yield from _scan_directory(entry.path, recursive, pattern)
+        except OSError:
+            continue  # Deleted while scanning.
@@ -0,0 +1,125 @@
+import os
+import run_manifest
+import storage_janitor
+import tempfile
+import time
+import unittest
+
+DAY = 24 * 3600
+
+
+class TestStorageJanitor(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.uploads_dir = os.path.join(self.tmp_dir.name, 'uploads')
+        self.output_dir = os.path.join(self.tmp_dir.name, 'output-json')
+        self.runs_dir = os.path.join(self.tmp_dir.name, 'runs')
+        for directory in (self.uploads_dir, self.output_dir, self.runs_dir):
+            os.makedirs(directory)
+        self.now = time.time()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def janitor(self, **limits):
+        return storage_janitor.StorageJanitor(
+            roots=[(self.uploads_dir, True), (self.output_dir, False),
+                   (self.runs_dir, False)],
+            manifests_dir=self.runs_dir, grace_seconds=60, **limits)
+
+    def write(self, directory, name, age_seconds, size=100):
+        path = os.path.join(directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        mtime = self.now - age_seconds
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_age_eviction_keeps_recent_and_in_use_files(self):
+        old = self.write(self.output_dir, 'a-civiform-m.json', 10 * DAY)
+        in_use = self.write(self.output_dir, 'b-civiform-m.json', 10 * DAY)
+        recent = self.write(self.output_dir, 'c-civiform-m.json', 30)
+        batch_upload = self.write(
+            self.uploads_dir, 'batch-1/form.pdf', 10 * DAY)
+        janitor = self.janitor(max_age_seconds=7 * DAY, max_bytes=0)
+
+        with janitor.in_use(prefixes=[os.path.join(self.output_dir, 'b-')]):
+            report = janitor.sweep(now=self.now)
+
+        self.assertEqual(report.deleted_files, 2)
+        self.assertEqual(report.reclaimed_bytes, 200)
+        self.assertEqual(report.protected_files, 2)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(in_use))
+        self.assertTrue(os.path.exists(recent))
+        self.assertFalse(os.path.exists(batch_upload))
+        # The emptied batch directory is removed too.
+        self.assertFalse(os.path.exists(os.path.dirname(batch_upload)))
+        self.assertEqual(janitor.metrics()['reclaimed_bytes'], 200)
+
+    def test_in_use_files_match_exactly_and_directories_by_prefix(self):
+        in_use = self.write(self.uploads_dir, 'a.pdf', 10 * DAY)
+        backup = self.write(self.uploads_dir, 'a.pdf.bak', 10 * DAY)
+        other = self.write(self.uploads_dir, 'ab.pdf', 10 * DAY)
+        batch_upload = self.write(
+            self.uploads_dir, 'batch-1/form.pdf', 10 * DAY)
+        other_batch_upload = self.write(
+            self.uploads_dir, 'batch-10/form.pdf', 10 * DAY)
+        janitor = self.janitor(max_age_seconds=7 * DAY, max_bytes=0)
+
+        with janitor.in_use(in_use, os.path.join(self.uploads_dir, 'a'),
+                            os.path.join(self.uploads_dir, 'batch-1', '')):
+            janitor.sweep(now=self.now)
+
+        self.assertTrue(os.path.exists(in_use))
+        self.assertTrue(os.path.exists(batch_upload))
+        self.assertFalse(os.path.exists(backup))
+        self.assertFalse(os.path.exists(other))
+        self.assertFalse(os.path.exists(other_batch_upload))
+
+    def test_pattern_limits_a_root_to_matching_files(self):
+        extract = self.write(
+            self.tmp_dir.name, 'form-pdf-extract-m.json', 10 * DAY)
+        other = self.write(self.tmp_dir.name, 'notes.txt', 10 * DAY)
+        nested = self.write(
+            self.tmp_dir.name, 'other/form-pdf-extract-m.json', 10 * DAY)
+        janitor = storage_janitor.StorageJanitor(
+            roots=[(self.tmp_dir.name, False, '*-pdf-extract-*.json')],
+            max_age_seconds=7 * DAY, max_bytes=0)
+
+        report = janitor.sweep(now=self.now)
+        self.assertEqual(report.scanned_files, 1)
+        self.assertFalse(os.path.exists(extract))
+        self.assertTrue(os.path.exists(other))
+        self.assertTrue(os.path.exists(nested))
+
+    def test_size_cap_evicts_oldest_first(self):
+        paths = [self.write(self.uploads_dir, f'{age}.pdf', age * DAY)
+                 for age in (1, 2, 3, 4)]
+        report = self.janitor(max_age_seconds=0, max_bytes=250).sweep(
+            now=self.now)
+        self.assertEqual(report.remaining_bytes, 200)
+        self.assertEqual([os.path.exists(path) for path in paths],
+                         [True, True, False, False])
+
+    def test_manifest_outputs_are_kept_with_their_manifest(self):
+        output = self.write(self.output_dir, 'a-civiform-m.json', 10 * DAY)
+        manifest = run_manifest.RunManifest.load(
+            os.path.join(self.runs_dir, 'run.json'))
+        manifest.checkpoint(b'pdf', 'a.pdf').record('civiform', output)
+        janitor = self.janitor(max_age_seconds=7 * DAY, max_bytes=0)
+
+        janitor.sweep(now=self.now)
+        self.assertTrue(os.path.exists(output))
+
+        # Once the manifest expires, so do its outputs.
+        janitor.sweep(now=self.now + 8 * DAY)
+        self.assertFalse(os.path.exists(manifest.path))
+        janitor.sweep(now=self.now + 8 * DAY)
+        self.assertFalse(os.path.exists(output))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+""" Single-pass handling of uploaded PDFs.
+
+An upload is read from the request stream exactly once: it is hashed while
+it is read, and its bytes go straight to the pipeline. Saving a copy under
+uploads/ happens on a background thread, off the request path, instead of
+saving the file and then reading it back.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import hashlib
+import logging
+import os
+
+SPOOL_CHUNK_SIZE = 64 * 1024
+
+# The bytes of an upload, the hex SHA-256 digest of those bytes, and their
+# length.
+SpooledUpload = collections.namedtuple(
+    'SpooledUpload', ['data', 'content_hash', 'size'])
+
+# One writer thread is enough: persisting uploads is not latency sensitive,
+# and it keeps disk writes from competing with each other.
+_upload_writer = ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="upload_writer")
+
+
+def spool_upload(stream):
+    """ Reads an upload stream to the end, hashing it on the way.
+
+    Args:
+      stream: A binary file-like object, e.g. a werkzeug FileStorage.stream.
+
+    Returns:
+      A SpooledUpload.
+    """
+    hasher = hashlib.sha256()
+    chunks = []
+    size = 0
+    while True:
+        chunk = stream.read(SPOOL_CHUNK_SIZE)
+        if not chunk:
+            break
+        hasher.update(chunk)
+        chunks.append(chunk)
+        size += len(chunk)
+    return SpooledUpload(b"".join(chunks), hasher.hexdigest(), size)
+
+
+def _write_file(data, path):
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        logging.debug(f"Upload saved to: {path}")
+    except OSError as e:
+        logging.error(f"Error saving upload to '{path}': {e}")
+        raise
+
+
+def persist_in_background(data, path):
+    """ Saves an upload's bytes to `path` on the background writer thread.
+
+    The file is written under a temporary name and renamed when complete,
+    so readers never see a partial upload.
+
+    Args:
+      data: The bytes to save.
+      path: The destination path.
+
+    Returns:
+      A concurrent.futures.Future that completes when the file is saved.
+    """
+    return _upload_writer.submit(_write_file, data, path)
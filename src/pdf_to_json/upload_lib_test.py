@@ -0,0 +1,28 @@
+import hashlib
+import io
+import os
+import tempfile
+import unittest
+import upload_lib
+
+
+class TestUploadLib(unittest.TestCase):
+
+    def test_spool_hashes_in_one_pass(self):
+        data = os.urandom(3 * upload_lib.SPOOL_CHUNK_SIZE + 17)
+        upload = upload_lib.spool_upload(io.BytesIO(data))
+        self.assertEqual(upload.data, data)
+        self.assertEqual(upload.size, len(data))
+        self.assertEqual(upload.content_hash, hashlib.sha256(data).hexdigest())
+
+    def test_persist_in_background(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'a.pdf')
+            upload_lib.persist_in_background(b'pdf bytes', path).result()
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), b'pdf bytes')
+            self.assertEqual(os.listdir(tmp_dir), ['a.pdf'])
+
+
+if __name__ == '__main__':
+    unittest.main()